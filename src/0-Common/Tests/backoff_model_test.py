@@ -0,0 +1,92 @@
+import unittest
+import random
+import tempfile
+from pathlib import Path
+import numpy as np
+from backoff_model import BackoffModel, map_backoff_model, save_backoff_model
+from model_io import save_binary_model, backoff_path, ArrayModel
+from vocabulary import END
+
+
+def random_models(max_order, seed=0, pitches=range(60, 67)):
+    """{order: model} of random transitions over a few pitches (with some END)."""
+    rng = random.Random(seed)
+    models = {}
+    for order in range(1, max_order + 1):
+        model = {}
+        for _ in range(30):
+            state = tuple(rng.choice(pitches) for _ in range(order))
+            targets = rng.sample(list(pitches) + [END], 3)
+            weights = [rng.random() for _ in targets]
+            model[state] = {t: w / sum(weights) for t, w in zip(targets, weights)}
+        models[order] = model
+    return models
+
+
+class Testbackoff_model(unittest.TestCase):
+    """Unit tests for the backoff table."""
+
+    def setUp(self):
+        """Prepare a temporary directory and random models of orders 1-3."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+        self.models = random_models(3)
+
+    def tearDown(self):
+        """Clean up temporary directory."""
+        self.temp_dir.cleanup()
+
+    def assertSameChains(self, a, b, rows):
+        """Both tables must give the same (token, next row) for every row and draw."""
+        u = np.linspace(0, 0.999, 7)
+        for row in rows:
+            self.assertEqual([a.sample(row, x) for x in u], [b.sample(row, x) for x in u])
+            tokens_a, rows_a = a.sample_rows([row] * len(u), u)
+            tokens_b, rows_b = b.sample_rows([row] * len(u), u)
+            self.assertEqual((tokens_a.tolist(), rows_a.tolist()), (tokens_b.tolist(), rows_b.tolist()))
+
+    def test_lower_orders_match_a_table_built_for_them(self):
+        """Test that for_order(k) of a larger table behaves like a table of orders 1..k."""
+        full = BackoffModel.from_models(self.models)
+        for order in (1, 2):
+            small = BackoffModel.from_models({k: self.models[k] for k in range(1, order + 1)})
+            view = full.for_order(order)
+            seeds = [list(s) for s in self.models[3]]
+            self.assertEqual(view.start_rows(seeds).tolist(), small.start_rows(seeds).tolist())
+            self.assertSameChains(view, small, range(len(small.offsets) - 1))
+
+    def test_saved_table_is_mapped_as_int32_and_float32(self):
+        """Test that a saved table maps back without copies and samples the same chains."""
+        table = BackoffModel.from_models(self.models)
+        table.save(self.temp_path / "backoff.bin")
+        mapped = map_backoff_model(self.temp_path / "backoff.bin")
+
+        self.assertEqual((mapped.tokens.dtype, mapped.next_rows.dtype, mapped.cumulative.dtype),
+                         (np.dtype("<i4"), np.dtype("<i4"), np.dtype("<f4")))
+        self.assertFalse(mapped.next_rows.flags.owndata)
+        self.assertSameChains(mapped.for_order(2), table.for_order(2), range(len(table.offsets) - 1))
+
+    def test_built_from_detects_other_models(self):
+        """Test that a table only claims the models it was built from."""
+        table = BackoffModel.from_models(self.models)
+        arrays = [ArrayModel.from_dict(self.models[k]) for k in (1, 2)]
+        self.assertTrue(table.built_from(arrays))
+        self.assertFalse(table.built_from([ArrayModel.from_dict(random_models(1, seed=1)[1])]))
+        self.assertFalse(table.built_from(arrays + [arrays[1], arrays[1]]))
+
+    def test_save_backoff_model_uses_the_models_of_a_directory(self):
+        """Test that the table saved next to the models covers every order found there."""
+        for order, model in self.models.items():
+            save_binary_model(model, self.temp_path / f"markov_order{order}.bin")
+        path = save_backoff_model(self.temp_path)
+
+        self.assertEqual(path, backoff_path(self.temp_path))
+        mapped = map_backoff_model(path)
+        self.assertEqual(mapped.max_order, 3)
+        self.assertTrue(mapped.built_from([ArrayModel.from_dict(self.models[k]) for k in (1, 2, 3)]))
+
+    def test_map_backoff_model_rejects_model_files(self):
+        """Test that a model file is not mistaken for a backoff table."""
+        save_binary_model(self.models[1], self.temp_path / "model.bin")
+        with self.assertRaises(ValueError):
+            map_backoff_model(self.temp_path / "model.bin")
@@ -0,0 +1,79 @@
+import unittest
+import json
+import tempfile
+import numpy as np
+from pathlib import Path
+from corpus import write_corpus, Corpus, convert_token_directory, is_corpus
+from vocabulary import END
+
+
+class Testcorpus(unittest.TestCase):
+    """Unit tests for the consolidated token corpus."""
+
+    def setUp(self):
+        """Prepare a temporary directory."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        """Clean up temporary directory."""
+        self.temp_dir.cleanup()
+
+    def test_write_and_read_round_trip(self):
+        """Test that written sequences and metadata are read back in order."""
+        sequences = [[60, 62, END], [64, END], [67, 65, 64, END]]
+        write_corpus(self.temp_path / "train", sequences, [{"title": "a"}, {"title": "b"}, {"title": "c"}])
+        corpus = Corpus(self.temp_path / "train")
+
+        self.assertEqual(len(corpus), 3)
+        self.assertEqual([seq.tolist() for seq in corpus], sequences)
+        self.assertEqual(corpus[-1].tolist(), sequences[-1])
+        self.assertEqual(corpus.metadata[1], {"title": "b"})
+        self.assertEqual(corpus.lengths().tolist(), [3, 2, 4])
+
+    def test_tokens_use_compact_dtype_and_are_memory_mapped(self):
+        """Test that pitch tokens are stored as uint8 and mapped read-only."""
+        write_corpus(self.temp_path / "c", [[60, END]])
+        corpus = Corpus(self.temp_path / "c")
+        self.assertEqual(corpus.tokens.dtype, np.uint8)
+        self.assertIsInstance(corpus.tokens, np.memmap)
+
+    def test_large_ids_use_wider_dtype(self):
+        """Test that ids above 255 are stored without overflow."""
+        write_corpus(self.temp_path / "c", [[300, 1]])
+        self.assertEqual(Corpus(self.temp_path / "c")[0].tolist(), [300, 1])
+
+    def test_write_rejects_mismatched_metadata(self):
+        """Test that metadata must have one record per sequence."""
+        with self.assertRaises(ValueError):
+            write_corpus(self.temp_path / "c", [[1], [2]], [{}])
+
+    def test_index_out_of_range_raises(self):
+        """Test that indexing past the end raises IndexError."""
+        write_corpus(self.temp_path / "c", [[1]])
+        with self.assertRaises(IndexError):
+            Corpus(self.temp_path / "c")[1]
+
+    def test_missing_corpus_raises(self):
+        """Test that opening a directory without a corpus raises FileNotFoundError."""
+        self.assertFalse(is_corpus(self.temp_path))
+        with self.assertRaises(FileNotFoundError):
+            Corpus(self.temp_path)
+
+    def test_convert_token_directory(self):
+        """Test conversion from the one-JSON-per-piece layout."""
+        src = self.temp_path / "json"
+        src.mkdir()
+        (src / "a.json").write_text(json.dumps({"metadata": {"title": "A"}, "tokens": ["NOTE_60", "END"]}))
+        (src / "b.json").write_text(json.dumps({"metadata": {"title": "B"}, "tokens": [62, END]}))
+        (src / "c.json").write_text(json.dumps({"metadata": {}, "tokens": []}))
+        (src / "d.json").write_text("not json")
+
+        corpus = convert_token_directory(src, self.temp_path / "corpus")
+        self.assertEqual([seq.tolist() for seq in corpus], [[60, END], [62, END]])
+        self.assertEqual([m["title"] for m in corpus.metadata], ["A", "B"])
+
+    def test_empty_corpus(self):
+        """Test that a corpus without sequences can be written and opened."""
+        write_corpus(self.temp_path / "empty", [])
+        self.assertEqual(len(Corpus(self.temp_path / "empty")), 0)
@@ -0,0 +1,242 @@
+import unittest
+import json
+import tempfile
+from pathlib import Path
+from vocabulary import END
+from model_io import (save_binary_model, load_model, export_json, model_path, read_arrays, write_arrays, pack_states,
+                      unpack_states, model_to_arrays, model_fingerprint, MappedModel, ArrayModel, cumulative_probs,
+                      bisect_rows)
+
+
+class Testmodel_io(unittest.TestCase):
+    """Unit tests for the binary model format."""
+
+    def setUp(self):
+        """Prepare a temporary directory and a small order-2 model."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+        self.model = {
+            ("NOTE_60", "NOTE_62"): {"NOTE_64": 0.75, "END": 0.25},
+            ("NOTE_62", "NOTE_64"): {"NOTE_60": 1.0},
+        }
+
+    def tearDown(self):
+        """Clean up temporary directory."""
+        self.temp_dir.cleanup()
+
+    # save_binary_model / load_model
+
+    def test_binary_round_trip_preserves_model(self):
+        """Test that a model saved in binary loads back with the same states and probabilities."""
+        path = self.temp_path / "model.bin"
+        save_binary_model(self.model, path)
+        loaded = load_model(path)
+
+        self.assertEqual(set(loaded), set(self.model))
+        for state, transitions in self.model.items():
+            self.assertEqual(set(loaded[state]), set(transitions))
+            for token, prob in transitions.items():
+                self.assertAlmostEqual(loaded[state][token], prob, places=6)
+
+    def test_binary_round_trip_with_integer_tokens(self):
+        """Test that integer tokens keep their type through the vocabulary."""
+        path = self.temp_path / "model.bin"
+        save_binary_model({(1,): {2: 1.0}, (2,): {1: 0.5, 3: 0.5}}, path)
+        loaded = load_model(path)
+        self.assertEqual(set(loaded), {(1,), (2,)})
+        self.assertAlmostEqual(loaded[(2,)][3], 0.5)
+
+    def test_binary_round_trip_empty_model(self):
+        """Test that an empty model can be saved and loaded."""
+        path = self.temp_path / "empty.bin"
+        save_binary_model({}, path)
+        self.assertEqual(load_model(path), {})
+
+    def test_save_binary_model_rejects_mixed_state_lengths(self):
+        """Test that states of different lengths raise ValueError."""
+        with self.assertRaises(ValueError):
+            save_binary_model({("A",): {"B": 1.0}, ("A", "B"): {"C": 1.0}}, self.temp_path / "m.bin")
+
+    def test_save_binary_model_creates_parent_directories(self):
+        """Test that nested output folders are created."""
+        path = self.temp_path / "nested" / "deep" / "model.bin"
+        save_binary_model(self.model, path)
+        self.assertTrue(path.exists())
+
+    def test_binary_file_is_smaller_than_json_export(self):
+        """Test that the binary format is more compact than the JSON export."""
+        model = {(f"NOTE_{a}",): {f"NOTE_{b}": 1 / 40 for b in range(40, 80)} for a in range(40, 80)}
+        save_binary_model(model, self.temp_path / "m.bin")
+        export_json(model, self.temp_path / "m.json")
+        self.assertLess((self.temp_path / "m.bin").stat().st_size, (self.temp_path / "m.json").stat().st_size)
+
+    # MappedModel
+
+    def test_mapped_model_answers_lookups_like_dict(self):
+        """Test that a memory-mapped model returns the same transitions as the dict loader."""
+        path = self.temp_path / "model.bin"
+        save_binary_model(self.model, path)
+        mapped = load_model(path, mapped=True)
+        try:
+            self.assertIsInstance(mapped, MappedModel)
+            self.assertEqual(len(mapped), 2)
+            self.assertEqual(set(mapped), set(self.model))
+            self.assertIn(("NOTE_60", "NOTE_62"), mapped)
+            self.assertAlmostEqual(mapped[("NOTE_60", "NOTE_62")]["NOTE_64"], 0.75)
+        finally:
+            mapped.close()
+
+    def test_cumulative_probs_restart_per_row(self):
+        """Test that cumulative probabilities restart at every state and end at 1."""
+        cumulative = cumulative_probs([0, 2, 2, 5], [0.75, 0.25, 0.2, 0.0, 0.6])
+        self.assertEqual(cumulative.tolist()[:2], [0.75, 1.0])
+        self.assertEqual([round(c, 6) for c in cumulative.tolist()[2:]], [0.25, 0.25, 1.0])
+
+    def test_array_model_sample_follows_cumulative_probabilities(self):
+        """Test that sample() maps uniform draws onto the transition probabilities."""
+        model = ArrayModel.from_dict({(60,): {62: 0.5, 64: 0.0, 67: 0.5}, (62,): {END: 1.0}})
+        self.assertEqual(model[(60,)], {62: 0.5, 64: 0.0, 67: 0.5})
+        self.assertEqual([model.sample((60,), u) for u in (0.0, 0.49, 0.5, 0.999, 1 - 1e-12)], [62, 62, 67, 67, 67])
+        self.assertEqual(model.sample((62,), 0.7), END)
+        self.assertIsNone(model.sample((61,), 0.5))
+
+    def test_array_model_vectorized_lookup_and_sampling(self):
+        """Test that find_rows and sample_rows agree with row() and sample()."""
+        model = ArrayModel.from_dict({(60, 62): {64: 0.25, 65: 0.75}, (62, 64): {60: 1.0}, (62, 65): {}})
+        states = [(60, 62), (62, 64), (64, 60), (62, 65)]
+        ids = model.token_ids([t for state in states for t in state]).reshape(-1, 2)
+        rows = model.find_rows(ids)
+        self.assertEqual(rows.tolist()[:3], [model.row(s) for s in states[:3]])
+        self.assertEqual(rows[3], -1)  # no transitions
+
+        u = [0.2, 0.9]
+        next_ids = model.sample_rows(rows[:2], u)
+        self.assertEqual([model.vocab[i] for i in next_ids], [model.sample(s, x) for s, x in zip(states, u)])
+
+    def test_bisect_rows_matches_bisect_per_row(self):
+        """Test that bisect_rows finds the same index as a search within each row."""
+        import bisect
+        cumulative = cumulative_probs([0, 3, 4, 9], [0.2, 0.3, 0.5, 1.0, 0.1, 0.1, 0.2, 0.3, 0.3])
+        starts, ends = [0, 3, 4, 4, 0], [3, 4, 9, 9, 3]
+        u = [0.5, 0.99, 0.0, 0.45, 0.2]
+        values = cumulative.tolist()  # compared in float64, like bisect_rows
+        expected = [bisect.bisect_right(values, x, lo, hi) for x, lo, hi in zip(u, starts, ends)]
+        self.assertEqual(bisect_rows(cumulative, starts, ends, u).tolist(), expected)
+
+    def test_mapped_model_maps_stored_cumulative_probabilities(self):
+        """Test that the cumulative probabilities are read from the file, not rebuilt."""
+        path = self.temp_path / "model.bin"
+        save_binary_model(self.model, path)
+        mapped = MappedModel(path)
+        try:
+            self.assertEqual(mapped.cumulative.dtype, "float32")
+            self.assertFalse(mapped.cumulative.flags.owndata)
+            self.assertEqual(mapped.sample(("NOTE_60", "NOTE_62"), 0.1), "END")
+        finally:
+            mapped.close()
+
+    def test_fingerprint_is_stored_in_the_header(self):
+        """Test that a saved model carries its fingerprint, so comparing it reads no arrays."""
+        path = self.temp_path / "model.bin"
+        save_binary_model(self.model, path)
+        with open(path, "rb") as f:
+            header, arrays = read_arrays(f.read())
+
+        expected = ArrayModel.from_dict(self.model).fingerprint
+        self.assertEqual(header["fingerprint"], expected)
+        self.assertEqual(model_fingerprint(header["vocab"], arrays["state_keys"], arrays["offsets"],
+                                           arrays["next_ids"], arrays["probs"]), expected)
+        mapped = MappedModel(path)
+        try:
+            mapped.state_keys = mapped.probs = None  # the arrays are not needed
+            self.assertEqual(mapped.fingerprint, expected)
+        finally:
+            mapped.close()
+
+    def test_version_1_files_without_cumulative_still_sample(self):
+        """Test that model files written before the cumulative array are still usable."""
+        order, vocab, arrays = model_to_arrays(self.model)
+        path = self.temp_path / "old.bin"
+        write_arrays(path, {"order": order, "vocab": vocab}, arrays)
+        data = bytearray(path.read_bytes())
+        data[4:6] = (1).to_bytes(2, "little")
+        path.write_bytes(bytes(data))
+
+        mapped = MappedModel(path)
+        try:
+            self.assertEqual(mapped.cumulative.tolist(), [0.25, 1.0, 1.0])
+            self.assertEqual(mapped.sample(("NOTE_60", "NOTE_62"), 0.5), "NOTE_64")
+        finally:
+            mapped.close()
+
+    def test_mapped_model_unknown_states(self):
+        """Test that unknown states, unknown tokens and wrong lengths are reported as missing."""
+        path = self.temp_path / "model.bin"
+        save_binary_model(self.model, path)
+        mapped = MappedModel(path)
+        try:
+            self.assertNotIn(("NOTE_64", "NOTE_60"), mapped)
+            self.assertNotIn(("NOTE_99", "NOTE_60"), mapped)
+            self.assertNotIn(("NOTE_60",), mapped)
+            self.assertIsNone(mapped.get(("NOTE_64", "NOTE_60")))
+            with self.assertRaises(KeyError):
+                mapped[("NOTE_64", "NOTE_60")]
+        finally:
+            mapped.close()
+
+    def test_mapped_model_rejects_empty_file(self):
+        """Test that an empty file raises ValueError instead of failing inside mmap."""
+        path = self.temp_path / "empty.bin"
+        path.write_bytes(b"")
+        with self.assertRaises(ValueError):
+            MappedModel(path)
+
+    # read_arrays
+
+    def test_read_arrays_rejects_bad_magic(self):
+        """Test that a file without the magic number raises ValueError."""
+        with self.assertRaises(ValueError):
+            read_arrays(b"NOPE" + b"\0" * 32)
+
+    def test_read_arrays_rejects_newer_version(self):
+        """Test that files from a newer format version are refused."""
+        path = self.temp_path / "model.bin"
+        save_binary_model(self.model, path)
+        data = bytearray(path.read_bytes())
+        data[4:6] = (999).to_bytes(2, "little")
+        with self.assertRaises(ValueError):
+            read_arrays(bytes(data))
+
+    # pack_states / unpack_states
+
+    def test_pack_and_unpack_states_are_inverse(self):
+        """Test that packed state keys unpack to the original ids."""
+        ids = [[0, 1, 2], [2, 2, 2], [1, 0, 0]]
+        keys = pack_states(ids, 3)
+        self.assertEqual(unpack_states(keys, 3, 3).tolist(), ids)
+
+    # JSON export / legacy loading
+
+    def test_json_export_is_loadable(self):
+        """Test that a JSON export keeps token strings and loads back as integer ids."""
+        path = self.temp_path / "model.json"
+        export_json(self.model, path)
+        self.assertIn("NOTE_60,NOTE_62", json.loads(path.read_text()))
+        self.assertEqual(load_model(path), {
+            (60, 62): {64: 0.75, END: 0.25},
+            (62, 64): {60: 1.0},
+        })
+
+    def test_json_export_renders_integer_states(self):
+        """Test that integer-id models are rendered as token strings in JSON."""
+        path = self.temp_path / "model.json"
+        export_json({(60,): {END: 1.0}}, path)
+        self.assertEqual(json.loads(path.read_text()), {"NOTE_60": {"END": 1.0}})
+
+    def test_model_path_falls_back_to_json(self):
+        """Test that model_path prefers .bin but falls back to an existing .json."""
+        self.assertEqual(model_path(2, self.temp_path).suffix, ".bin")
+        (self.temp_path / "markov_order2.json").write_text("{}")
+        self.assertEqual(model_path(2, self.temp_path).suffix, ".json")
+        (self.temp_path / "markov_order2.bin").write_bytes(b"")
+        self.assertEqual(model_path(2, self.temp_path).suffix, ".bin")
@@ -0,0 +1,78 @@
+import unittest
+import json
+import tempfile
+import threading
+from pathlib import Path
+import numpy as np
+from sequence_loader import iter_sequences, load_sequences, prefetch
+from corpus import write_corpus
+from vocabulary import END
+
+
+class Testsequence_loader(unittest.TestCase):
+    """Unit tests for the shared sequence loader."""
+
+    def setUp(self):
+        """Prepare a temporary directory."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        """Clean up temporary directory."""
+        self.temp_dir.cleanup()
+
+    def test_missing_root_raises_before_iteration(self):
+        """Test that a missing split raises FileNotFoundError when the stream is created."""
+        with self.assertRaises(FileNotFoundError):
+            iter_sequences(self.temp_path / "missing", "Train folder")
+
+    def test_json_directory_is_streamed_and_encoded(self):
+        """Test that JSON pieces are yielded as id lists and bad files are skipped."""
+        (self.temp_path / "a.json").write_text(json.dumps({"tokens": ["NOTE_60", "END"]}))
+        (self.temp_path / "b.json").write_text(json.dumps({"no_tokens": []}))
+        (self.temp_path / "c.json").write_text("broken")
+
+        stream = iter_sequences(self.temp_path)
+        self.assertEqual(list(stream), [[60, END]])
+
+    def test_corpus_is_streamed_as_lists_or_arrays(self):
+        """Test that corpus pieces come out as lists by default and as arrays on request."""
+        write_corpus(self.temp_path / "train", [[60, END], [62, 64, END]])
+
+        self.assertEqual(load_sequences(self.temp_path / "train"), [[60, END], [62, 64, END]])
+        arrays = list(iter_sequences(self.temp_path / "train", as_arrays=True))
+        self.assertIsInstance(arrays[0], np.ndarray)
+        self.assertEqual(arrays[1].tolist(), [62, 64, END])
+
+    def test_prefetch_preserves_order(self):
+        """Test that prefetching yields every item in order."""
+        self.assertEqual(list(prefetch(iter(range(100)), size=3)), list(range(100)))
+
+    def test_prefetch_propagates_errors(self):
+        """Test that an error raised by the producer reaches the consumer."""
+        def failing():
+            yield 1
+            raise RuntimeError("boom")
+
+        stream = prefetch(failing())
+        self.assertEqual(next(stream), 1)
+        with self.assertRaises(RuntimeError):
+            next(stream)
+
+    def test_prefetch_stops_producer_when_consumer_stops(self):
+        """Test that abandoning the stream stops the reader thread and closes the source."""
+        closed = threading.Event()
+
+        def source():
+            try:
+                for i in range(1000):
+                    yield i
+            finally:
+                closed.set()
+
+        stream = prefetch(source(), size=2, poll_interval=0.01)
+        for item in stream:
+            if item == 5:
+                break
+        stream.close()
+        self.assertTrue(closed.wait(timeout=2))
@@ -0,0 +1,85 @@
+import unittest
+import numpy as np
+from vocabulary import (encode, decode, encode_sequence, decode_sequence, to_array, is_pitch, END, VOCAB_SIZE,
+                        TOKEN_DTYPE, timed_note, rest, pitch_of, duration_of, transpose, transpose_ids,
+                        fold_pitches)
+
+
+class Testvocabulary(unittest.TestCase):
+    """Unit tests for the token vocabulary."""
+
+    def test_encode_note_string_is_midi_pitch(self):
+        """Test that NOTE_<pitch> encodes to the MIDI pitch itself."""
+        self.assertEqual(encode("NOTE_60"), 60)
+        self.assertEqual(encode("NOTE_0"), 0)
+        self.assertEqual(encode("NOTE_127"), 127)
+
+    def test_encode_end_token(self):
+        """Test that END encodes to the END id, outside the pitch range."""
+        self.assertEqual(encode("END"), END)
+        self.assertFalse(is_pitch(END))
+
+    def test_encode_passes_through_ids(self):
+        """Test that integer ids (including NumPy integers) are returned unchanged."""
+        self.assertEqual(encode(64), 64)
+        self.assertEqual(encode(np.int16(64)), 64)
+
+    def test_encode_rejects_unknown_tokens(self):
+        """Test that malformed tokens and out-of-range ids raise ValueError."""
+        for bad in ["REST", "NOTE_128", "NOTE_-1", VOCAB_SIZE, -1]:
+            with self.assertRaises(ValueError):
+                encode(bad)
+
+    def test_decode_renders_strings(self):
+        """Test that ids are rendered back into token strings."""
+        self.assertEqual(decode(60), "NOTE_60")
+        self.assertEqual(decode(END), "END")
+        self.assertEqual(decode("NOTE_61"), "NOTE_61")
+
+    def test_decode_rejects_out_of_range_ids(self):
+        """Test that decode raises ValueError for unknown ids."""
+        with self.assertRaises(ValueError):
+            decode(VOCAB_SIZE)
+
+    def test_sequence_round_trip(self):
+        """Test that encode_sequence and decode_sequence are inverse."""
+        tokens = ["NOTE_60", "NOTE_62", "END"]
+        self.assertEqual(decode_sequence(encode_sequence(tokens)), tokens)
+
+    def test_to_array_uses_compact_dtype(self):
+        """Test that to_array produces a compact integer array."""
+        arr = to_array(["NOTE_60", "END"])
+        self.assertEqual(arr.dtype, TOKEN_DTYPE)
+        self.assertEqual(arr.tolist(), [60, END])
+
+    def test_timed_tokens_round_trip(self):
+        """Test that timed notes and rests encode and decode with their durations."""
+        tokens = ["NOTE_60_1/2", "REST_3/2", "NOTE_127_4", "NOTE_0_1/3"]
+        self.assertEqual(decode_sequence(encode_sequence(tokens)), tokens)
+        self.assertTrue(all(END < t < VOCAB_SIZE for t in encode_sequence(tokens)))
+        for bad in ["NOTE_60_5/7", "REST_", "NOTE_128_1"]:
+            with self.assertRaises(ValueError):
+                encode(bad)
+
+    def test_timed_note_quantizes_duration(self):
+        """Test that durations snap to the closest duration class."""
+        self.assertEqual(decode(timed_note(64, 0.49)), "NOTE_64_1/2")
+        self.assertEqual(decode(rest(9.0)), "REST_4")
+        self.assertEqual((pitch_of(timed_note(64, 0.49)), duration_of(timed_note(64, 0.49))), (64, 0.5))
+        self.assertEqual((pitch_of(60), duration_of(60), duration_of(END)), (60, 1.0, 0.0))
+        self.assertIsNone(pitch_of(rest(1)))
+
+    def test_transpose_keeps_durations(self):
+        """Test that transposition moves pitches of timed notes and leaves rests and END."""
+        ids = [60, timed_note(60, 1.5), rest(1), END]
+        expected = [62, timed_note(62, 1.5), rest(1), END]
+        self.assertEqual([transpose(t, 2) for t in ids], expected)
+        self.assertEqual(transpose_ids(ids, 2).tolist(), expected)
+
+    def test_transpose_folds_pitches_out_of_range(self):
+        """Test that pitches pushed past 0-127 move back by octaves, or are clamped on request."""
+        self.assertEqual(fold_pitches([-1, -13, 128, 140, 64]).tolist(), [11, 11, 116, 116, 64])
+        self.assertEqual(fold_pitches([-1, 130], fold=False).tolist(), [0, 127])
+        self.assertEqual(transpose_ids([[125, timed_note(125, 2)], [END, 3]], 5).tolist(),
+                         [[118, timed_note(118, 2)], [END, 8]])
+        self.assertEqual(transpose(2, -5, fold=False), 0)
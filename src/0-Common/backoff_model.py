@@ -0,0 +1,242 @@
+import bisect
+import mmap
+from pathlib import Path
+
+import numpy as np
+
+import vocabulary
+from model_io import (ArrayModel, MODELS_DIR, backoff_path, bisect_rows, cumulative_probs, load_model,
+                      model_path, pack_states, read_arrays, unpack_states, write_arrays, scalar_view)
+
+# Backoff table layout (same binary container as the models):
+#   header -> kind "backoff", max_order, and for each order k = 1..max_order:
+#             vocabs[k - 1]        token ids of the order-k model's vocabulary
+#             row_base[k - 1]      row of its first state in the table
+#             fingerprints[k - 1]  model_fingerprint of the model the rows were built from
+#   data   -> offsets (i8)               transitions of row r: offsets[r]:offsets[r + 1]
+#             tokens (i4)                token id of each transition (END left out)
+#             cumulative (f4)            running sum of probabilities within each row
+#             next_rows (i4)             row of the longest known suffix of state + token
+#             state_keys_<k> (i8)        packed states of order k, sorted
+#             capped_next_rows_<k> (i4)  next_rows of the order-k transitions when
+#                                        k is the highest order used (k < max_order)
+
+
+class BackoffModel:
+    """
+    Markov models of orders 1..max_order sampled as one chain.
+    Every context is a row of one flat CSR table: row 0 is the unigram
+    distribution, followed by the states of each order. Next to each
+    transition's token the row of the longest known suffix of
+    (state + token) is precomputed, so a step is one bisect and no state
+    lookups: unseen contexts back off to shorter ones for free.
+    END transitions are left out, so chains always reach the requested length.
+
+    One table serves every order up to max_order (see for_order). It is
+    saved at training time and memory-mapped by the generator (map_backoff_model).
+    """
+
+    def __init__(self, header, arrays, order=None):
+        self.max_order = header["max_order"]
+        self.order = order or self.max_order
+        if not 1 <= self.order <= self.max_order:
+            raise ValueError(f"Order {self.order} is not in the table (1..{self.max_order})")
+
+        self._header = header
+        self._arrays = arrays
+        self.vocab = header["vocabs"][0]
+        self.fingerprints = header["fingerprints"]
+        self.offsets = arrays["offsets"]
+        self.tokens = arrays["tokens"]
+        self.cumulative = arrays["cumulative"]
+        self.next_rows = arrays.get("next_rows")
+
+        # token id -> vocabulary index in the model of each order (-1: never seen)
+        self._state_keys = [arrays[f"state_keys_{k}"] for k in range(1, self.max_order + 1)]
+        self._lookups = []
+        for vocab in header["vocabs"]:
+            lookup = np.full(vocabulary.VOCAB_SIZE, -1, dtype=np.int32)
+            lookup[np.asarray(vocab, dtype=np.int64)] = np.arange(len(vocab))
+            self._lookups.append(lookup)
+
+        # Below max_order the transitions of the highest order in use take
+        # their next row from capped_next_rows (contexts one token shorter)
+        self._capped = None
+        if self.order < self.max_order:
+            first = header["row_base"][self.order - 1]
+            last = first + len(self._state_keys[self.order - 1])
+            self._capped = (int(self.offsets[first]), int(self.offsets[last]),
+                            arrays[f"capped_next_rows_{self.order}"])
+
+        # sample() bisects memoryviews (plain Python numbers, see ArrayModel)
+        self._views = None
+
+    @classmethod
+    def from_models(cls, models):
+        """Build the table in memory from {order: ArrayModel or dict} for every order 1..n."""
+        orders = sorted(models)
+        if not orders or orders != list(range(1, len(orders) + 1)):
+            raise ValueError(f"Backoff needs the models of orders 1..n, got {orders}")
+        max_order = orders[-1]
+        models = [m if isinstance(m, ArrayModel) else ArrayModel.from_dict(m)
+                  for m in (models[k] for k in orders)]
+        vocabs = [np.array(vocabulary.encode_sequence(m.vocab), dtype=np.int64) for m in models]
+
+        # Unigram row, then the rows of orders 1..max_order. The context after
+        # each transition is resolved once every row is numbered.
+        src, tokens, probs = cls._transitions(models[0], vocabs[0])
+        tokens, probs = cls._unigram(tokens, probs)
+        row_counts, all_tokens, all_probs, contexts = [[len(tokens)]], [tokens], [probs], [tokens[:, None]]
+
+        row_base = []
+        base = 1
+        for k, model in enumerate(models, start=1):
+            src, tokens, probs = cls._transitions(model, vocabs[k - 1])
+            row_counts.append(np.bincount(src, minlength=len(model.state_keys)))
+            row_base.append(base)
+            base += len(model.state_keys)
+
+            states = vocabs[k - 1][unpack_states(model.state_keys, max(len(model.vocab), 1), k)]
+            contexts.append(np.hstack([states[src], tokens[:, None]]))
+            all_tokens.append(tokens)
+            all_probs.append(probs)
+
+        offsets = np.concatenate([[0], np.cumsum(np.concatenate(row_counts))]).astype("<i8")
+        header = {
+            "kind": "backoff",
+            "max_order": max_order,
+            "vocabs": [v.tolist() for v in vocabs],
+            "row_base": row_base,
+            "fingerprints": [m.fingerprint for m in models],
+        }
+        arrays = {
+            "offsets": offsets,
+            "tokens": np.concatenate(all_tokens).astype("<i4"),
+            "cumulative": cumulative_probs(offsets, np.concatenate(all_probs)).astype("<f4"),
+        }
+        for k, model in enumerate(models, start=1):
+            arrays[f"state_keys_{k}"] = np.asarray(model.state_keys).astype("<i8")
+
+        table = cls(header, arrays)
+        arrays["next_rows"] = np.concatenate(
+            [table._suffix_rows(c[:, -max_order:], max_order) for c in contexts]).astype("<i4")
+        for k in range(1, max_order):
+            arrays[f"capped_next_rows_{k}"] = table._suffix_rows(contexts[k][:, -k:], k).astype("<i4")
+        return cls(header, arrays)
+
+    @staticmethod
+    def _transitions(model, vocab_tokens):
+        """(source row, token id, probability) of the model's non-END transitions."""
+        offsets = np.asarray(model.offsets, dtype=np.int64)
+        src = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        tokens = vocab_tokens[np.asarray(model.next_ids, dtype=np.int64)]
+        probs = np.asarray(model.probs, dtype=np.float64)
+        keep = tokens != vocabulary.END
+        return src[keep], tokens[keep], probs[keep]
+
+    @staticmethod
+    def _unigram(tokens, probs):
+        """Last-resort distribution: order-1 transition probabilities summed per token."""
+        weights = np.bincount(tokens, weights=probs, minlength=vocabulary.VOCAB_SIZE)
+        support = np.flatnonzero(weights > 0)
+        if len(support) == 0:
+            raise ValueError("The order-1 model has no transitions besides END")
+        return support, weights[support]
+
+    def for_order(self, order):
+        """The same table restricted to orders 1..order (shares the arrays)."""
+        return BackoffModel(self._header, self._arrays, order)
+
+    def built_from(self, models):
+        """
+        True if the rows of orders 1..len(models) were built from exactly these
+        models (compares the fingerprints stored in the model headers).
+        """
+        return (len(models) <= self.max_order
+                and all(m.fingerprint == f for m, f in zip(models, self.fingerprints)))
+
+    def save(self, path):
+        """Write the table in the binary container used for models."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_arrays(path, self._header, self._arrays)
+
+    def _suffix_rows(self, contexts, max_order):
+        """Row of the longest known suffix (up to max_order tokens) of each context, 0 if none."""
+        rows = np.zeros(len(contexts), dtype=np.int64)
+        for k in range(1, min(contexts.shape[1], max_order) + 1):
+            state_keys = self._state_keys[k - 1]
+            if len(state_keys) == 0:
+                continue
+            ids = self._lookups[k - 1][contexts[:, -k:]]
+            keys = pack_states(ids, max(len(self._header["vocabs"][k - 1]), 1))
+            found = np.minimum(np.searchsorted(state_keys, keys), len(state_keys) - 1)
+            known = (ids >= 0).all(axis=1) & (state_keys[found] == keys)
+            row = self._header["row_base"][k - 1] + found
+            known &= self.offsets[row + 1] > self.offsets[row]  # states with only END
+            rows[known] = row[known]
+        return rows
+
+    def start_rows(self, states):
+        """Context rows of seeds given as an (n, length) array of token ids."""
+        return self._suffix_rows(np.asarray(states, dtype=np.int64).reshape(len(states), -1), self.order)
+
+    def start_row(self, state):
+        """Context row of one seed (token ids): its longest known suffix."""
+        return int(self.start_rows([state])[0])
+
+    def sample(self, row, u):
+        """(token, next context row) for a uniform draw u in [0, 1)."""
+        if self._views is None:
+            self._views = tuple(scalar_view(a) for a in (self.offsets, self.cumulative, self.tokens, self.next_rows))
+        offsets, cumulative, tokens, next_rows = self._views
+
+        start, end = offsets[row], offsets[row + 1]
+        j = min(bisect.bisect_right(cumulative, u, start, end), end - 1)
+        next_row = next_rows[j]
+        if self._capped is not None and self._capped[0] <= j < self._capped[1]:
+            next_row = self._capped[2][j - self._capped[0]]
+        return int(tokens[j]), int(next_row)
+
+    def sample_rows(self, rows, u):
+        """Vectorized sample(): (tokens, next rows) for arrays of rows and draws."""
+        rows = np.asarray(rows, dtype=np.int64)
+        j = bisect_rows(self.cumulative, self.offsets[rows], self.offsets[rows + 1], u)
+        next_rows = self.next_rows[j].astype(np.int64)
+        if self._capped is not None:
+            first, last, capped = self._capped
+            top = (j >= first) & (j < last)
+            if top.any():
+                next_rows[top] = capped[j[top] - first]
+        return self.tokens[j].astype(np.int64), next_rows
+
+
+def map_backoff_model(path):
+    """Memory-map a backoff table saved with BackoffModel.save()."""
+    path = Path(path)
+    with open(path, "rb") as f:
+        if path.stat().st_size == 0:
+            raise ValueError(f"Empty backoff file: {path}")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header, arrays = read_arrays(buffer)  # the arrays keep the mapping alive
+    if header.get("kind") != "backoff":
+        raise ValueError(f"Not a backoff table: {path}")
+    return BackoffModel(header, arrays)
+
+
+def save_backoff_model(models_dir=MODELS_DIR):
+    """
+    Build the backoff table from the models of orders 1, 2, ... found in
+    `models_dir` (stopping at the first missing order) and save it there.
+    """
+    models = {}
+    while model_path(len(models) + 1, models_dir).exists():
+        model = load_model(model_path(len(models) + 1, models_dir), mapped=True)
+        models[len(models) + 1] = model if isinstance(model, ArrayModel) else ArrayModel.from_dict(model)
+    if not models:
+        raise FileNotFoundError(f"No models found in {models_dir}")
+
+    path = backoff_path(models_dir)
+    BackoffModel.from_models(models).save(path)
+    return path
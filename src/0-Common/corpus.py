@@ -0,0 +1,125 @@
+import json
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+import vocabulary
+
+# Consolidated token corpus, one directory per split:
+#   tokens.npy     -> every token id of every piece, concatenated (uint8 / int16)
+#   offsets.npy    -> piece i is tokens[offsets[i]:offsets[i + 1]] (int64)
+#   metadata.json  -> one metadata record per piece, in the same order
+TOKEN_SEQUENCES_DIR = Path("outputs/token_sequences")
+CORPUS_DIR = Path("outputs/corpus")
+
+TOKENS_FILE = "tokens.npy"
+OFFSETS_FILE = "offsets.npy"
+METADATA_FILE = "metadata.json"
+
+
+def _token_dtype(max_id):
+    return np.uint8 if max_id < 256 else vocabulary.TOKEN_DTYPE
+
+
+def is_corpus(path):
+    return (Path(path) / TOKENS_FILE).exists()
+
+
+def write_corpus(path, sequences, metadata=None):
+    """
+    Write token sequences (lists or arrays of ids) as a consolidated corpus.
+    `metadata` is an optional list with one JSON-serializable record per sequence.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    arrays = [np.asarray(seq, dtype=np.int64) for seq in sequences]
+    lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+    flat = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+    max_id = int(flat.max()) if len(flat) else 0
+    np.save(path / TOKENS_FILE, flat.astype(_token_dtype(max_id)))
+    np.save(path / OFFSETS_FILE, offsets)
+
+    if metadata is None:
+        metadata = [{} for _ in arrays]
+    if len(metadata) != len(arrays):
+        raise ValueError("metadata must have one record per sequence")
+
+    with open(path / METADATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+
+
+class Corpus(Sequence):
+    """
+    Read access to a consolidated corpus.
+    With mmap=True (default) the token array is memory-mapped, so opening a
+    split costs one np.load call and pieces are sliced without copies.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        if not is_corpus(self.path):
+            raise FileNotFoundError(f"Corpus not found: {self.path}")
+
+        self.tokens = np.load(self.path / TOKENS_FILE, mmap_mode="r" if mmap else None)
+        self.offsets = np.load(self.path / OFFSETS_FILE)
+        self._metadata = None
+
+    @property
+    def metadata(self):
+        # loaded on first use, training only needs the tokens
+        if self._metadata is None:
+            with open(self.path / METADATA_FILE, "r", encoding="utf-8") as f:
+                self._metadata = json.load(f)
+        return self._metadata
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Corpus index out of range")
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+
+def convert_token_directory(src_dir, dest_dir):
+    """
+    Convert a directory of per-piece JSON files ({"metadata": ..., "tokens": [...]})
+    into a consolidated corpus. Unreadable files and pieces without tokens are skipped.
+    Returns the written Corpus.
+    """
+    src_dir = Path(src_dir)
+    if not src_dir.exists():
+        raise FileNotFoundError(f"Token directory not found: {src_dir}")
+
+    sequences = []
+    metadata = []
+    for file in sorted(src_dir.glob("*.json")):
+        try:
+            with open(file, "r") as f:
+                data = json.load(f)
+            tokens = data.get("tokens")
+            if tokens:
+                sequences.append(vocabulary.encode_sequence(tokens))
+                metadata.append(data.get("metadata", {}))
+        except Exception as e:
+            print(f"Error reading {file}: {e}")
+
+    write_corpus(dest_dir, sequences, metadata)
+    print(f"Wrote {len(sequences)} sequences to {dest_dir}")
+    return Corpus(dest_dir)
+
+
+if __name__ == "__main__":
+    for split in ["train", "validation", "test"]:
+        convert_token_directory(TOKEN_SEQUENCES_DIR / split, CORPUS_DIR / split)
@@ -0,0 +1,502 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+from vocabulary import encode, decode
+
+# Binary model layout:
+#   preamble  -> magic, format version, reserved, header length
+#   header    -> UTF-8 JSON (order, vocabulary, fingerprint, array table)
+#   data      -> 8-byte aligned little-endian arrays, CSR style:
+#                state_keys[i]                 packed state ids (sorted)
+#                offsets[i]:offsets[i + 1]     slice of transitions of state i
+#                next_ids / probs              target token id and probability
+#                cumulative (version 2)        running sum of probs within each row
+#                counts (optional)             raw count of each transition
+MAGIC = b"MKCH"
+FORMAT_VERSION = 2
+_PREAMBLE = struct.Struct("<4sHHI")
+_ALIGN = 8
+
+MODELS_DIR = Path("models")
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def sort_tokens(tokens):
+    # Integers first, then strings, so mixed vocabularies can still be sorted
+    return sorted(tokens, key=lambda t: (isinstance(t, str), t))
+
+
+def pack_states(state_ids, base):
+    """
+    Pack a (n_states, order) array of token ids into one int64 per state
+    (base-`base` positional encoding, first token most significant).
+    """
+    state_ids = np.asarray(state_ids, dtype=np.int64)
+    keys = np.zeros(state_ids.shape[0], dtype=np.int64)
+    for column in range(state_ids.shape[1]):
+        keys = keys * base + state_ids[:, column]
+    return keys
+
+
+def unpack_states(keys, base, order):
+    """Inverse of pack_states: returns a (n_states, order) array of token ids."""
+    keys = np.asarray(keys, dtype=np.int64).copy()
+    state_ids = np.empty((keys.shape[0], order), dtype=np.int64)
+    for column in range(order - 1, -1, -1):
+        state_ids[:, column] = keys % base
+        keys //= base
+    return state_ids
+
+
+# WRITING
+def model_to_arrays(model):
+    """
+    CSR arrays of a {state_tuple: {token: prob}} model.
+    Returns (order, vocab, {"state_keys", "offsets", "next_ids", "probs"}).
+    """
+    orders = {len(state) for state in model}
+    if len(orders) > 1:
+        raise ValueError(f"All states must have the same length, got {sorted(orders)}")
+    order = orders.pop() if orders else 0
+
+    tokens = set()
+    for state, transitions in model.items():
+        tokens.update(state)
+        tokens.update(transitions)
+    vocab = sort_tokens(tokens)
+    token_to_id = {token: i for i, token in enumerate(vocab)}
+
+    base = max(len(vocab), 1)
+    if order and base ** order >= 2 ** 63:
+        raise ValueError(f"Vocabulary of {base} tokens is too large for order {order}")
+
+    states = list(model.keys())
+    state_ids = np.array([[token_to_id[t] for t in s] for s in states], dtype=np.int64)
+    state_ids = state_ids.reshape(len(states), order)
+    state_keys = pack_states(state_ids, base)
+    ordering = np.argsort(state_keys, kind="stable")
+
+    offsets = np.zeros(len(states) + 1, dtype=np.int64)
+    next_ids = []
+    probs = []
+    for row, idx in enumerate(ordering):
+        transitions = model[states[idx]]
+        ids = sorted(token_to_id[t] for t in transitions)
+        next_ids.extend(ids)
+        probs.extend(transitions[vocab[i]] for i in ids)
+        offsets[row + 1] = len(next_ids)
+
+    arrays = {
+        "state_keys": state_keys[ordering],
+        "offsets": offsets,
+        "next_ids": np.asarray(next_ids, dtype=np.int32),
+        "probs": np.asarray(probs, dtype=np.float32),
+    }
+    return order, vocab, arrays
+
+
+def save_binary_model(model, path):
+    """
+    Save a {state_tuple: {token: prob}} model in the binary format.
+    """
+    order, vocab, arrays = model_to_arrays(model)
+    write_model_arrays(path, order, vocab, **arrays)
+
+
+def write_model_arrays(path, order, vocab, state_keys, offsets, next_ids, probs, counts=None):
+    """
+    Write a model given directly as CSR arrays (rows sorted by state key).
+    When `counts` is given the raw transition counts are stored too, which
+    lets the model be updated with new data later without retraining.
+    The cumulative probabilities used for sampling are computed here, so that
+    readers can map them instead of building a copy in every process.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    arrays = {
+        "state_keys": np.asarray(state_keys).astype("<i8"),
+        "offsets": np.asarray(offsets).astype("<i8"),
+        "next_ids": np.asarray(next_ids).astype("<i4"),
+        "probs": np.asarray(probs).astype("<f4"),
+    }
+    fingerprint = model_fingerprint(vocab, **arrays)
+    arrays["cumulative"] = cumulative_probs(arrays["offsets"], arrays["probs"]).astype("<f4")
+    if counts is not None:
+        arrays["counts"] = np.asarray(counts).astype("<i8")
+
+    write_arrays(path, {"order": order, "vocab": vocab, "fingerprint": fingerprint}, arrays)
+
+
+def write_arrays(path, header, arrays):
+    """Write a header dict and named NumPy arrays using the binary layout."""
+    table = {}
+    position = 0
+    for name, array in arrays.items():
+        table[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": position,
+        }
+        position = _align(position + array.nbytes)
+
+    header = dict(header, arrays=table)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (_align(_PREAMBLE.size + len(header_bytes)) - _PREAMBLE.size - len(header_bytes))
+
+    # Write a temporary file and rename it over the target: a model file is
+    # never truncated in place, since running generators may have it mapped
+    # (they keep the old content until they reload).
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(header_bytes)))
+            f.write(header_bytes)
+            for array in arrays.values():
+                data = np.ascontiguousarray(array).tobytes()
+                f.write(data)
+                f.write(b"\0" * (_align(len(data)) - len(data)))
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+# READING
+def read_arrays(buffer):
+    """
+    Parse a binary model held in a bytes-like object.
+    Returns (header, {name: array}); arrays are views on `buffer`, not copies.
+    """
+    if len(buffer) < _PREAMBLE.size:
+        raise ValueError("File is too small to be a binary Markov model")
+
+    magic, version, _, header_len = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a binary Markov model (bad magic number)")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported model format version {version} (max {FORMAT_VERSION})")
+
+    header_end = _PREAMBLE.size + header_len
+    header = json.loads(bytes(buffer[_PREAMBLE.size:header_end]).decode("utf-8"))
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=header_end + spec["offset"])
+        arrays[name] = array.reshape(spec["shape"])
+
+    return header, arrays
+
+
+def arrays_to_dict(header, arrays):
+    """Materialize parsed arrays into a {state_tuple: {token: prob}} dict."""
+    vocab = header["vocab"]
+    order = header["order"]
+    state_ids = unpack_states(arrays["state_keys"], max(len(vocab), 1), order).tolist()
+    offsets = arrays["offsets"].tolist()
+    next_ids = arrays["next_ids"].tolist()
+    probs = arrays["probs"].tolist()
+
+    model = {}
+    for row, ids in enumerate(state_ids):
+        start, end = offsets[row], offsets[row + 1]
+        model[tuple(vocab[i] for i in ids)] = {
+            vocab[next_ids[j]]: probs[j] for j in range(start, end)
+        }
+    return model
+
+
+def model_fingerprint(vocab, state_keys, offsets, next_ids, probs):
+    """
+    Checksum of a model's vocabulary and CSR arrays. It is stored in the
+    header when the model is saved, so it can be compared without reading
+    the arrays of a mapped model.
+    """
+    crc = zlib.crc32(json.dumps(vocab).encode("utf-8"))
+    for array, dtype in ((state_keys, "<i8"), (offsets, "<i8"), (next_ids, "<i4"), (probs, "<f4")):
+        crc = zlib.crc32(np.ascontiguousarray(array, dtype=dtype).data, crc)
+    return crc
+
+
+def model_path(order, models_dir=MODELS_DIR):
+    """Path of the model for `order`, falling back to a legacy JSON export."""
+    binary = Path(models_dir) / f"markov_order{order}.bin"
+    legacy = binary.with_suffix(".json")
+    if not binary.exists() and legacy.exists():
+        return legacy
+    return binary
+
+
+def backoff_path(models_dir=MODELS_DIR):
+    """Path of the backoff table built from the models of every order (see backoff_model)."""
+    return Path(models_dir) / "markov_backoff.bin"
+
+
+def load_json_model(path):
+    """Load a model exported as JSON with comma-joined state keys."""
+    with open(path, "r") as f:
+        raw_model = json.load(f)
+
+    model = {}
+    for state_str, transitions in raw_model.items():
+        # Convert string "NOTE_60,NOTE_62" -> tuple of ids (60, 62)
+        state = tuple(encode(t) for t in state_str.split(","))
+        model[state] = {encode(t): p for t, p in transitions.items()}
+    return model
+
+
+def cumulative_probs(offsets, probs):
+    """
+    Running sum of the transition probabilities within each CSR row, scaled so
+    that every row ends at exactly 1.0 (float32, one entry per transition).
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    cumulative = np.cumsum(np.asarray(probs, dtype=np.float64))
+    if len(cumulative) == 0:
+        return cumulative
+
+    lengths = np.diff(offsets)
+    starts = offsets[:-1][lengths > 0]
+    ends = offsets[1:][lengths > 0]
+    before = np.where(starts > 0, cumulative[starts - 1], 0.0)
+    totals = cumulative[ends - 1] - before
+    totals[totals <= 0] = 1.0
+
+    cumulative -= np.repeat(before, lengths[lengths > 0])
+    cumulative /= np.repeat(totals, lengths[lengths > 0])
+    cumulative[ends - 1] = 1.0  # rounding must never leave a draw past the row
+    return cumulative.astype(np.float32)
+
+
+def bisect_rows(cumulative, starts, ends, u):
+    """
+    Vectorized bisect_right: for each i, the index j in [starts[i], ends[i])
+    of the first cumulative value above u[i]. All rows are searched together,
+    in log2(longest row) steps, without copying `cumulative`.
+    """
+    lo = np.array(starts, dtype=np.int64)
+    hi = np.array(ends, dtype=np.int64)
+    u = np.asarray(u)
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = (lo + hi) // 2
+        right = active & (cumulative[np.where(active, mid, 0)] <= u)
+        lo = np.where(right, mid + 1, lo)
+        hi = np.where(active & ~right, mid, hi)
+
+
+def scalar_view(array):
+    """memoryview of a 1-D array (items read as Python numbers), or the array if it has none."""
+    try:
+        view = memoryview(array)
+        view[:0].tolist()  # formats memoryview cannot index (e.g. byte-swapped) raise here
+        return view
+    except (TypeError, ValueError, NotImplementedError):
+        return array
+
+
+class ArrayModel(Mapping):
+    """
+    Read-only model held as CSR arrays (see the binary layout above).
+    model[state] binary-searches the sorted state keys; sample() draws the next
+    token from the per-row cumulative probabilities stored with the model
+    (computed at load time for files written before format version 2).
+    """
+
+    def __init__(self, order, vocab, arrays, fingerprint=None):
+        self.order = order
+        self.vocab = vocab
+        self._token_to_id = {token: i for i, token in enumerate(self.vocab)}
+        self._base = max(len(self.vocab), 1)
+
+        self.state_keys = arrays["state_keys"]
+        self.offsets = arrays["offsets"]
+        self.next_ids = arrays["next_ids"]
+        self.probs = arrays["probs"]
+        self.cumulative = arrays.get("cumulative")
+        if self.cumulative is None:
+            self.cumulative = cumulative_probs(self.offsets, self.probs)
+        self._fingerprint = fingerprint
+
+        # row() and sample() bisect memoryviews of the arrays: indexing them
+        # gives plain ints and floats (no NumPy scalar per probe, no copy)
+        self._key_view = scalar_view(self.state_keys)
+        self._offset_view = scalar_view(self.offsets)
+        self._next_id_view = scalar_view(self.next_ids)
+        self._cumulative_view = scalar_view(self.cumulative)
+
+    @property
+    def fingerprint(self):
+        """model_fingerprint of the model: read from the file header when it has one."""
+        if self._fingerprint is None:
+            self._fingerprint = model_fingerprint(self.vocab, self.state_keys, self.offsets,
+                                                  self.next_ids, self.probs)
+        return self._fingerprint
+
+    @classmethod
+    def from_dict(cls, model):
+        """Build an ArrayModel from a {state_tuple: {token: prob}} dict."""
+        order, vocab, arrays = model_to_arrays(model)
+        return cls(order, vocab, arrays)
+
+    def row(self, state):
+        """Row index of `state` in the CSR arrays, or -1 when the state is unknown."""
+        if len(state) != self.order:
+            return -1
+
+        key = 0
+        for token in state:
+            token_id = self._token_to_id.get(token)
+            if token_id is None:
+                return -1
+            key = key * self._base + token_id
+
+        keys = self._key_view
+        idx = bisect.bisect_left(keys, key)
+        if idx < len(keys) and keys[idx] == key:
+            return idx
+        return -1
+
+    def sample(self, state, u):
+        """
+        Next token after `state` for a uniform draw u in [0, 1): a binary
+        search in the state's cumulative probabilities. None for unknown states.
+        """
+        idx = self.row(state)
+        if idx < 0:
+            return None
+
+        start, end = self._offset_view[idx], self._offset_view[idx + 1]
+        if start == end:
+            return None
+        # the last value of a row is 1.0, but clamp anyway: a draw must not leave its row
+        j = min(bisect.bisect_right(self._cumulative_view, u, start, end), end - 1)
+        return self.vocab[self._next_id_view[j]]
+
+    def token_ids(self, tokens):
+        """Vocabulary index of each token (-1 for tokens the model has never seen)."""
+        return np.array([self._token_to_id.get(t, -1) for t in tokens], dtype=np.int64)
+
+    def find_rows(self, state_ids):
+        """
+        Vectorized row(): states given as an (n, order) array of vocabulary
+        indices. Returns the row of each state, -1 for unknown states and
+        states without transitions.
+        """
+        state_ids = np.asarray(state_ids, dtype=np.int64).reshape(-1, self.order)
+        keys = pack_states(state_ids, self._base)
+        rows = np.searchsorted(self.state_keys, keys)
+        clipped = np.minimum(rows, max(len(self.state_keys) - 1, 0))
+
+        found = (state_ids >= 0).all(axis=1) & (rows < len(self.state_keys))
+        if len(self.state_keys):
+            found &= (self.state_keys[clipped] == keys) & (self.offsets[clipped + 1] > self.offsets[clipped])
+        return np.where(found, rows, -1)
+
+    def sample_rows(self, rows, u):
+        """
+        Vectorized sample(): vocabulary index of the next token for each known
+        row, given one uniform draw in [0, 1) per row.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        j = bisect_rows(self.cumulative, self.offsets[rows], self.offsets[rows + 1], u)
+        return np.asarray(self.next_ids)[j].astype(np.int64)
+
+    def __getitem__(self, state):
+        idx = self.row(state)
+        if idx < 0:
+            raise KeyError(state)
+
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        vocab = self.vocab
+        return {
+            vocab[i]: p
+            for i, p in zip(self.next_ids[start:end].tolist(), self.probs[start:end].tolist())
+        }
+
+    def __contains__(self, state):
+        return self.row(state) >= 0
+
+    def __iter__(self):
+        for ids in unpack_states(self.state_keys, self._base, self.order).tolist():
+            yield tuple(self.vocab[i] for i in ids)
+
+    def __len__(self):
+        return len(self.state_keys)
+
+
+class MappedModel(ArrayModel):
+    """
+    ArrayModel backed by a memory-mapped binary file, so processes opening the
+    same file share its pages, cumulative probabilities included.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            if self.path.stat().st_size == 0:
+                raise ValueError(f"Empty model file: {self.path}")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header, arrays = read_arrays(self._mmap)
+        super().__init__(header["order"], header["vocab"], arrays, header.get("fingerprint"))
+
+    def close(self):
+        """Release the mapping (arrays taken from this model become invalid)."""
+        for view in (self._key_view, self._offset_view, self._next_id_view, self._cumulative_view):
+            if isinstance(view, memoryview):
+                view.release()
+        self.state_keys = self.offsets = self.next_ids = self.probs = None
+        self.cumulative = None
+        self._key_view = self._offset_view = self._next_id_view = self._cumulative_view = None
+        self._mmap.close()
+
+
+def load_model(path, mapped=False):
+    """
+    Load a trained Markov model as a {state_tuple: {token: prob}} dict.
+    Binary files are the default; `.json` files are read as legacy exports.
+    With mapped=True binary files are memory-mapped instead (see MappedModel).
+    """
+    path = Path(path)
+    if path.suffix == ".json":
+        return load_json_model(path)
+
+    if mapped:
+        return MappedModel(path)
+
+    with open(path, "rb") as f:
+        header, arrays = read_arrays(f.read())
+    return arrays_to_dict(header, arrays)
+
+
+# JSON EXPORT
+def export_json(model, path):
+    """Export a model as JSON (tuple keys become comma-joined token strings)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    json_ready = {
+        ",".join(decode(t) for t in state): {decode(t): p for t, p in probs.items()}
+        for state, probs in model.items()
+    }
+
+    with open(path, "w") as f:
+        json.dump(json_ready, f, indent=2)
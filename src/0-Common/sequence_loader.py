@@ -0,0 +1,106 @@
+import json
+import queue
+import threading
+from pathlib import Path
+
+import vocabulary
+from corpus import Corpus, is_corpus, CORPUS_DIR, TOKEN_SEQUENCES_DIR
+
+_DONE = object()
+
+
+def split_root(split):
+    """Location of a split: the consolidated corpus if it exists, else the JSON directory."""
+    if is_corpus(CORPUS_DIR / split):
+        return CORPUS_DIR / split
+    return TOKEN_SEQUENCES_DIR / split
+
+
+def _iter_json_directory(root):
+    for file in root.glob("*.json"):
+        try:
+            with open(file, "r") as f:
+                data = json.load(f)
+                tokens = data.get("tokens")
+                if tokens:
+                    yield vocabulary.encode_sequence(tokens)
+        except Exception as e:
+            print(f"Error reading {file}: {e}")
+
+
+def _iter_corpus(root, as_arrays):
+    for seq in Corpus(root):
+        yield seq if as_arrays else seq.tolist()
+
+
+def prefetch(iterable, size=4, poll_interval=0.1):
+    """
+    Read ahead up to `size` items of `iterable` in a background thread, so
+    file reading overlaps with whatever the consumer does with each item.
+    If the consumer stops early, the thread stops too and closes `iterable`.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        # a plain put() would block forever once the consumer is gone
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=poll_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        else:
+            put(_DONE)
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()  # releases open files of a generator stopped early
+
+    threading.Thread(target=producer, daemon=True).start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_sequences(root, label="Sequence folder", as_arrays=False, prefetch_size=4):
+    """
+    Stream the token-id sequences of a split one piece at a time.
+    `root` can be a consolidated corpus or a directory of per-piece JSON files.
+    Corpus pieces are returned as lists unless as_arrays=True (NumPy views).
+    Raises FileNotFoundError right away if `root` does not exist.
+    """
+    root = Path(root)
+    if not root.exists():
+        raise FileNotFoundError(f"{label} not found: {root}")
+
+    if is_corpus(root):
+        sequences = _iter_corpus(root, as_arrays)
+    else:
+        sequences = _iter_json_directory(root)
+
+    if prefetch_size:
+        sequences = prefetch(sequences, prefetch_size)
+    return sequences
+
+
+def load_sequences(root, label="Sequence folder", as_arrays=False):
+    """Load every sequence of a split into a list (see iter_sequences)."""
+    return list(iter_sequences(root, label, as_arrays, prefetch_size=0))
@@ -0,0 +1,199 @@
+from fractions import Fraction
+
+import numpy as np
+
+# Token ids shared by every stage of the pipeline.
+#   0-127  -> MIDI pitch (NOTE_<pitch>), so a pitch token *is* its MIDI number
+#   128    -> END of piece
+# New event types are appended after END so existing ids never change.
+NUM_PITCHES = 128
+END = 128
+
+NOTE_PREFIX = "NOTE_"
+END_TOKEN = "END"
+REST_PREFIX = "REST_"
+
+# Timed tokens ("timed" tokenizer mode), in quarter lengths quantized to DURATIONS:
+#   REST_BASE + d                                   -> REST_<duration d>
+#   TIMED_NOTE_BASE + pitch * NUM_DURATIONS + d     -> NOTE_<pitch>_<duration d>
+# A note and its duration share one token, so a Markov state still spans
+# `order` notes; models only store the (few) combinations that occur.
+DURATIONS = tuple(Fraction(d) for d in ["1/4", "1/3", "1/2", "2/3", "3/4", "1", "3/2", "2", "3", "4"])
+NUM_DURATIONS = len(DURATIONS)
+REST_BASE = END + 1
+TIMED_NOTE_BASE = REST_BASE + NUM_DURATIONS
+VOCAB_SIZE = TIMED_NOTE_BASE + NUM_PITCHES * NUM_DURATIONS
+
+# Plain pitch tokens carry no duration; they count as one quarter note
+DEFAULT_DURATION = 1.0
+
+# Smallest integer dtype able to hold every token id
+TOKEN_DTYPE = np.int16
+
+_DURATION_VALUES = np.array([float(d) for d in DURATIONS])
+
+
+def is_pitch(token_id):
+    return 0 <= token_id < NUM_PITCHES
+
+
+def is_rest(token_id):
+    return REST_BASE <= token_id < TIMED_NOTE_BASE
+
+
+def is_timed_note(token_id):
+    return TIMED_NOTE_BASE <= token_id < VOCAB_SIZE
+
+
+def is_timed(token_id):
+    """True for tokens that carry a duration (timed notes and rests)."""
+    return REST_BASE <= token_id < VOCAB_SIZE
+
+
+def quantize_duration(quarter_length):
+    """Index in DURATIONS of the closest duration class."""
+    return int(np.argmin(np.abs(_DURATION_VALUES - float(quarter_length))))
+
+
+def timed_note(pitch, quarter_length):
+    """Id of a note of `pitch` lasting about `quarter_length` quarters."""
+    if not is_pitch(pitch):
+        raise ValueError(f"Pitch out of range: {pitch}")
+    return TIMED_NOTE_BASE + int(pitch) * NUM_DURATIONS + quantize_duration(quarter_length)
+
+
+def rest(quarter_length):
+    """Id of a rest lasting about `quarter_length` quarters."""
+    return REST_BASE + quantize_duration(quarter_length)
+
+
+def pitch_of(token_id):
+    """MIDI pitch of a plain or timed note token, None for other tokens."""
+    if is_pitch(token_id):
+        return int(token_id)
+    if is_timed_note(token_id):
+        return (int(token_id) - TIMED_NOTE_BASE) // NUM_DURATIONS
+    return None
+
+
+def duration_of(token_id):
+    """Length of a token in quarter notes (DEFAULT_DURATION for plain pitches, 0 for END)."""
+    if is_pitch(token_id):
+        return DEFAULT_DURATION
+    if is_rest(token_id):
+        return float(DURATIONS[int(token_id) - REST_BASE])
+    if is_timed_note(token_id):
+        return float(DURATIONS[(int(token_id) - TIMED_NOTE_BASE) % NUM_DURATIONS])
+    return 0.0
+
+
+def fold_pitches(pitches, fold=True):
+    """
+    Bring pitches back into 0-127: by whole octaves (fold=True, keeps the
+    pitch class) or by clamping to the nearest limit (fold=False).
+    """
+    pitches = np.asarray(pitches, dtype=np.int64)
+    if not fold:
+        return np.clip(pitches, 0, NUM_PITCHES - 1)
+    low = -(pitches // 12) * 12  # octaves up for pitches below 0
+    high = -((pitches - NUM_PITCHES) // 12 + 1) * 12  # octaves down above 127
+    return pitches + np.where(pitches < 0, low, 0) + np.where(pitches >= NUM_PITCHES, high, 0)
+
+
+def transpose(token_id, semitones, fold=True):
+    """
+    Move a (plain or timed) note token by `semitones`; other tokens are unchanged.
+    Pitches pushed outside 0-127 are folded back by octaves (or clamped, see fold_pitches).
+    """
+    if is_pitch(token_id) or is_timed_note(token_id):
+        return int(transpose_ids([token_id], semitones, fold)[0])
+    return token_id
+
+
+def transpose_ids(token_ids, semitones, fold=True):
+    """
+    Vectorized transpose() over an array of ids, of any shape: one NumPy add
+    per token kind. Returns a new int64 array.
+    """
+    token_ids = np.array(token_ids, dtype=np.int64)
+    if semitones == 0:
+        return token_ids
+
+    pitches = (token_ids >= 0) & (token_ids < NUM_PITCHES)
+    token_ids[pitches] = fold_pitches(token_ids[pitches] + semitones, fold)
+
+    timed = (token_ids >= TIMED_NOTE_BASE) & (token_ids < VOCAB_SIZE)
+    pitch, duration = np.divmod(token_ids[timed] - TIMED_NOTE_BASE, NUM_DURATIONS)
+    token_ids[timed] = TIMED_NOTE_BASE + fold_pitches(pitch + semitones, fold) * NUM_DURATIONS + duration
+    return token_ids
+
+
+def _parse_duration(text):
+    duration = Fraction(text)
+    if duration not in DURATIONS:
+        raise ValueError(f"Unknown duration: {text!r}")
+    return DURATIONS.index(duration)
+
+
+def encode(token):
+    """
+    Convert a token to its integer id.
+    Accepts ids (returned unchanged) and strings like "NOTE_60", "END",
+    "NOTE_60_1/2" or "REST_3/2".
+    """
+    if isinstance(token, (int, np.integer)):
+        if not 0 <= token < VOCAB_SIZE:
+            raise ValueError(f"Token id out of range: {token}")
+        return int(token)
+
+    if token == END_TOKEN:
+        return END
+
+    try:
+        if isinstance(token, str) and token.startswith(REST_PREFIX):
+            return REST_BASE + _parse_duration(token[len(REST_PREFIX):])
+
+        if isinstance(token, str) and token.startswith(NOTE_PREFIX):
+            pitch, _, duration = token[len(NOTE_PREFIX):].partition("_")
+            pitch = int(pitch)
+            if is_pitch(pitch):
+                if not duration:
+                    return pitch
+                return TIMED_NOTE_BASE + pitch * NUM_DURATIONS + _parse_duration(duration)
+    except (ValueError, ZeroDivisionError):
+        pass
+
+    raise ValueError(f"Unknown token: {token!r}")
+
+
+def decode(token_id):
+    """Render a token id as its string form ("NOTE_60", "END", "NOTE_60_1/2", "REST_1")."""
+    if isinstance(token_id, str):
+        return decode(encode(token_id))
+
+    token_id = int(token_id)
+    if is_pitch(token_id):
+        return f"{NOTE_PREFIX}{token_id}"
+    if token_id == END:
+        return END_TOKEN
+    if is_rest(token_id):
+        return f"{REST_PREFIX}{DURATIONS[token_id - REST_BASE]}"
+    if is_timed_note(token_id):
+        duration = DURATIONS[(token_id - TIMED_NOTE_BASE) % NUM_DURATIONS]
+        return f"{NOTE_PREFIX}{pitch_of(token_id)}_{duration}"
+    raise ValueError(f"Token id out of range: {token_id}")
+
+
+def encode_sequence(tokens):
+    """Encode a list of tokens (strings or ids) into a list of ids."""
+    return [encode(t) for t in tokens]
+
+
+def decode_sequence(token_ids):
+    """Render a list of ids as token strings (UI / export boundary)."""
+    return [decode(t) for t in token_ids]
+
+
+def to_array(tokens):
+    """Encode a token sequence as a compact NumPy array of ids."""
+    return np.asarray(encode_sequence(tokens), dtype=TOKEN_DTYPE)
@@ -0,0 +1,167 @@
+import unittest
+from data_collection_1 import download_file, extract_zip, verify_zip, file_sha256, ChecksumError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+import hashlib
+import tempfile
+import threading
+import zipfile
+import json
+import os
+
+
+def make_handler(payload, ranges=True, requests=None, fail_at=None):
+    """
+    HTTP stand-in serving `payload`, with or without byte-range support.
+    Range requests starting at byte `fail_at` get an HTTP 500.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body_only):
+            header = self.headers.get("Range")
+            if requests is not None and not body_only:
+                requests.append(header)
+            if ranges and header:
+                start, end = header.split("=")[1].split("-")
+                start, end = int(start), int(end) + 1
+                if start == fail_at:
+                    self.send_error(500)
+                    return b""
+                self.send_response(206)
+                body = payload[start:end]
+            else:
+                self.send_response(200)
+                body = payload
+            self.send_header("Content-Length", str(len(body)))
+            if ranges:
+                self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            return body
+
+        def do_HEAD(self):
+            self._send(body_only=True)
+
+        def do_GET(self):
+            self.wfile.write(self._send(body_only=False))
+
+    return Handler
+
+
+class Testdata_collection_1(unittest.TestCase):
+    """Unit tests for the data_collection_1 module."""
+
+    def setUp(self):
+        """Create a temporary directory and a payload to download."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.payload = os.urandom(100_000)
+        self.sha256 = hashlib.sha256(self.payload).hexdigest()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def serve(self, **kwargs):
+        """Start a local HTTP server for the payload and return its URL."""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(self.payload, **kwargs))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_port}/file.zip"
+
+    def test_download_file_fetches_chunks_in_parallel(self):
+        """Test that a range download reassembles the file and verifies its checksum."""
+        requests = []
+        url = self.serve(requests=requests)
+        dest = download_file(url, self.dir / "out.zip", sha256=self.sha256, chunk_size=7_000, workers=4)
+
+        self.assertEqual(dest.read_bytes(), self.payload)
+        self.assertEqual(len(requests), 15)
+        self.assertFalse((self.dir / "out.zip.part").exists())
+
+    def test_download_file_resumes_missing_chunks(self):
+        """Test that chunks recorded as done are not downloaded again."""
+        requests = []
+        url = self.serve(requests=requests)
+        part = self.dir / "out.zip.part"
+        chunk = 10_000
+
+        # an interrupted download: chunks 0-5 are on disk
+        part.write_bytes(self.payload[:6 * chunk] + bytes(len(self.payload) - 6 * chunk))
+        (self.dir / "out.zip.part.json").write_text(json.dumps(
+            {"url": url, "size": len(self.payload), "chunk_size": chunk, "done": list(range(6))}))
+
+        download_file(url, self.dir / "out.zip", sha256=self.sha256, chunk_size=chunk)
+
+        self.assertEqual((self.dir / "out.zip").read_bytes(), self.payload)
+        self.assertEqual(sorted(requests), sorted(f"bytes={i * chunk}-{(i + 1) * chunk - 1}" for i in range(6, 10)))
+
+    def test_download_file_records_chunks_before_a_failure(self):
+        """Test that a failed chunk stops the download with the finished chunks recorded."""
+        requests = []
+        chunk = 10_000
+        url = self.serve(requests=requests, fail_at=3 * chunk)
+
+        with self.assertRaises(OSError):
+            download_file(url, self.dir / "out.zip", sha256=self.sha256, chunk_size=chunk, workers=1)
+
+        state = json.loads((self.dir / "out.zip.part.json").read_text())
+        self.assertEqual(state["done"], [0, 1, 2])
+        # the queued chunks were cancelled (only the one already picked up may run)
+        self.assertLessEqual(len(set(requests)), 5)
+
+    def test_download_file_without_range_support(self):
+        """Test that servers without byte ranges get a single plain download."""
+        url = self.serve(ranges=False)
+        dest = download_file(url, self.dir / "out.zip", sha256=self.sha256)
+        self.assertEqual(dest.read_bytes(), self.payload)
+
+    def test_download_file_rejects_bad_checksum(self):
+        """Test that a checksum mismatch raises and leaves no file behind."""
+        url = self.serve()
+        with self.assertRaises(ChecksumError):
+            download_file(url, self.dir / "out.zip", sha256="0" * 64)
+        self.assertFalse((self.dir / "out.zip").exists())
+        self.assertFalse((self.dir / "out.zip.part").exists())
+
+    def test_download_file_from_local_mirror(self):
+        """Test that file:// URLs and plain paths are copied."""
+        source = self.dir / "mirror.zip"
+        source.write_bytes(self.payload)
+
+        download_file(source.as_uri(), self.dir / "a.zip", sha256=self.sha256)
+        download_file(str(source), self.dir / "b.zip", sha256=self.sha256)
+        self.assertEqual(file_sha256(self.dir / "a.zip"), self.sha256)
+        self.assertEqual(file_sha256(self.dir / "b.zip"), self.sha256)
+
+    def test_verify_zip_checks_archive_without_checksum(self):
+        """Test that without a checksum the ZIP structure is verified."""
+        archive = self.dir / "data.zip"
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("a.midi", b"MThd")
+        verify_zip(archive)
+
+        not_a_zip = self.dir / "random.zip"
+        not_a_zip.write_bytes(self.payload)
+        with self.assertRaises(ChecksumError):
+            verify_zip(not_a_zip)
+
+    def test_extract_zip_selects_members_and_skips_existing(self):
+        """Test that only matching members are extracted and existing files are kept."""
+        archive = self.dir / "data.zip"
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("maestro/2004/a.midi", b"MThd-a")
+            zf.writestr("maestro/2004/b.midi", b"MThd-b")
+            zf.writestr("maestro/README", b"text")
+
+        out = self.dir / "out"
+        (out / "maestro/2004").mkdir(parents=True)
+        (out / "maestro/2004/a.midi").write_bytes(b"kept!!")  # same size as the member
+
+        extract_zip(archive, out, patterns=["*.midi"])
+
+        self.assertEqual((out / "maestro/2004/a.midi").read_bytes(), b"kept!!")
+        self.assertEqual((out / "maestro/2004/b.midi").read_bytes(), b"MThd-b")
+        self.assertFalse((out / "maestro/README").exists())
@@ -0,0 +1,42 @@
+import unittest
+from key_detection import pitch_class_histogram, detect_key, key_shift, transpose_tokens
+from music21 import stream, note, chord, interval
+
+
+class Testkey_detection(unittest.TestCase):
+    """Unit tests for the key_detection module."""
+
+    def test_pitch_class_histogram_sums_durations(self):
+        """Test that durations are summed per pitch class across octaves."""
+        histogram = pitch_class_histogram([60, 72, 66], [3.0, 1.0, 2.0])
+        self.assertEqual(histogram.tolist(), [4.0, 0, 0, 0, 0, 0, 2.0, 0, 0, 0, 0, 0])
+
+    def test_detect_key_matches_music21(self):
+        """Test that the detected key and transposition match music21's analyze('key')."""
+        scales = {
+            "E major": ["E4", "F#4", "G#4", "A4", "B4", "C#5", "D#5", "E5"],
+            "D minor": ["D4", "E4", "F4", "G4", "A4", "B-4", "C#5", "D5", "A4", "F4", "D4"],
+            "B- major": ["B-3", "D4", "F4", "B-4", "E-4", "G4", "C4", "A3"],
+        }
+        for name, names in scales.items():
+            s = stream.Stream([note.Note(n, quarterLength=1 + i % 3) for i, n in enumerate(names)])
+            s.append(chord.Chord(names[:3], quarterLength=2))
+
+            expected = s.analyze("key")
+            expected_shift = interval.Interval(expected.tonic, note.Note("C" if expected.mode == "major" else "A")).semitones
+
+            histogram = pitch_class_histogram(
+                [p.midi for n in s.notes for p in n.pitches],
+                [float(n.quarterLength) for n in s.notes for _ in n.pitches],
+            )
+            tonic, mode, _ = detect_key(histogram)
+            self.assertEqual((tonic, mode), (expected.tonic.pitchClass, expected.mode), name)
+            self.assertEqual(key_shift(tonic, mode), expected_shift, name)
+
+    def test_detect_key_breaks_ties_like_music21(self):
+        """Test that a flat histogram (no correlation) gives B minor, as in music21."""
+        self.assertEqual(detect_key([1.0] * 12)[:2], (11, "minor"))
+
+    def test_transpose_tokens_leaves_non_pitch_tokens(self):
+        """Test that only pitch tokens are shifted."""
+        self.assertEqual(transpose_tokens([60, 64, 128], -4).tolist(), [56, 60, 128])
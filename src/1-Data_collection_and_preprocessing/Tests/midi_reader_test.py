@@ -0,0 +1,63 @@
+import unittest
+import struct
+from midi_reader import MidiFormatError, read_midi, read_midi_notes, midi_to_pitches, pair_notes, quantize
+
+
+def smf(*tracks, ticks_per_quarter=480):
+    """Build a Standard MIDI File from raw track bodies (without end-of-track)."""
+    data = b"MThd" + struct.pack(">IHHH", 6, 1, len(tracks), ticks_per_quarter)
+    for body in tracks:
+        body += b"\x00\xff\x2f\x00"
+        data += b"MTrk" + struct.pack(">I", len(body)) + body
+    return data
+
+
+class Testmidi_reader(unittest.TestCase):
+    """Unit tests for the midi_reader module."""
+
+    def test_read_midi_handles_running_status_and_velocity_zero(self):
+        """Test that running status and note-on with velocity 0 (note-off) are decoded."""
+        # on C4, (running status) on E4, 480 ticks later both off with velocity 0
+        body = b"\x00\x90\x3c\x40\x00\x40\x40\x83\x60\x3c\x00\x00\x40\x00"
+        ticks_per_quarter, tracks = read_midi(smf(body))
+        notes = tracks[0][0]
+
+        self.assertEqual(ticks_per_quarter, 480)
+        self.assertEqual(notes, [(0, 60, 0, True), (0, 64, 0, True), (480, 60, 0, False), (480, 64, 0, False)])
+        self.assertEqual(sorted(pair_notes(notes)), [(0, 480, 60, 0), (0, 480, 64, 0)])
+
+    def test_read_midi_rejects_non_midi_data(self):
+        """Test that data without an MThd header raises MidiFormatError."""
+        with self.assertRaises(MidiFormatError):
+            read_midi(b"notamidi")
+
+    def test_read_midi_rejects_truncated_file(self):
+        """Test that a truncated file raises MidiFormatError."""
+        data = smf(b"\x00\x90\x3c\x40\x83\x60\x80\x3c\x40")
+        with self.assertRaises(MidiFormatError):
+            read_midi(data[:-6])
+
+    def test_read_midi_notes_rejects_several_note_tracks(self):
+        """Test that files with more than one track of notes are left to music21."""
+        track = b"\x00\x90\x3c\x40\x83\x60\x80\x3c\x40"
+        with self.assertRaises(MidiFormatError):
+            read_midi_notes(smf(track, track))
+
+    def test_midi_to_pitches_keeps_highest_chord_note(self):
+        """Test that a chord gives a single token, its highest pitch."""
+        body = b"\x00\x90\x3c\x40\x00\x90\x43\x40\x00\x90\x40\x40\x83\x60\x80\x3c\x40\x00\x80\x43\x40\x00\x80\x40\x40"
+        self.assertEqual(midi_to_pitches(smf(body)), [67])
+
+    def test_read_midi_notes_splits_notes_over_barline(self):
+        """Test that a note crossing a 4/4 barline appears once per measure."""
+        # whole note starting on beat 4 of the first measure
+        body = b"\x8b\x20\x90\x3c\x40\x8f\x00\x80\x3c\x40"
+        notes = read_midi_notes(smf(body))
+
+        self.assertEqual([(o, d) for o, d, _ in notes], [(3, 1), (4, 3)])
+        self.assertEqual(midi_to_pitches(smf(body)), [60, 60])
+
+    def test_quantize_snaps_to_nearest_grid(self):
+        """Test that values snap to the closest 1/4 or 1/3 quarter."""
+        self.assertEqual(quantize(0.26), 0.25)
+        self.assertAlmostEqual(quantize(0.32), 1 / 3)
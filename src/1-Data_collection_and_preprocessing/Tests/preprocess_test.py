@@ -1,9 +1,11 @@
 import unittest
-from preprocess_2 import normalize_key, parse_midi_file, process_entry, process_maestro_parallel, DATA_ROOT as original_data_root
+from preprocess_2 import normalize_key, parse_midi_file, process_entry, process_maestro_parallel, rest_tokens, tokenizer_settings, cache_key, DATA_ROOT as original_data_root
 from music21 import stream, note, chord, key as m21key
 from pathlib import Path
 import tempfile
 import pandas as pd
+from fractions import Fraction
+from vocabulary import decode_sequence
 
 
 
@@ -69,7 +71,7 @@ class Testpreprocess_2(unittest.TestCase):
             tokens = []
 
         self.assertIsInstance(tokens, list)
-        self.assertIn("NOTE_60", tokens)
+        self.assertIn(60, tokens)
 
 
     def test_parse_midi_file_handles_chords(self):
@@ -85,7 +87,7 @@ class Testpreprocess_2(unittest.TestCase):
 
         self.assertIsInstance(tokens, list)
         if tokens is not None:
-            self.assertIn("NOTE_79", tokens)
+            self.assertIn(79, tokens)
 
     def test_process_entry_skips_existing_file(self):
         """Test that process_entry returns skip message if output already exists."""
@@ -176,3 +178,234 @@ class Testpreprocess_2(unittest.TestCase):
 
             self.assertTrue(ok)
 
+
+    def test_process_maestro_parallel_writes_consolidated_corpus(self):
+        """Test that process_maestro_parallel consolidates each split when corpus_dir is given."""
+        import preprocess_2
+        from corpus import Corpus
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            stream.Stream([note.Note("C4"), note.Note("E4")]).write("midi", fp=tmp / "piece.mid")
+
+            csv_path = tmp / "data.csv"
+            pd.DataFrame([
+                {"split": "train", "midi_filename": "piece.mid",
+                 "canonical_composer": "C", "canonical_title": "T", "year": 2020}
+            ]).to_csv(csv_path, index=False)
+
+            preprocess_2.DATA_ROOT = tmp
+            try:
+                process_maestro_parallel(csv_path=csv_path, output_dir=tmp / "out",
+                                         max_workers=1, corpus_dir=tmp / "corpus")
+            finally:
+                preprocess_2.DATA_ROOT = original_data_root
+
+            corpus = Corpus(tmp / "corpus" / "train")
+            self.assertEqual(len(corpus), 1)
+            self.assertEqual(corpus.metadata[0]["title"], "T")
+            self.assertIn("transposition", corpus.metadata[0]["key"])
+            self.assertEqual(int(corpus[0][-1]), 128)
+            self.assertEqual(len(Corpus(tmp / "corpus" / "test")), 0)
+
+    def _parse_both(self, s, name, normalize=False, token_mode="pitch"):
+        """Write a stream to MIDI and tokenize it with both parsers."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / name
+            s.write("midi", fp=path)
+            return (parse_midi_file(path, normalize=normalize, token_mode=token_mode),
+                    parse_midi_file(path, normalize=normalize, parser="direct", token_mode=token_mode))
+
+    def test_direct_parser_matches_music21_on_melody_and_chords(self):
+        """Test that the direct parser gives the same tokens as music21 for notes, chords and ties."""
+        s = stream.Stream()
+        for i, p in enumerate([60, 62, 64, 65, 67, 69, 71, 72]):
+            s.append(note.Note(p, quarterLength=[1, 0.5, 1.5, 0.25, 3, 1 / 3, 2, 0.75][i]))
+        s.append(chord.Chord(["C4", "E4", "G4"], quarterLength=2.5))
+        s.insert(3, note.Note(48, quarterLength=6))  # overlapping voice held over a barline
+
+        music21_result, direct_result = self._parse_both(s, "parity.mid")
+        self.assertIsNone(direct_result[1])
+        self.assertEqual(direct_result, music21_result)
+
+    def test_direct_parser_matches_music21_key_normalization(self):
+        """Test that the direct parser transposes to the same key as music21."""
+        s = stream.Stream([note.Note(p) for p in ["E4", "F#4", "G#4", "A4", "B4", "C#5", "D#5", "E5"]])
+
+        music21_result, direct_result = self._parse_both(s, "parity_key.mid", normalize=True)
+        self.assertEqual(direct_result, music21_result)
+
+    def test_timed_mode_encodes_durations_and_rests(self):
+        """Test that timed tokens carry note durations and rests, the same for both parsers."""
+        s = stream.Stream([note.Note("C4"), note.Rest(quarterLength=1.5), note.Note("E4", quarterLength=2),
+                           note.Note("G4", quarterLength=0.5)])
+        s.append(chord.Chord(["C4", "E4", "A4"], quarterLength=3))
+
+        music21_result, direct_result = self._parse_both(s, "timed.mid", token_mode="timed")
+        self.assertEqual(direct_result, music21_result)
+        # E4 crosses the barline at beat 4: one tied piece per measure
+        self.assertEqual(decode_sequence(music21_result[0]),
+                         ["NOTE_60_1", "REST_3/2", "NOTE_64_3/2", "NOTE_64_1/2", "NOTE_67_1/2", "NOTE_69_3", "END"])
+
+    def test_rest_tokens_split_long_gaps(self):
+        """Test that long silences become several rests and tiny gaps none."""
+        self.assertEqual(decode_sequence(rest_tokens(Fraction(9))), ["REST_4", "REST_4", "REST_1"])
+        self.assertEqual(rest_tokens(Fraction(1, 16)), [])
+
+    def test_timed_cache_key_depends_on_parser(self):
+        """Test that timed tokens are cached per parser while pitch tokens are shared."""
+        def key(token_mode, parser):
+            return cache_key("digest", tokenizer_settings(True, token_mode, parser))
+
+        self.assertEqual(key("pitch", "music21"), key("pitch", "direct"))
+        self.assertNotEqual(key("timed", "music21"), key("timed", "direct"))
+
+    def test_parse_midi_file_rejects_unknown_token_mode(self):
+        """Test that an unknown token mode raises ValueError."""
+        with self.assertRaises(ValueError):
+            parse_midi_file("piece.mid", token_mode="velocity")
+
+    def test_parse_midi_file_rejects_unknown_parser(self):
+        """Test that an unknown parser name raises ValueError."""
+        with self.assertRaises(ValueError):
+            parse_midi_file("piece.mid", parser="fast")
+
+    def test_process_entry_with_direct_parser(self):
+        """Test that process_entry writes the same JSON with the direct parser."""
+        import json
+        import preprocess_2
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            stream.Stream([note.Note("C4"), chord.Chord(["E4", "G4"])]).write("midi", fp=tmp / "direct.mid")
+            row = {"midi_filename": "direct.mid", "canonical_composer": "C",
+                   "canonical_title": "T", "year": 2020, "split": "train"}
+
+            preprocess_2.DATA_ROOT = tmp
+            try:
+                for parser in ("music21", "direct"):
+                    (tmp / parser).mkdir()
+                    process_entry(row, tmp / parser, parser=parser)
+            finally:
+                preprocess_2.DATA_ROOT = original_data_root
+
+            with open(tmp / "music21" / "direct.json") as f:
+                expected = json.load(f)
+            with open(tmp / "direct" / "direct.json") as f:
+                self.assertEqual(json.load(f), expected)
+
+    def test_process_entry_stores_detected_key(self):
+        """Test that process_entry keeps the detected key and transposition with the tokens."""
+        import json
+        import preprocess_2
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            # G major scale, normalized down to C major
+            notes = [note.Note(p) for p in ["G4", "A4", "B4", "C5", "D5", "E5", "F#5", "G5", "D5", "G4"]]
+            stream.Stream(notes).write("midi", fp=tmp / "in_g.mid")
+            row = {"midi_filename": "in_g.mid", "canonical_composer": "C",
+                   "canonical_title": "T", "year": 2020, "split": "train"}
+
+            preprocess_2.DATA_ROOT = tmp
+            try:
+                process_entry(row, tmp, parser="direct")
+            finally:
+                preprocess_2.DATA_ROOT = original_data_root
+
+            with open(tmp / "in_g.json") as f:
+                data = json.load(f)
+
+        self.assertEqual(data["metadata"]["key"], {"tonic": 7, "mode": "major", "transposition": -7})
+        self.assertEqual(data["tokens"][:3], [60, 62, 64])
+
+    def test_process_maestro_parallel_only_retokenizes_changed_inputs(self):
+        """Test that the manifest cache skips unchanged files and redoes changed content or settings."""
+        import json
+        import preprocess_2
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            stream.Stream([note.Note("C4"), note.Note("E4")]).write("midi", fp=tmp / "a.mid")
+            stream.Stream([note.Note("D4"), note.Note("F4")]).write("midi", fp=tmp / "b.mid")
+
+            csv_path = tmp / "data.csv"
+            pd.DataFrame([
+                {"split": "train", "midi_filename": name, "canonical_composer": "C",
+                 "canonical_title": "T", "year": 2020} for name in ["a.mid", "b.mid"]
+            ]).to_csv(csv_path, index=False)
+            out = tmp / "out"
+
+            def run(normalize=True):
+                process_maestro_parallel(csv_path=csv_path, output_dir=out, max_workers=1, normalize=normalize)
+
+            def mark_outputs():
+                for name in ["a", "b"]:
+                    (out / "train" / f"{name}.json").write_text('{"stale": true}')
+
+            def refreshed():
+                return sorted(name for name in ["a", "b"]
+                              if "tokens" in json.loads((out / "train" / f"{name}.json").read_text()))
+
+            preprocess_2.DATA_ROOT = tmp
+            try:
+                run()
+                self.assertEqual(set(json.loads((out / "manifest.json").read_text())), {"a.mid", "b.mid"})
+
+                mark_outputs()
+                run()
+                self.assertEqual(refreshed(), [])  # nothing changed
+
+                stream.Stream([note.Note("G4")]).write("midi", fp=tmp / "b.mid")
+                run()
+                self.assertEqual(refreshed(), ["b"])  # only the modified file
+
+                mark_outputs()
+                run(normalize=False)
+                self.assertEqual(refreshed(), ["a", "b"])  # settings changed
+            finally:
+                preprocess_2.DATA_ROOT = original_data_root
+
+    def test_make_chunks_balances_file_sizes(self):
+        """Test that large files get their own chunk and small files are batched."""
+        from preprocess_2 import make_chunks
+
+        tasks = [{"size": size} for size in [100, 5, 5, 5, 5, 50, 5, 5, 10, 10]]
+        chunks = make_chunks(tasks, 4)
+
+        self.assertEqual(sorted(t["size"] for chunk in chunks for t in chunk), sorted(t["size"] for t in tasks))
+        self.assertEqual([t["size"] for t in chunks[0]], [100])
+        self.assertLess(len(chunks), len(tasks))
+        self.assertEqual(make_chunks([], 4), [])
+
+    def test_process_maestro_parallel_reads_from_archive(self):
+        """Test that MIDI files and the CSV are read from the ZIP without extraction."""
+        import io
+        import zipfile
+        from preprocess_2 import ARCHIVE_ROOT, ZipMember
+        from corpus import Corpus
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            stream.Stream([note.Note("C4"), chord.Chord(["E4", "G4"])]).write("midi", fp=tmp / "piece.mid")
+            csv = io.StringIO()
+            pd.DataFrame([
+                {"split": "train", "midi_filename": "2004/piece.mid",
+                 "canonical_composer": "C", "canonical_title": "T", "year": 2020}
+            ]).to_csv(csv, index=False)
+
+            archive = tmp / "dataset.zip"
+            with zipfile.ZipFile(archive, "w") as zf:
+                zf.write(tmp / "piece.mid", f"{ARCHIVE_ROOT}/2004/piece.mid")
+                zf.writestr(f"{ARCHIVE_ROOT}/data.csv", csv.getvalue())
+
+            for parser in ("music21", "direct"):
+                member = ZipMember(str(archive), f"{ARCHIVE_ROOT}/2004/piece.mid")
+                self.assertEqual(parse_midi_file(member, parser=parser), parse_midi_file(tmp / "piece.mid"))
+
+            process_maestro_parallel(csv_path=tmp / "data.csv", output_dir=tmp / "out", max_workers=1,
+                                     corpus_dir=tmp / "corpus", parser="direct", archive=archive)
+
+            self.assertFalse((tmp / "data.csv").exists())
+            self.assertEqual(Corpus(tmp / "corpus" / "train")[0].tolist(),
+                             parse_midi_file(tmp / "piece.mid")[0])
@@ -1,28 +1,235 @@
+import os
+import sys
+import json
+import shutil
+import fnmatch
+import hashlib
 import zipfile
 from pathlib import Path
-from urllib.request import urlretrieve
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen, url2pathname
 
 URL = "https://storage.googleapis.com/magentadata/datasets/maestro/v3.0.0/maestro-v3.0.0-midi.zip"
 DATA_DIR = Path("data")
 MIDI_DIR = DATA_DIR / "midi"
 ZIP_PATH = DATA_DIR / "maestro-v3.0.0-midi.zip"
 
-def download_maestro():
+# Expected SHA-256 of the archive (None: only the ZIP's own CRCs are checked).
+# MAESTRO_SHA256 / MAESTRO_MIRROR override the checksum and the source
+# (a local path, file:// URL or another HTTP server with the same file).
+ZIP_SHA256 = os.environ.get("MAESTRO_SHA256")
+MIRROR = os.environ.get("MAESTRO_MIRROR")
+
+CHUNK_SIZE = 4 * 1024 * 1024
+DOWNLOAD_WORKERS = 4
+RETRIES = 3
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+# DOWNLOAD
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _local_path(source):
+    """Filesystem path of a local source (plain path or file:// URL), else None."""
+    parsed = urlparse(str(source))
+    if parsed.scheme == "file":
+        return Path(url2pathname(parsed.path))
+    if parsed.scheme in ("http", "https"):
+        return None
+    return Path(source)
+
+
+def _probe(url, timeout):
+    """(size, accepts byte ranges) of a remote file; size is None if unknown."""
+    with urlopen(Request(url, method="HEAD"), timeout=timeout) as response:
+        size = response.headers.get("Content-Length")
+        ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return (int(size) if size is not None else None), ranges
+
+
+def _fetch_range(url, part_path, start, end, timeout):
+    """Download bytes [start, end) of url into the same place of part_path."""
+    for attempt in range(RETRIES):
+        try:
+            request = Request(url, headers={"Range": f"bytes={start}-{end - 1}"})
+            with urlopen(request, timeout=timeout) as response:
+                if response.status != 206:
+                    raise OSError(f"Server ignored the range request (HTTP {response.status})")
+                data = response.read()
+            if len(data) != end - start:
+                raise OSError(f"Expected {end - start} bytes, got {len(data)}")
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                f.write(data)
+            return
+        except OSError:
+            if attempt == RETRIES - 1:
+                raise
+
+
+def _save_state(state_path, state):
+    tmp_path = state_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)  # a kill mid-write keeps the previous state
+
+
+def _download_ranges(url, part_path, size, chunk_size, workers, timeout):
+    """
+    Fetch the file in chunks of chunk_size, `workers` at a time.
+    Each finished chunk is recorded next to the partial file as soon as it is
+    written, so a download that is killed or fails resumes with the chunks
+    that are still missing.
+    """
+    state_path = part_path.with_name(part_path.name + ".json")
+    state = {"url": url, "size": size, "chunk_size": chunk_size, "done": []}
+    if part_path.exists() and state_path.exists():
+        with open(state_path, "r") as f:
+            saved = json.load(f)
+        if saved.get("size") == size and saved.get("chunk_size") == chunk_size:
+            state["done"] = saved["done"]
+
+    if not state["done"]:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+        _save_state(state_path, state)
+
+    done = set(state["done"])
+    missing = [i for i in range((size + chunk_size - 1) // chunk_size) if i not in done]
+    if done:
+        print(f"Resuming download: {len(missing)} chunks left")
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(_fetch_range, url, part_path, i * chunk_size,
+                            min((i + 1) * chunk_size, size), timeout): i
+            for i in missing
+        }
+        for future in as_completed(futures):
+            future.result()
+            state["done"].append(futures[future])
+            _save_state(state_path, state)
+    except BaseException:
+        # drop the queued chunks; the ones already running finish and are lost
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    state_path.unlink()
+
+
+def _download_stream(url, part_path, timeout):
+    """Plain download, for servers that do not support byte ranges."""
+    with urlopen(url, timeout=timeout) as response, open(part_path, "wb") as f:
+        shutil.copyfileobj(response, f, CHUNK_SIZE)
+
+
+def verify_zip(path, sha256=None):
+    """Raise ChecksumError if the file does not match sha256 (or, without it, is not a valid ZIP)."""
+    if sha256 is not None:
+        actual = file_sha256(path)
+        if actual != sha256.lower():
+            raise ChecksumError(f"SHA-256 mismatch for {path}: expected {sha256}, got {actual}")
+        return
+
+    try:
+        with zipfile.ZipFile(path) as zf:
+            bad = zf.testzip()
+    except zipfile.BadZipFile as e:
+        raise ChecksumError(f"{path} is not a valid ZIP file: {e}") from e
+    if bad is not None:
+        raise ChecksumError(f"CRC check failed for {bad} in {path}")
+
+
+def download_file(source, dest, sha256=None, chunk_size=CHUNK_SIZE, workers=DOWNLOAD_WORKERS,
+                  timeout=60, verify=verify_zip):
+    """
+    Download `source` (HTTP(S) URL, file:// URL or local path) to `dest`.
+    HTTP downloads go to dest + ".part" in parallel byte-range chunks and
+    resume after an interruption; servers without range support get a plain
+    download. The result is checked with verify(path, sha256) before it is
+    moved to `dest`; a file that fails the check is deleted.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part_path = dest.with_name(dest.name + ".part")
+
+    local = _local_path(source)
+    if local is not None:
+        shutil.copyfile(local, part_path)
+    else:
+        size, ranges = _probe(source, timeout)
+        if ranges and size:
+            _download_ranges(source, part_path, size, chunk_size, workers, timeout)
+        else:
+            _download_stream(source, part_path, timeout)
+
+    try:
+        verify(part_path, sha256)
+    except ChecksumError:
+        part_path.unlink()
+        raise
+    os.replace(part_path, dest)
+    return dest
+
+
+def download_maestro(url=URL, mirror=MIRROR, sha256=ZIP_SHA256, workers=DOWNLOAD_WORKERS):
+    """Download the MAESTRO archive, from the mirror first if one is set."""
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     if ZIP_PATH.exists():
         print("ZIP file already exists. Skipping download.")
-    else:
-        print(f"Downloading file from:\n{URL}")
-        urlretrieve(URL, ZIP_PATH)
-        print("Download complete.")
+        return
+
+    sources = [s for s in (mirror, url) if s]
+    for i, source in enumerate(sources):
+        print(f"Downloading file from:\n{source}")
+        try:
+            download_file(source, ZIP_PATH, sha256=sha256, workers=workers)
+            print("Download complete.")
+            return
+        except (OSError, ChecksumError) as e:
+            if i == len(sources) - 1:
+                raise
+            print(f"Download from {source} failed ({e}), trying next source")
+
 
-def extract_zip():
+# EXTRACTION
+def extract_zip(zip_path=ZIP_PATH, dest=DATA_DIR, patterns=None):
+    """
+    Extract the archive into `dest`.
+    `patterns` (fnmatch patterns such as "*.midi") restrict which members are
+    extracted; members already extracted with the same size are skipped.
+    """
+    dest = Path(dest)
     print("Extracting ZIP file...")
-    with zipfile.ZipFile(ZIP_PATH, 'r') as zip_ref:
-        zip_ref.extractall(DATA_DIR)
-    print("Extraction complete.")
+    extracted = 0
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for member in zip_ref.infolist():
+            if member.is_dir():
+                continue
+            if patterns and not any(fnmatch.fnmatch(member.filename, p) for p in patterns):
+                continue
+            target = dest / member.filename
+            if target.exists() and target.stat().st_size == member.file_size:
+                continue
+            zip_ref.extract(member, dest)
+            extracted += 1
+    print(f"Extraction complete ({extracted} files).")
 
 
 if __name__ == "__main__":
     download_maestro()
-    extract_zip()
\ No newline at end of file
+    # preprocess_2 reads the MIDI files from the ZIP; extract only on request
+    if "--extract" in sys.argv:
+        extract_zip()
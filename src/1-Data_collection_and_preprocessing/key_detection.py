@@ -0,0 +1,71 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+import vocabulary
+
+# Krumhansl-Schmuckler key finding on a pitch-class histogram, in NumPy.
+# The profiles are the Aarden-Essen weights used by music21's analyze('key'),
+# and ties are broken the same way, so the detected key (and the transposition
+# to C major / A minor) matches what music21 would give for the same notes.
+MAJOR_PROFILE = np.array([17.7661, 0.145624, 14.9265, 0.160186, 19.8049, 11.3587,
+                          0.291248, 22.062, 0.145624, 8.15494, 0.232998, 4.95122])
+MINOR_PROFILE = np.array([18.2648, 0.737619, 14.0499, 16.8599, 0.702494, 14.4362,
+                          0.702494, 18.6161, 4.56621, 1.93186, 7.37619, 1.75623])
+
+# Pitch class each mode is normalized to (C major, A minor)
+REFERENCE_TONIC = {"major": 0, "minor": 9}
+
+# row i = profile rotated to tonic i: _ROTATIONS[i, j] = (j - i) % 12
+_ROTATIONS = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+
+
+def pitch_class_histogram(pitches, durations):
+    """
+    Total duration (in quarter lengths) spent on each of the 12 pitch classes.
+    `pitches` and `durations` are parallel sequences (a chord contributes one
+    entry per pitch).
+    """
+    pitches = np.asarray(pitches, dtype=np.int64)
+    durations = np.asarray(durations, dtype=np.float64)
+    return np.bincount(pitches % 12, weights=durations, minlength=12)
+
+
+def _correlations(histogram, profile):
+    """Pearson correlation of the histogram with the profile rotated to each tonic."""
+    profiles = profile[_ROTATIONS] - profile.mean()
+    centered = histogram - histogram.mean()
+
+    top = profiles @ centered
+    bottom = np.sqrt((profiles ** 2).sum(axis=1) * (centered ** 2).sum())
+    if bottom[0] == 0:
+        return np.zeros(12)
+    return top / bottom
+
+
+def detect_key(histogram):
+    """
+    Most likely key of a pitch-class histogram.
+    Returns (tonic pitch class, "major" | "minor", correlation).
+    """
+    histogram = np.asarray(histogram, dtype=np.float64)
+    candidates = []
+    for mode, profile in (("major", MAJOR_PROFILE), ("minor", MINOR_PROFILE)):
+        for tonic, r in enumerate(_correlations(histogram, profile).tolist()):
+            candidates.append((r, tonic, mode))
+
+    # equal correlations: higher tonic first, then minor (as music21 sorts them)
+    r, tonic, mode = max(candidates)
+    return tonic, mode, r
+
+
+def key_shift(tonic, mode):
+    """Semitones that move a key to C major / A minor (between -11 and +9)."""
+    return REFERENCE_TONIC[mode] - tonic
+
+
+def transpose_tokens(tokens, shift):
+    """Move every (plain or timed) note token of a sequence by `shift` semitones."""
+    return vocabulary.transpose_ids(tokens, shift)
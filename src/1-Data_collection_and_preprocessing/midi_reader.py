@@ -0,0 +1,475 @@
+import math
+import struct
+from collections import namedtuple
+from fractions import Fraction
+
+# Lightweight Standard MIDI File reader.
+# Produces the same "highest note per onset" tokens as the music21 pipeline
+# (converter.parse -> partitionByInstrument -> flatten -> notesAndRests)
+# without building any music21 object. The music21 rules it reproduces:
+#   - a note-on takes the time of the next note-off of the same pitch/channel
+#   - notes starting (and ending) within 1/4 quarter of each other form a chord
+#   - onsets and durations are snapped to the 1/4 and 1/3 quarter grids
+#   - a note crossing a barline is split into tied notes, one token per measure
+# Files with a single track of notes (such as MAESTRO) are supported; files with
+# several instruments raise MidiFormatError so callers can fall back to music21.
+
+QUANTIZATION_DIVISORS = (4, 3)
+PERCUSSION_CHANNEL = 9  # MIDI channel 10
+
+# pitches -> every pitch of the chord (one for a single note)
+NoteGroup = namedtuple("NoteGroup", ["onset", "duration", "pitches", "percussion"])
+
+
+class MidiFormatError(ValueError):
+    pass
+
+
+# SMF PARSING
+def _read_varlen(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _parse_track(data, pos, end):
+    """
+    Parse one MTrk chunk.
+    Returns (notes, time_signatures, marker_ticks): notes are
+    (tick, pitch, channel, is_on) in file order, marker_ticks are the ticks of
+    the non-note events music21 turns into stream elements.
+    """
+    notes = []
+    time_signatures = []
+    markers = []
+    tick = 0
+    status = 0
+
+    while pos < end:
+        delta, pos = _read_varlen(data, pos)
+        tick += delta
+
+        byte = data[pos]
+        if byte & 0x80:
+            status = byte
+            pos += 1
+        elif not status:
+            raise MidiFormatError("Data byte without a status byte")
+
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = _read_varlen(data, pos + 1)
+            payload = data[pos:pos + length]
+            pos += length
+            if meta_type == 0x58 and length >= 2:
+                time_signatures.append((tick, payload[0], 2 ** payload[1]))
+            if meta_type in (0x03, 0x04, 0x51, 0x58, 0x59):
+                markers.append(tick)
+            if meta_type == 0x2F:
+                break
+            status = 0
+        elif status in (0xF0, 0xF7):
+            length, pos = _read_varlen(data, pos)
+            pos += length
+            status = 0
+        else:
+            kind = status & 0xF0
+            channel = status & 0x0F
+            if kind in (0xC0, 0xD0):
+                if kind == 0xC0:
+                    markers.append(tick)
+                pos += 1
+            else:
+                data1, data2 = data[pos], data[pos + 1]
+                pos += 2
+                if kind == 0x90:
+                    notes.append((tick, data1, channel, data2 > 0))
+                elif kind == 0x80:
+                    notes.append((tick, data1, channel, False))
+
+    return notes, time_signatures, markers
+
+
+def _read_chunks(data):
+    header_length, _, n_tracks, division = struct.unpack(">IHHH", data[4:14])
+    if division & 0x8000:
+        raise MidiFormatError("SMPTE time division is not supported")
+
+    pos = 8 + header_length
+    tracks = []
+    while pos + 8 <= len(data) and len(tracks) < n_tracks:
+        chunk_type = data[pos:pos + 4]
+        (length,) = struct.unpack(">I", data[pos + 4:pos + 8])
+        start, pos = pos + 8, pos + 8 + length
+        if chunk_type == b"MTrk":
+            tracks.append(_parse_track(data, start, min(pos, len(data))))
+
+    return division, tracks
+
+
+def read_midi(data):
+    """
+    Parse the bytes of a Standard MIDI File.
+    Returns (ticks_per_quarter, tracks) where every track is the
+    (notes, time_signatures, marker_ticks) tuple of _parse_track.
+    """
+    if data[:4] != b"MThd":
+        raise MidiFormatError("Not a MIDI file (missing MThd header)")
+    try:
+        return _read_chunks(data)
+    except (IndexError, struct.error) as e:
+        raise MidiFormatError(f"Truncated MIDI file: {e}") from e
+
+
+# NOTES AND CHORDS
+def pair_notes(events):
+    """
+    Match note-ons with note-offs like music21: walking backwards, every
+    note-on ends at the next note-off of its pitch and channel.
+    Note-ons that are never turned off are dropped.
+    Returns (on_tick, off_tick, pitch, channel) sorted by on_tick.
+    """
+    awaiting = {}
+    notes = []
+    for tick, pitch, channel, is_on in reversed(events):
+        if not is_on:
+            awaiting[pitch, channel] = tick
+        elif (pitch, channel) in awaiting:
+            notes.append((tick, awaiting[pitch, channel], pitch, channel))
+    notes.reverse()
+    return notes
+
+
+def group_chords(notes, ticks_per_quarter, divisors=QUANTIZATION_DIVISORS):
+    """
+    Gather notes that start and end within the quantization unit into chords.
+    Returns NoteGroups with onset and duration in quarter lengths (unquantized),
+    and whether two notes started together but ended apart (music21 then
+    splits the measures into voices).
+    """
+    tolerance = ticks_per_quarter / max(divisors)
+    gathered = [False] * len(notes)
+    groups = []
+    voices_required = False
+
+    for i, (on, off, pitch, channel) in enumerate(notes):
+        if gathered[i]:
+            continue
+        members = [notes[i]]
+        for j in range(i + 1, len(notes)):
+            other = notes[j]
+            if abs(other[0] - on) >= tolerance:
+                break
+            if abs(other[1] - off) > tolerance:
+                voices_required = True
+                continue
+            members.append(other)
+            gathered[j] = True
+
+        # music21 takes the chord duration from its last note
+        last_on, last_off = members[-1][0], members[-1][1]
+        groups.append(NoteGroup(
+            onset=on / ticks_per_quarter,
+            duration=(last_off - last_on) / ticks_per_quarter,
+            pitches=[m[2] for m in members],
+            percussion=any(m[3] == PERCUSSION_CHANNEL for m in members),
+        ))
+    return groups, voices_required
+
+
+# QUANTIZATION
+# music21 mixes floats (grid matches) and Fractions (stored offsets); the
+# float round-off decides between the two grids in borderline cases, so
+# the comparisons are done on the same floats and results kept exact.
+OFFSET_DENOMINATOR_LIMIT = 65535
+
+
+def _exact(value):
+    """Exact offset music21 stores for a float (music21 common.opFrac)."""
+    return Fraction(value).limit_denominator(OFFSET_DENOMINATOR_LIMIT)
+
+
+def _nearest_multiple(value, unit):
+    low = unit * math.floor(value / unit)
+    if value <= low + unit / 2:
+        return low, round(value - low, 7)
+    return low + unit, round(low + unit - value, 7)
+
+
+def quantize(value, divisors=QUANTIZATION_DIVISORS, zero_allowed=True, gap=0.0):
+    """
+    Snap a quarter length to the closest grid point of `divisors` (see
+    music21 Stream.quantize). A duration is preferably snapped so that it
+    fills the `gap` up to the next onset. Returns the grid point as a float.
+    """
+    found = []
+    for div in divisors:
+        unit = 1 / div
+        match, error = _nearest_multiple(value, unit)
+        if not zero_allowed and match == 0:
+            match = unit
+            error = abs(round(value - match, 7))
+        remaining = 0.0 if gap % unit == 0 else max(gap - match, 0.0)
+        found.append((remaining, error, unit, match))
+    return min(found)[3]
+
+
+def quantize_groups(groups, extra_onsets=(), divisors=QUANTIZATION_DIVISORS):
+    """
+    Quantize onsets and durations of time-sorted NoteGroups.
+    A duration is quantized looking ahead to the next later onset (of a note
+    or of a marker event such as a tempo change in the same track).
+    Returns a list of (onset, duration, group) with exact Fraction values.
+    """
+    onsets = [quantize(g.onset, divisors) for g in groups]
+    later = sorted(set(onsets).union(quantize(o, divisors) for o in extra_onsets))
+
+    quantized = []
+    k = 0
+    for onset, group in zip(onsets, groups):
+        while k < len(later) and later[k] <= onset:
+            k += 1
+        exact_onset = _exact(onset)
+        # a note without length is a grace note and keeps its zero duration
+        grace = group.duration == 0
+        gap = float(_exact(later[k] - float(exact_onset))) if k < len(later) else 0.0
+        duration = quantize(group.duration, divisors, zero_allowed=grace, gap=gap)
+        quantized.append((exact_onset, _exact(duration), group))
+    return quantized
+
+
+# MEASURES
+# Measure contents are lists of [offset in measure, insertion number, event]
+# kept in music21's order; an event is a mutable [duration, pitches, percussion].
+class _Measure:
+    __slots__ = ("start", "length", "notes", "voices")
+
+    def __init__(self, start, length):
+        self.start = start
+        self.length = length
+        self.notes = []
+        self.voices = None
+
+
+class _Counter:
+    def __init__(self):
+        self.value = 0
+
+    def __call__(self):
+        self.value += 1
+        return self.value
+
+
+def _bar_length(signatures, offset):
+    length = Fraction(4)
+    for start, bar in signatures:
+        if start > offset:
+            break
+        length = bar
+    return length
+
+
+def _make_measures(events, signatures, next_index):
+    """Distribute quantized (onset, duration, group) events into measures."""
+    end = max((onset + duration for onset, duration, _ in events), default=0)
+    measures = [_Measure(Fraction(0), _bar_length(signatures, 0))]
+    while measures[-1].start + measures[-1].length < end:
+        start = measures[-1].start + measures[-1].length
+        measures.append(_Measure(start, _bar_length(signatures, start)))
+
+    m = 0
+    # grace notes sort before the other notes of their offset
+    for onset, duration, group in sorted(events, key=lambda e: (e[0], e[1] != 0)):
+        while m + 1 < len(measures) and measures[m + 1].start <= onset:
+            m += 1
+        event = [duration, tuple(group.pitches), group.percussion]
+        measures[m].notes.append([onset - measures[m].start, next_index(), event])
+    return measures
+
+
+def _voice_count(notes):
+    """Size of the largest overlap group (music21 Stream.getOverlaps)."""
+    spans = [(offset, offset + event[0]) for offset, _, event in notes]
+    layering = [[] for _ in spans]
+    for i in range(len(spans)):
+        for j in range(i + 1, len(spans)):
+            first, second = sorted((spans[i], spans[j]))
+            if not second[0] < first[1]:
+                break
+            layering[i].append(j)
+            layering[j].append(i)
+
+    groups = {}
+    for i, overlapping in enumerate(layering):
+        if not overlapping:
+            continue
+        target = None
+        for j in sorted(overlapping):
+            stored = next((k for k, members in groups.items() if j in members), None)
+            if stored is not None:
+                target = stored
+            elif target is None:
+                target = spans[i][0]
+            if stored is None:
+                groups.setdefault(target, []).append(j)
+        if not any(i in members for members in groups.values()):
+            if target is None:
+                target = spans[i][0]
+            groups.setdefault(target, []).append(i)
+
+    return max([len(members) for members in groups.values()] + [1])
+
+
+def _make_voices(measure, next_index):
+    """Spread overlapping notes over voices (music21 Measure.makeVoices)."""
+    count = _voice_count(measure.notes)
+    if count == 1:
+        return
+
+    voices = [[] for _ in range(count)]
+    highest = [0] * count
+    for offset, _, event in measure.notes:
+        for v in range(count):
+            if highest[v] <= offset:
+                voices[v].append([offset, next_index(), event])
+                highest[v] = max(highest[v], offset + event[0])
+                break
+        # music21 drops a note that finds no free voice
+
+    measure.notes = []
+    measure.voices = [v for v in voices if v]
+
+
+def _insert_at_start(container, event, next_index):
+    entry = [0, next_index(), event]
+    position = 0
+    while position < len(container) and container[position][0] <= 0:
+        position += 1
+    container.insert(position, entry)
+
+
+def _make_ties(measures, signatures, next_index):
+    """Split events crossing a barline into tied pieces (music21 makeTies)."""
+    m = 0
+    while m < len(measures):
+        measure = measures[m]
+        if m + 1 < len(measures):
+            following, add = measures[m + 1], False
+        else:
+            start = measure.start + measure.length
+            following, add = _Measure(start, _bar_length(signatures, start)), True
+        following_has_voices = following.voices is not None
+
+        for container in (measure.voices or [measure.notes]):
+            for offset, _, event in list(container):
+                overshot = offset + event[0] - measure.length
+                if overshot <= 0 or offset >= measure.length:
+                    continue
+                event[0] = measure.length - offset
+                remain = [overshot, event[1], event[2]]
+
+                if following_has_voices:
+                    # voices are matched by id, which never succeeds for MIDI imports
+                    destination = following.notes if measure.voices else following.voices[0]
+                elif measure.voices:
+                    if following.voices is None:
+                        following.voices = []
+                    following.voices.append(following.notes)
+                    following.notes = []
+                    destination = following.voices[0]
+                else:
+                    destination = following.notes
+
+                _insert_at_start(destination, remain, next_index)
+                if add:
+                    measures.append(following)
+                    add = False
+        m += 1
+
+    # a single remaining voice is merged back into its measure
+    for measure in measures:
+        if measure.voices is None:
+            continue
+        measure.voices = [v for v in measure.voices if v]
+        if len(measure.voices) == 1:
+            for offset, _, event in measure.voices[0]:
+                measure.notes.append([offset, next_index(), event])
+            measure.notes.sort(key=lambda entry: (entry[0], entry[2][0] != 0, entry[1]))
+            measure.voices = None
+
+
+def _track_pieces(events, signatures, voices_required):
+    """(offset, event) of every note as music21 lays the track out in measures."""
+    next_index = _Counter()
+    measures = _make_measures(events, signatures, next_index)
+    if voices_required:
+        for measure in measures:
+            _make_voices(measure, next_index)
+    _make_ties(measures, signatures, next_index)
+
+    # music21 only splits the voices of a measure that has voices, so a
+    # longer note sitting next to them stretches the measure and shifts
+    # every following measure (makeRests lays measures out end to end)
+    pieces = []
+    start = 0
+    for measure in measures:
+        contents = [(offset, event) for container in (measure.voices or []) + [measure.notes]
+                    for offset, _, event in container]
+        pieces.extend((start + offset, event) for offset, event in contents)
+        start += max([measure.length] + [offset + event[0] for offset, event in contents])
+    return pieces
+
+
+# NOTES
+def read_midi_notes(data, divisors=QUANTIZATION_DIVISORS):
+    """
+    Notes and chords of a single-instrument MIDI file, as music21 reads them.
+    Returns (offset, duration, pitches) tuples in quarter lengths, in the order
+    of music21's flattened stream; a note tied over barlines appears once per
+    measure. Percussion (channel 10) is left out.
+    Raises MidiFormatError for files the reader does not handle.
+    """
+    ticks_per_quarter, tracks = read_midi(data)
+
+    note_tracks = []
+    conductor_signatures = []
+    for track in tracks:
+        if any(is_on for _, _, _, is_on in track[0]):
+            note_tracks.append(track)
+        else:
+            conductor_signatures.extend(track[1])
+    if len(note_tracks) > 1:
+        raise MidiFormatError("Several tracks with notes (music21 merges them by instrument)")
+
+    # music21 takes the meter from the tracks without notes, else from the notes track
+    track_signatures = conductor_signatures or [sig for track in note_tracks for sig in track[1]]
+    signatures = sorted(
+        (Fraction(tick, ticks_per_quarter), Fraction(numerator * 4, denominator))
+        for tick, numerator, denominator in track_signatures
+    )
+
+    pieces = []
+    for notes, _, markers in note_tracks:
+        groups, voices_required = group_chords(pair_notes(notes), ticks_per_quarter, divisors)
+        marker_offsets = [t / ticks_per_quarter for t in markers]
+        events = quantize_groups(groups, marker_offsets, divisors)
+        pieces = _track_pieces(events, signatures, voices_required)
+
+    # stable: simultaneous notes keep their measure order, grace notes first
+    pieces.sort(key=lambda piece: (piece[0], piece[1][0] != 0))
+    return [(offset, event[0], event[1]) for offset, event in pieces if not event[2]]
+
+
+def midi_to_pitches(data, divisors=QUANTIZATION_DIVISORS):
+    """Highest pitch of every note/chord of a MIDI file, in playing order."""
+    return [max(pitches) for _, _, pitches in read_midi_notes(data, divisors)]
+
+
+def read_midi_file(filepath, divisors=QUANTIZATION_DIVISORS):
+    """read_midi_notes for a file on disk."""
+    with open(filepath, "rb") as f:
+        return read_midi_notes(f.read(), divisors)
@@ -1,42 +1,106 @@
+import io
 import os
+import sys
 import json
+import hashlib
+import zipfile
 import pandas as pd
+from collections import namedtuple
+from fractions import Fraction
 from pathlib import Path
 from concurrent.futures import ProcessPoolExecutor, as_completed
-from music21 import converter, instrument, note, chord, interval
+from music21 import converter, instrument, note, chord
 from typing import Any
 
+import midi_reader
+import key_detection
+from data_collection_1 import ZIP_PATH
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+import vocabulary
+from corpus import convert_token_directory, CORPUS_DIR
+
 DATA_ROOT = Path("data/maestro-v3.0.0")
 CSV_PATH = DATA_ROOT / "maestro-v3.0.0.csv"
+# Folder of the dataset inside the downloaded archive (ZIP_PATH)
+ARCHIVE_ROOT = "maestro-v3.0.0"
 OUTPUT_DIR = Path("outputs/token_sequences")
 
+# "music21": full music21 parse; "direct": midi_reader fast path (same tokens;
+# in "timed" mode rests can differ where music21 lays out overlapping voices)
+PARSERS = ("music21", "direct")
+
+# "pitch": NOTE_<pitch> only; "timed": pitch + duration and rest tokens (see vocabulary)
+TOKEN_MODES = ("pitch", "timed")
+
+# Bump whenever a change to the tokenization rules changes the output tokens,
+# so process_maestro_parallel re-tokenizes every cached piece.
+TOKENIZER_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+# A MIDI file inside a ZIP archive; accepted wherever a MIDI path is
+ZipMember = namedtuple("ZipMember", ["archive", "name"])
+
+_open_archives = {}  # per process: archive path -> ZipFile
+
+# SOURCES
+def _archive(path):
+    archive = _open_archives.get(str(path))
+    if archive is None:
+        archive = _open_archives[str(path)] = zipfile.ZipFile(path)
+    return archive
+
+def midi_source(midi_filename, archive=None):
+    """Where a dataset file is read from: DATA_ROOT, or the archive if one is given."""
+    if archive is None:
+        return DATA_ROOT / midi_filename
+    return ZipMember(str(archive), f"{ARCHIVE_ROOT}/{midi_filename}")
+
+def read_source(source):
+    """Bytes of a MIDI file on disk or in a ZIP archive (no extraction)."""
+    if isinstance(source, ZipMember):
+        return _archive(source.archive).read(source.name)
+    with open(source, "rb") as f:
+        return f.read()
+
+def source_size(source):
+    """Size in bytes of a MIDI file on disk or (uncompressed) in a ZIP archive."""
+    if isinstance(source, ZipMember):
+        return _archive(source.archive).getinfo(source.name).file_size
+    return Path(source).stat().st_size
+
+def stream_histogram(midi_data):
+    """Pitch-class histogram of every pitched note of a music21 stream (see key_detection)."""
+    pitches, durations = [], []
+    for element in midi_data.flatten().notes:
+        if isinstance(element, note.Unpitched):
+            continue
+        for p in element.pitches:
+            pitches.append(p.midi)
+            durations.append(float(element.quarterLength))
+    return key_detection.pitch_class_histogram(pitches, durations)
+
 def normalize_key(midi_data):
     """
     Detects the key and transposes everything to C major or A minor.
     """
     try:
-        key = midi_data.analyze('key')
+        tonic, mode, _ = key_detection.detect_key(stream_histogram(midi_data))
     except:
         return midi_data  # fallback
 
-    if key.mode == "major":
-        interval_to_c = interval.Interval(key.tonic, note.Note("C"))
-    else:  # minor
-        interval_to_c = interval.Interval(key.tonic, note.Note("A"))
-
-    return midi_data.transpose(interval_to_c)
+    return midi_data.transpose(key_detection.key_shift(tonic, mode))
 
-def parse_midi_file(filepath, normalize=True):
-    """Convert a MIDI file into a simplified token sequence (only highest note, normalized key)."""
-
-    try:
-        midi_data: Any = converter.parse(filepath)
-    except Exception as e:
-        return None, f"Error reading {filepath}: {e}"
-
-    # Normalize key
-    if normalize:
-        midi_data = normalize_key(midi_data)
+def read_music21_notes(filepath):
+    """
+    (offset, duration, highest pitch) of every note/chord, not transposed,
+    and the pitch-class histogram of the piece, via music21.
+    """
+    if isinstance(filepath, ZipMember):
+        midi_data: Any = converter.parseData(read_source(filepath), format="midi")
+    else:
+        midi_data = converter.parse(filepath)
+    histogram = stream_histogram(midi_data)
 
     parts = instrument.partitionByInstrument(midi_data)
 
@@ -54,34 +118,143 @@ def parse_midi_file(filepath, normalize=True):
     # Always flatten
     flat = piano_stream.flatten()
 
-    tokens = []
+    notes = []
     for element in flat.notesAndRests:
         if isinstance(element, note.Note):
-            tokens.append(f"NOTE_{element.pitch.midi}")
+            notes.append((element.offset, element.quarterLength, element.pitch.midi))
 
         elif isinstance(element, chord.Chord):
             highest = max(p.midi for p in element.pitches)
-            tokens.append(f"NOTE_{highest}")
+            notes.append((element.offset, element.quarterLength, highest))
+
+    return notes, histogram
+
+def read_direct_notes(filepath):
+    """read_music21_notes without music21 streams: notes come from midi_reader."""
+    notes = midi_reader.read_midi_notes(read_source(filepath))
+    histogram = key_detection.pitch_class_histogram(
+        [p for _, _, pitches in notes for p in pitches],
+        [float(duration) for _, duration, pitches in notes for _ in pitches],
+    )
+    return [(offset, duration, max(pitches)) for offset, duration, pitches in notes], histogram
+
+def rest_tokens(gap):
+    """Rest tokens filling `gap` quarters (nothing for gaps shorter than half the shortest duration)."""
+    longest = vocabulary.DURATIONS[-1]
+    tokens = []
+    while gap >= longest:
+        tokens.append(vocabulary.rest(longest))
+        gap -= longest
+    if gap >= vocabulary.DURATIONS[0] / 2:
+        tokens.append(vocabulary.rest(gap))
+    return tokens
+
+def notes_to_tokens(notes, token_mode="pitch"):
+    """
+    Token ids of (offset, duration, pitch) notes in playing order.
+    "pitch": one NOTE_<pitch> per note. "timed": NOTE_<pitch>_<duration> per
+    note, with REST_<duration> tokens for the silences between notes. Like
+    pitch tokens, a note tied over a barline gives one token per measure.
+    """
+    if token_mode == "pitch":
+        return [pitch for _, _, pitch in notes]
+
+    tokens = []
+    end = None
+    for offset, duration, pitch in notes:
+        offset = Fraction(offset)
+        if end is not None and offset > end:
+            tokens.extend(rest_tokens(offset - end))
+        tokens.append(vocabulary.timed_note(pitch, duration))
+        note_end = offset + Fraction(duration)
+        end = note_end if end is None else max(end, note_end)
+    return tokens
+
+def read_tokens(filepath, parser="music21", token_mode="pitch"):
+    """
+    Tokens of a MIDI file before key normalization, with its pitch-class histogram.
+    Returns (tokens, histogram, None), or (None, None, error message).
+    The "direct" parser hands files midi_reader does not handle (several
+    instruments, SMPTE timing, damaged data) to music21.
+    """
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser: {parser!r} (expected one of {PARSERS})")
+    if token_mode not in TOKEN_MODES:
+        raise ValueError(f"Unknown token mode: {token_mode!r} (expected one of {TOKEN_MODES})")
+
+    try:
+        notes = None
+        if parser == "direct":
+            try:
+                notes, histogram = read_direct_notes(filepath)
+            except midi_reader.MidiFormatError:
+                pass
+        if notes is None:
+            notes, histogram = read_music21_notes(filepath)
+        return notes_to_tokens(notes, token_mode), histogram, None
+    except Exception as e:
+        return None, None, f"Error reading {filepath}: {e}"
+
+def detect_piece_key(tokens, histogram):
+    """
+    Key of a piece as stored in its metadata: tonic pitch class, mode and
+    the transposition applied by normalization (0 for pieces without notes).
+    """
+    if not tokens:
+        return {"tonic": None, "mode": None, "transposition": 0}
+    tonic, mode, _ = key_detection.detect_key(histogram)
+    return {"tonic": tonic, "mode": mode, "transposition": key_detection.key_shift(tonic, mode)}
+
+def finish_tokens(tokens, transposition=0):
+    """Apply the key transposition and append END."""
+    tokens = key_detection.transpose_tokens(tokens, transposition).tolist()
+    tokens.append(vocabulary.END)
+    return tokens
+
+def parse_midi_file(filepath, normalize=True, parser="music21", token_mode="pitch"):
+    """
+    Convert a MIDI file into a simplified token sequence (only highest note, normalized key).
+    Tokens are vocabulary ids: the MIDI pitch of each note, then vocabulary.END.
+    parser="direct" reads the MIDI events without building music21 streams.
+    token_mode="timed" gives pitch + duration tokens and rests instead.
+    """
+    tokens, histogram, error = read_tokens(filepath, parser, token_mode)
+    if error:
+        return None, error
 
-    tokens.append("END")
-    return tokens, None
+    # Normalize key: one integer offset on the extracted tokens
+    transposition = detect_piece_key(tokens, histogram)["transposition"] if normalize else 0
+    return finish_tokens(tokens, transposition), None
 
-def process_entry(row, output_dir):
-    midi_path = DATA_ROOT / row["midi_filename"]
+def process_entry(row, output_dir, parser="music21", normalize=True, overwrite=False, archive=None,
+                  token_mode="pitch"):
+    """
+    Tokenize one dataset row into output_dir/<piece>.json.
+    The MIDI file is read from DATA_ROOT, or straight from the dataset ZIP
+    if `archive` is given. An existing output is kept unless overwrite=True.
+    """
+    midi_path = Path(row["midi_filename"])
     out_path = output_dir / f"{midi_path.stem}.json"
-    if out_path.exists():
+    if out_path.exists() and not overwrite:
         return f"File already exists. Skipping: {midi_path.name}"
 
-    tokens, error = parse_midi_file(midi_path)
-    if error or not tokens:
+    tokens, histogram, error = read_tokens(midi_source(row["midi_filename"], archive), parser, token_mode)
+    if error:
         return f"Error: {error}"
 
+    # the detected key is kept with the tokens, so it never has to be recomputed
+    key = detect_piece_key(tokens, histogram)
+    if not normalize:
+        key["transposition"] = 0
+    tokens = finish_tokens(tokens, key["transposition"])
+
     metadata = {
         "composer": row["canonical_composer"],
         "title": row["canonical_title"],
         "year": row["year"],
         "split": row["split"],
-        "midi_file": str(row["midi_filename"])
+        "midi_file": str(row["midi_filename"]),
+        "key": key
     }
 
     with open(out_path, "w", encoding="utf-8") as f:
@@ -89,23 +262,198 @@ def process_entry(row, output_dir):
 
     return f"{midi_path.name}"
 
-def process_maestro_parallel(csv_path=CSV_PATH, output_dir=OUTPUT_DIR, max_workers=6):
-    df = pd.read_csv(csv_path)
+# CACHE
+def file_digest(path):
+    """SHA-256 of a file's content (a path or a ZipMember)."""
+    if isinstance(path, ZipMember):
+        return hashlib.sha256(read_source(path)).hexdigest()
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def tokenizer_settings(normalize=True, token_mode="pitch", parser="music21"):
+    """
+    Everything besides the MIDI content that the tokens depend on.
+    Both parsers produce the same pitch tokens, but timed rests can differ
+    where voices overlap, so the parser is part of the timed settings.
+    """
+    settings = {"version": TOKENIZER_VERSION, "normalize": normalize, "token_mode": token_mode}
+    if token_mode == "timed":
+        settings["parser"] = parser
+    return settings
+
+def cache_key(content_digest, settings):
+    """Key of a tokenized piece: MIDI content hash + tokenizer settings."""
+    payload = content_digest + json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_manifest(output_dir):
+    """{midi_filename: {"cache_key", "output"}} of the pieces tokenized so far."""
+    path = Path(output_dir) / MANIFEST_FILE
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return {}
+
+def save_manifest(output_dir, manifest):
+    path = Path(output_dir) / MANIFEST_FILE
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)  # never leave a half-written manifest
+
+def stale_entries(rows, output_dir, split, manifest, settings, archive=None):
+    """
+    Rows whose tokens must be (re)computed: new files, files whose content or
+    tokenizer settings changed since they were cached, and missing outputs.
+    Returns [(row, key)] where key is None if the MIDI file cannot be read.
+    """
+    stale = []
+    for row in rows:
+        name = str(row["midi_filename"])
+        output = f"{split}/{Path(name).stem}.json"
+        try:
+            key = cache_key(file_digest(midi_source(name, archive)), settings)
+        except (OSError, KeyError):  # KeyError: not in the archive
+            stale.append((row, None))
+            continue
+
+        entry = manifest.get(name)
+        if entry is None or entry["cache_key"] != key or entry["output"] != output \
+                or not (Path(output_dir) / output).exists():
+            stale.append((row, key))
+    return stale
+
+# PARALLEL PROCESSING
+def _init_worker(data_root):
+    """
+    Runs once in every worker process of the pool (music21 is imported with
+    this module, once per worker). Also passes DATA_ROOT on to workers that
+    do not inherit the parent's globals.
+    """
+    global DATA_ROOT
+    DATA_ROOT = Path(data_root)
+    # archives opened by the parent share its file offset after a fork
+    _open_archives.clear()
+
+def make_chunks(tasks, num_chunks):
+    """
+    Group tasks into about num_chunks chunks of similar total MIDI size.
+    Tasks are taken largest first, so long pieces end up alone in the first
+    chunks and the small ones batched together at the end.
+    """
+    tasks = sorted(tasks, key=lambda task: task["size"], reverse=True)
+    target = max(sum(task["size"] for task in tasks) / max(num_chunks, 1), 1)
+
+    chunks = []
+    current = []
+    current_size = 0
+    for task in tasks:
+        current.append(task)
+        current_size += task["size"]
+        if current_size >= target:
+            chunks.append(current)
+            current = []
+            current_size = 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+def process_chunk(tasks, output_dir, parser="music21", normalize=True, archive=None, token_mode="pitch"):
+    """Tokenize a chunk of tasks in a worker. Returns [(task, message)]."""
+    return [
+        (task, process_entry(task["row"], output_dir / task["split"], parser, normalize,
+                             overwrite=True, archive=archive, token_mode=token_mode))
+        for task in tasks
+    ]
+
+def process_maestro_parallel(csv_path=CSV_PATH, output_dir=OUTPUT_DIR, max_workers=6, corpus_dir=None,
+                             parser="music21", normalize=True, chunks_per_worker=4, archive=None,
+                             token_mode="pitch"):
+    """
+    Tokenize every MIDI file of the dataset into output_dir/<split>/<piece>.json.
+    Only files whose content or tokenizer settings changed since the last run
+    are tokenized again (see output_dir/manifest.json).
+    Every split shares one process pool; files are sent to the workers in
+    chunks of similar size (about chunks_per_worker chunks per worker).
+    If corpus_dir is given, each split is also consolidated into
+    corpus_dir/<split> (see corpus.py) for fast loading.
+    parser="direct" uses the midi_reader fast path instead of music21 streams.
+    With `archive` (the dataset ZIP), MIDI files, and the CSV if csv_path
+    does not exist, are read from the archive without extracting it.
+    token_mode="timed" adds durations and rests to the tokens (see notes_to_tokens).
+    """
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser: {parser!r} (expected one of {PARSERS})")
+    if token_mode not in TOKEN_MODES:
+        raise ValueError(f"Unknown token mode: {token_mode!r} (expected one of {TOKEN_MODES})")
+
+    if archive is not None and not Path(csv_path).exists():
+        df = pd.read_csv(io.BytesIO(read_source(ZipMember(str(archive), f"{ARCHIVE_ROOT}/{Path(csv_path).name}"))))
+    else:
+        df = pd.read_csv(csv_path)
     print(f"{len(df)} entries found in the dataset.")
 
-    for split in ["train", "validation", "test"]:
-        subset = df[df["split"] == split]
-        split_dir = output_dir / split
-        split_dir.mkdir(parents=True, exist_ok=True)
-        print(f"\nProcessing {split} ({len(subset)} files)")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    settings = tokenizer_settings(normalize, token_mode, parser)
+
+    splits = ["train", "validation", "test"]
+    tasks = []
+    for split in splits:
+        (output_dir / split).mkdir(parents=True, exist_ok=True)
+        rows = df[df["split"] == split].to_dict("records")
+        stale = stale_entries(rows, output_dir, split, manifest, settings, archive)
+        print(f"{split}: {len(stale)} of {len(rows)} files changed")
+
+        for row, key in stale:
+            try:
+                size = source_size(midi_source(row["midi_filename"], archive))
+            except (OSError, KeyError):
+                size = 0
+            tasks.append({"row": row, "split": split, "key": key, "size": size})
+
+    chunks = make_chunks(tasks, max_workers * chunks_per_worker)
+    print(f"\nProcessing {len(tasks)} files in {len(chunks)} chunks")
+
+    done = 0
+    errors = 0
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(str(DATA_ROOT),)) as executor:
+            futures = [executor.submit(process_chunk, chunk, output_dir, parser, normalize, archive, token_mode) for chunk in chunks]
+            for f in as_completed(futures):
+                for task, msg in f.result():
+                    name = str(task["row"]["midi_filename"])
+                    if task["key"] is not None and not msg.startswith("Error"):
+                        manifest[name] = {"cache_key": task["key"], "output": f"{task['split']}/{Path(name).stem}.json"}
+                    else:
+                        manifest.pop(name, None)
+                        errors += 1
+                        print(msg)
+                    done += 1
+                print(f"[{done}/{len(tasks)}] files done, {errors} errors")
+    finally:
+        save_manifest(output_dir, manifest)  # keep the progress of an interrupted run
 
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(process_entry, row, split_dir) for _, row in subset.iterrows()]
-            for i, f in enumerate(as_completed(futures), 1):
-                msg = f.result()
-                print(f"[{i}/{len(futures)}] {msg}")
+    if corpus_dir is not None:
+        for split in splits:
+            convert_token_directory(output_dir / split, Path(corpus_dir) / split)
 
 if __name__ == "__main__":
     workers = (os.cpu_count() or 2) - 1
     workers = max(workers, 1)
-    process_maestro_parallel(max_workers=workers)
\ No newline at end of file
+    # read the MIDI files straight from the downloaded ZIP unless it was extracted
+    archive = ZIP_PATH if ZIP_PATH.exists() and not DATA_ROOT.exists() else None
+    # --timed: pitch + duration and rest tokens instead of pitches only
+    token_mode = "timed" if "--timed" in sys.argv else "pitch"
+    process_maestro_parallel(max_workers=workers, corpus_dir=CORPUS_DIR, parser="direct", archive=archive,
+                             token_mode=token_mode)
\ No newline at end of file
@@ -0,0 +1,101 @@
+import unittest
+import tempfile
+from pathlib import Path
+from training_1 import count_tables, train_markov_chain
+from count_table import CountTable
+
+
+class Testcount_table(unittest.TestCase):
+    """Unit tests for the mergeable CountTable."""
+
+    def setUp(self):
+        """Prepare a temporary directory and two corpus shards with different vocabularies."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+        self.shard_a = [[60, 62, 64, 62, 60, 128], [60, 62, 60, 128]]
+        self.shard_b = [[48, 60, 62, 64, 72, 128]]
+
+    def tearDown(self):
+        """Clean up temporary directory."""
+        self.temp_dir.cleanup()
+
+    def test_merge_equals_counting_whole_corpus(self):
+        """Test that merging shard tables gives the same counts as one table over all data."""
+        whole = count_tables(self.shard_a + self.shard_b, [2])[2]
+        merged = count_tables(self.shard_a, [2])[2].merge(count_tables(self.shard_b, [2])[2])
+
+        self.assertEqual(merged.vocab, whole.vocab)
+        self.assertEqual(merged.state_keys.tolist(), whole.state_keys.tolist())
+        self.assertEqual(merged.next_ids.tolist(), whole.next_ids.tolist())
+        self.assertEqual(merged.counts.tolist(), whole.counts.tolist())
+        self.assertEqual(merged.total(), whole.total())
+
+    def test_merge_sums_repeated_transitions(self):
+        """Test that the same transition seen in two tables has its counts added."""
+        table = count_tables([[1, 2]], [1])[1]
+        merged = CountTable.merge_all([table, table, table])
+        self.assertEqual(merged.counts.tolist(), [3])
+
+    def test_merge_rejects_different_orders(self):
+        """Test that tables of different orders cannot be merged."""
+        tables = count_tables(self.shard_a, [1, 2])
+        with self.assertRaises(ValueError):
+            tables[1].merge(tables[2])
+
+    def test_merge_all_rejects_empty_input(self):
+        """Test that merging nothing raises ValueError."""
+        with self.assertRaises(ValueError):
+            CountTable.merge_all([])
+
+    def test_to_model_matches_train_markov_chain(self):
+        """Test that normalizing a table gives the trained model."""
+        table = count_tables(self.shard_a, [1])[1]
+        self.assertEqual(table.to_model(), train_markov_chain(self.shard_a, order=1))
+
+    def test_empty_table_gives_empty_model(self):
+        """Test that an empty table normalizes to an empty model."""
+        self.assertEqual(CountTable(1, [], [], [], []).to_model(), {})
+
+    def test_save_and_load_round_trip(self):
+        """Test that a saved table loads back with the same contents."""
+        table = count_tables(self.shard_a, [2])[2]
+        path = self.temp_path / "shard.counts"
+        table.save(path)
+        loaded = CountTable.load(path)
+
+        self.assertEqual(loaded.order, 2)
+        self.assertEqual(loaded.vocab, table.vocab)
+        self.assertEqual(loaded.counts.tolist(), table.counts.tolist())
+        self.assertEqual(loaded.to_model(), table.to_model())
+
+    def test_load_reads_counts_stored_in_model_file(self):
+        """Test that a model saved from a table loads back as the same table."""
+        table = count_tables(self.shard_a, [2])[2]
+        path = self.temp_path / "model.bin"
+        table.save_model(path)
+        loaded = CountTable.load(path)
+
+        self.assertEqual(loaded.state_keys.tolist(), table.state_keys.tolist())
+        self.assertEqual(loaded.counts.tolist(), table.counts.tolist())
+        self.assertIsNotNone(loaded.probs)
+
+    def test_load_rejects_model_files_without_counts(self):
+        """Test that loading a model saved without counts raises ValueError."""
+        from model_io import save_binary_model
+        path = self.temp_path / "model.bin"
+        save_binary_model({(1,): {2: 1.0}}, path)
+        with self.assertRaises(ValueError):
+            CountTable.load(path)
+
+    def test_update_renormalizes_only_affected_states(self):
+        """Test that update recomputes probabilities of new states and keeps the others."""
+        table = count_tables(self.shard_a, [1])[1]
+        table.probs = table.probabilities()
+        table.probs[:] = 0.25  # marker values that a full renormalization would overwrite
+
+        updated = table.update(count_tables([[64, 72, 128]], [1])[1])
+        model = dict(zip(zip(updated.state_keys.tolist(), updated.next_ids.tolist()), updated.probs.tolist()))
+        ids = {t: i for i, t in enumerate(updated.vocab)}
+
+        self.assertAlmostEqual(model[(ids[64], ids[72])], 0.5)  # 64 -> 62 (x1), 64 -> 72 (x1)
+        self.assertEqual(model[(ids[60], ids[62])], 0.25)       # untouched marker
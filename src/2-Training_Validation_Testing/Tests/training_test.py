@@ -2,7 +2,10 @@ import unittest
 import json
 import tempfile
 from pathlib import Path
-from training_1 import load_train_sequences, train_markov_chain, save_model
+from training_1 import load_train_sequences, iter_train_sequences, count_tables_streaming, train_markov_chain, train_markov_chains, train_markov_chains_parallel, count_tables, save_model, update_model
+from model_io import load_model
+from vocabulary import END
+from corpus import write_corpus
 
 
 class Testtraining_1(unittest.TestCase):
@@ -37,6 +40,25 @@ class Testtraining_1(unittest.TestCase):
         result = load_train_sequences(root=str(self.temp_path))
         self.assertEqual(result, [[1, 2, 3]])
 
+    def test_load_train_sequences_encodes_token_strings(self):
+        """Test that token strings are converted to vocabulary ids on load."""
+        (self.temp_path / "piece.json").write_text(json.dumps({"tokens": ["NOTE_60", "NOTE_62", "END"]}))
+
+        result = load_train_sequences(root=str(self.temp_path))
+        self.assertEqual(result, [[60, 62, END]])
+
+    def test_load_train_sequences_reads_consolidated_corpus(self):
+        """Test that load_train_sequences also accepts a consolidated corpus directory."""
+        write_corpus(self.temp_path / "train", [[60, 62, END], [64, END]])
+
+        result = load_train_sequences(root=self.temp_path / "train")
+        self.assertEqual([list(map(int, seq)) for seq in result], [[60, 62, END], [64, END]])
+
+    def test_iter_train_sequences_raises_when_folder_missing(self):
+        """Test that the streaming loader fails as soon as it is created for a missing folder."""
+        with self.assertRaises(FileNotFoundError):
+            iter_train_sequences(root="non_existent_directory_123")
+
     # train_markov_chain
 
     def test_train_markov_chain_empty_input_returns_empty_model(self):
@@ -65,20 +87,120 @@ class Testtraining_1(unittest.TestCase):
         # transitions: 2→3 occurs twice, 2→? no others
         self.assertAlmostEqual(model[state][3], 1.0)
 
+    def test_train_markov_chain_matches_reference_counts(self):
+        """Test that the vectorized counting gives the same probabilities as counting by hand."""
+        sequences = [[60, 62, 60, 64, 60, 62, END], [62, 60, 62, END], [60]]
+        model = train_markov_chain(sequences, order=2)
+
+        self.assertEqual(model, {
+            (60, 62): {60: 1 / 3, END: 2 / 3},
+            (62, 60): {64: 0.5, 62: 0.5},
+            (60, 64): {60: 1.0},
+            (64, 60): {62: 1.0},
+        })
+
+    def test_train_markov_chain_windows_do_not_cross_sequences(self):
+        """Test that no state spans the boundary between two sequences."""
+        model = train_markov_chain([[1, 2], [3, 4]], order=1)
+        self.assertEqual(model, {(1,): {2: 1.0}, (3,): {4: 1.0}})
+
+    def test_train_markov_chain_accepts_string_tokens(self):
+        """Test that token strings are counted like any other token."""
+        model = train_markov_chain([["NOTE_60", "NOTE_62", "NOTE_60", "END"]], order=1)
+        self.assertEqual(model[("NOTE_60",)], {"NOTE_62": 0.5, "END": 0.5})
+
+    # train_markov_chains
+
+    def test_train_markov_chains_matches_single_order_training(self):
+        """Test that multi-order training gives the same models as training each order separately."""
+        sequences = [[60, 62, 64, 62, 60, 62, 64, END], [64, 62, 60, END], [60, 62]]
+        models = train_markov_chains(sequences, orders=[1, 2, 3, 4])
+
+        self.assertEqual(sorted(models), [1, 2, 3, 4])
+        for order, model in models.items():
+            self.assertEqual(model, train_markov_chain(sequences, order=order))
+
+    def test_train_markov_chains_rejects_non_positive_orders(self):
+        """Test that an order below 1 raises ValueError."""
+        with self.assertRaises(ValueError):
+            train_markov_chains([[1, 2, 3]], orders=[0, 1])
+
+    def test_train_markov_chains_parallel_matches_serial_training(self):
+        """Test that sharded training in a process pool gives the same models as serial training."""
+        sequences = [[60, 62, 64, 62, 60, END], [64, 62, 60, END], [48, 60, 62, 64, END], [60]]
+        parallel = train_markov_chains_parallel(sequences, orders=[1, 2], max_workers=2, shards=3)
+        self.assertEqual(parallel, train_markov_chains(sequences, orders=[1, 2]))
+
+    def test_count_tables_streaming_matches_in_memory_counting(self):
+        """Test that chunked counting of a stream gives the same models as counting everything at once."""
+        sequences = [[60, 62, 64, 62, 60, END], [64, 62, 60, END], [48, 60, 62, 64, END]] * 5
+        tables = count_tables_streaming(iter(sequences), [1, 2], chunk_tokens=4)
+        expected = train_markov_chains(sequences, orders=[1, 2])
+
+        self.assertEqual({order: t.to_model() for order, t in tables.items()}, expected)
+
     # save_model
 
-    def test_save_model_raises_typeerror_when_state_contains_non_strings(self):
-        """Test that save_model raises TypeError when tuple elements are not strings."""
-        model = {(1, 2): {3: 0.5, 4: 0.5}}
+    def test_save_model_json_export_renders_integer_states(self):
+        """Test that save_model renders integer token ids as token strings in a .json export."""
+        model = {(60, 62): {64: 0.5, END: 0.5}}
         out_file = self.temp_path / "model.json"
 
-        with self.assertRaises(TypeError):
-            save_model(model, out_file)
+        save_model(model, out_file)
+        exported = json.loads(out_file.read_text())
+        self.assertEqual(exported, {"NOTE_60,NOTE_62": {"NOTE_64": 0.5, "END": 0.5}})
 
-    def test_save_model_raises_typeerror_for_nested_directories_with_non_string_state(self):
-        """Test that save_model raises TypeError even when parent directories must be created."""
+    def test_save_model_writes_binary_for_nested_directories(self):
+        """Test that save_model writes a loadable binary model, creating parent directories."""
         model = {(9,): {1: 1.0}}
-        nested_path = self.temp_path / "nested" / "deep" / "model.json"
-
-        with self.assertRaises(TypeError):
-            save_model(model, nested_path)
+        nested_path = self.temp_path / "nested" / "deep" / "model.bin"
+
+        save_model(model, nested_path)
+        self.assertEqual(load_model(nested_path), model)
+
+    # update_model
+
+    def test_update_model_matches_retraining_on_all_data(self):
+        """Test that updating a saved model gives the same model as retraining on old + new data."""
+        old = [[60, 62, 64, 62, 60, END], [62, 64, 62, END]]
+        new = [[60, 62, 60, END], [48, 50, END]]
+        path = self.temp_path / "model.bin"
+        count_tables(old, [1])[1].save_model(path)
+
+        update_model(path, new)
+        updated = load_model(path)
+        expected = train_markov_chain(old + new, order=1)
+
+        self.assertEqual(set(updated), set(expected))
+        for state, transitions in expected.items():
+            self.assertEqual(set(updated[state]), set(transitions))
+            for token, prob in transitions.items():
+                self.assertAlmostEqual(updated[state][token], prob, places=6)
+
+    def test_update_model_keeps_unaffected_states(self):
+        """Test that states absent from the new data keep their stored probabilities."""
+        path = self.temp_path / "model.bin"
+        count_tables([[60, 62, 60, 64, END]], [1])[1].save_model(path)
+        before = load_model(path)[(64,)]
+
+        update_model(path, [[62, 60, 62, END]])
+        self.assertEqual(load_model(path)[(64,)], before)
+
+    def test_update_model_rebuilds_the_backoff_table(self):
+        """Test that a backoff table saved next to the model is rebuilt from the updated model."""
+        from backoff_model import map_backoff_model, save_backoff_model
+        from model_io import MappedModel
+        path = self.temp_path / "markov_order1.bin"
+        count_tables([[60, 62, 60, 64, END]], [1])[1].save_model(path)
+        save_backoff_model(self.temp_path)
+
+        update_model(path, [[62, 67, 62, END]])
+        table = map_backoff_model(self.temp_path / "markov_backoff.bin")
+        self.assertTrue(table.built_from([MappedModel(path)]))
+
+    def test_update_model_rejects_models_without_counts(self):
+        """Test that a model saved from probabilities only cannot be updated."""
+        path = self.temp_path / "model.bin"
+        save_model({(60,): {62: 1.0}}, path)
+        with self.assertRaises(ValueError):
+            update_model(path, [[60, 62]])
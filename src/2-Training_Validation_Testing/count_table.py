@@ -0,0 +1,206 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+from model_io import pack_states, unpack_states, sort_tokens, write_arrays, read_arrays, write_model_arrays
+
+
+def _reduce(grams, counts):
+    """Sum the counts of equal gram keys. Returns sorted unique keys and their totals."""
+    ordering = np.argsort(grams, kind="stable")
+    grams = grams[ordering]
+    counts = counts[ordering]
+    if len(grams) == 0:
+        return grams, counts
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(grams)) + 1))
+    return grams[starts], np.add.reduceat(counts, starts)
+
+
+def _normalize(state_keys, counts):
+    """count / state total for transitions grouped by (sorted) state key."""
+    if len(counts) == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    row_starts = np.concatenate(([0], np.flatnonzero(np.diff(state_keys)) + 1))
+    row_lengths = np.diff(np.append(row_starts, len(counts)))
+    totals = np.add.reduceat(counts, row_starts)
+    return counts / np.repeat(totals, row_lengths)
+
+
+class CountTable:
+    """
+    Raw (state -> next token) counts of one Markov order.
+    Tables trained on different shards of a corpus (possibly on different
+    machines) can be saved, merged and only then normalized into a model.
+
+    state_keys pack `order` ids of `vocab` in base len(vocab); the three
+    arrays are sorted by state, then next id. `probs` holds the stored
+    probabilities when the table was loaded from a model file.
+    """
+
+    def __init__(self, order, vocab, state_keys, next_ids, counts, probs=None):
+        self.order = order
+        self.vocab = list(vocab)
+        self.state_keys = np.asarray(state_keys, dtype=np.int64)
+        self.next_ids = np.asarray(next_ids, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.probs = probs
+
+    @property
+    def base(self):
+        return max(len(self.vocab), 1)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    # MERGING
+    def _mapping_to(self, vocab):
+        index = {token: i for i, token in enumerate(vocab)}
+        return np.array([index[t] for t in self.vocab], dtype=np.int64).reshape(-1)
+
+    def _states_in(self, vocab, base):
+        """State keys of every transition re-encoded for another vocabulary."""
+        state_ids = unpack_states(self.state_keys, self.base, self.order)
+        return pack_states(self._mapping_to(vocab)[state_ids], base)
+
+    def _grams_in(self, vocab, base):
+        """Gram keys (state + next token) of this table re-encoded for another vocabulary."""
+        return self._states_in(vocab, base) * base + self._mapping_to(vocab)[self.next_ids]
+
+    @classmethod
+    def merge_all(cls, tables):
+        """Merge count tables of the same order into one table (counts are summed)."""
+        tables = list(tables)
+        if not tables:
+            raise ValueError("Nothing to merge")
+
+        order = tables[0].order
+        if any(t.order != order for t in tables):
+            raise ValueError("Cannot merge count tables of different orders")
+
+        vocab = sort_tokens(set().union(*(t.vocab for t in tables)))
+        base = max(len(vocab), 1)
+        if base ** (order + 1) >= 2 ** 63:
+            raise ValueError(f"Vocabulary of {base} tokens is too large for order {order}")
+
+        grams, counts = _reduce(
+            np.concatenate([t._grams_in(vocab, base) for t in tables]),
+            np.concatenate([t.counts for t in tables]),
+        )
+        return cls(order, vocab, grams // base, grams % base, counts)
+
+    def merge(self, other):
+        return CountTable.merge_all([self, other])
+
+    def update(self, new):
+        """
+        Merge the counts of `new` into this table.
+        If this table carries stored probabilities, only the states that occur
+        in `new` are renormalized; every other state keeps its stored values.
+        Returns the merged table (with probabilities).
+        """
+        merged = self.merge(new)
+        if self.probs is None:
+            merged.probs = merged.probabilities()
+            return merged
+
+        base = merged.base
+        new_states = np.unique(new._states_in(merged.vocab, base))
+        affected = np.isin(merged.state_keys, new_states)
+        was_affected = np.isin(self._states_in(merged.vocab, base), new_states)
+
+        # Unaffected rows are identical (and in the same order) in both tables
+        probs = np.empty(len(merged), dtype=np.float64)
+        probs[~affected] = self.probs[~was_affected]
+        probs[affected] = _normalize(merged.state_keys[affected], merged.counts[affected])
+        merged.probs = probs
+        return merged
+
+    # NORMALIZATION
+    def _rows(self):
+        """Start and end index of the transitions of every state."""
+        if len(self.counts) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        row_starts = np.concatenate(([0], np.flatnonzero(np.diff(self.state_keys)) + 1))
+        row_ends = np.append(row_starts[1:], len(self.counts))
+        return row_starts, row_ends
+
+    def probabilities(self):
+        """Probability of every transition (count / total count of its state)."""
+        return _normalize(self.state_keys, self.counts)
+
+    def to_model(self):
+        """Normalize counts into a {state_tuple: {token: prob}} dict."""
+        row_starts, row_ends = self._rows()
+        probs = self.probabilities().tolist()
+
+        vocab = self.vocab
+        states = unpack_states(self.state_keys[row_starts], self.base, self.order).tolist()
+        next_ids = self.next_ids.tolist()
+
+        model = {}
+        for state, start, end in zip(states, row_starts.tolist(), row_ends.tolist()):
+            model[tuple(vocab[i] for i in state)] = {
+                vocab[next_ids[j]]: probs[j] for j in range(start, end)
+            }
+        return model
+
+    # SERIALIZATION
+    def save(self, path):
+        """Save the table in the binary container used for models."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        write_arrays(path, {"kind": "counts", "order": self.order, "vocab": self.vocab}, {
+            "state_keys": self.state_keys.astype("<i8"),
+            "next_ids": self.next_ids.astype("<i4"),
+            "counts": self.counts.astype("<i8"),
+        })
+
+    def save_model(self, path):
+        """
+        Save the table as a model file: normalized probabilities plus the raw
+        counts, so the model can be updated later (see training_1.update_model).
+        """
+        row_starts, _ = self._rows()
+        probs = self.probs if self.probs is not None else self.probabilities()
+
+        write_model_arrays(
+            path,
+            self.order,
+            self.vocab,
+            self.state_keys[row_starts],
+            np.append(row_starts, len(self.counts)),
+            self.next_ids,
+            probs,
+            counts=self.counts,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load a count table saved with save(), or the counts stored in a model file."""
+        with open(path, "rb") as f:
+            header, arrays = read_arrays(f.read())
+
+        if header.get("kind") == "counts":
+            return cls(header["order"], header["vocab"], arrays["state_keys"], arrays["next_ids"], arrays["counts"])
+
+        if "counts" not in arrays:
+            raise ValueError(f"{path} was saved without counts and cannot be updated")
+
+        state_keys = np.repeat(arrays["state_keys"], np.diff(arrays["offsets"]))
+        return cls(
+            header["order"],
+            header["vocab"],
+            state_keys,
+            arrays["next_ids"],
+            arrays["counts"],
+            probs=arrays["probs"].astype(np.float64),
+        )
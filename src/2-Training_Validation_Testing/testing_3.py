@@ -1,46 +1,31 @@
-import json
 import math
+import sys
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+import model_io
+import sequence_loader
 
-def load_model(path):
-    """Load a trained Markov model JSON."""
-    with open(path, "r") as f:
-        raw_model = json.load(f)
-
-    model = {}
-    for state_str, transitions in raw_model.items():
-        # Convert string "NOTE_60,NOTE_62" -> tuple ("NOTE_60", "NOTE_62")
-        state_tuple = tuple(state_str.split(","))
-        model[state_tuple] = transitions
 
-    return model
+def load_model(path):
+    """Load a trained Markov model (binary, or a legacy .json export)."""
+    return model_io.load_model(path)
 
-def load_sequences(root="outputs/token_sequences/test"):
+def load_sequences(root=None):
     """
-    Load sequences from the test dataset.
-    Returns: list of token lists
+    Load sequences from the test dataset (consolidated corpus or JSON folder).
+    Returns: list of token id lists
     """
-    root_path = Path(root)
-    sequences = []
-
-    if not root_path.exists():
-        raise FileNotFoundError(f"Test directory not found: {root}")
-
-    for file in root_path.glob("*.json"):
-        try:
-            with open(file, "r") as f:
-                data = json.load(f)
-                seq = data.get("tokens")
-                if seq:
-                    sequences.append(seq)
-        except Exception as e:
-            print(f"Error reading {file}: {e}")
-
+    sequences = sequence_loader.load_sequences(root or sequence_loader.split_root("test"), "Test directory")
     print(f"Loaded {len(sequences)} test sequences.")
     return sequences
 
 
+def iter_sequences(root=None):
+    """Stream sequences from the test dataset, one piece at a time."""
+    return sequence_loader.iter_sequences(root or sequence_loader.split_root("test"), "Test directory")
+
+
 def compute_log_likelihood(model, sequence):
     """
     Compute log-likelihood for higher-order Markov models.
@@ -90,16 +75,13 @@ if __name__ == "__main__":
     '''
     best_order = 2
 
-    model_path = f"models/markov_order{best_order}.json"
+    model_path = model_io.model_path(best_order)
     print(f"Loading best model (order {best_order}) from {model_path}")
 
     model = load_model(model_path)
 
-    print("Loading test sequences")
-    test_sequences = load_sequences()
-
-    print("Evaluating on test split")
-    avg_ll = evaluate_model(model, test_sequences)
+    print("Evaluating on streamed test split")
+    avg_ll = evaluate_model(model, iter_sequences())
 
     print("\nTEST RESULTS:")
     print(f"Final average log-likelihood (order {best_order}): {avg_ll:.4f}")
\ No newline at end of file
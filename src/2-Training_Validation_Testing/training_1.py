@@ -1,82 +1,244 @@
-import json
-from collections import defaultdict
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
 
-# Load token sequences for training
-def load_train_sequences(root="outputs/token_sequences/train"):
-    root = Path(root)
-    sequences = []
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+from model_io import save_binary_model, export_json, backoff_path
+from backoff_model import save_backoff_model
+from sequence_loader import iter_sequences, load_sequences, split_root
+from count_table import CountTable
 
-    if not root.exists():
-        raise FileNotFoundError(f"Train folder not found: {root}")
-
-    for file in root.glob("*.json"):
-        try:
-            with open(file, "r") as f:
-                data = json.load(f)
-                tokens = data.get("tokens")
-                if tokens:
-                    sequences.append(tokens)
-        except Exception as e:
-            print(f"Error reading {file}: {e}")
 
+# Load token sequences for training (consolidated corpus or JSON folder)
+def load_train_sequences(root=None):
+    sequences = load_sequences(root or split_root("train"), "Train folder", as_arrays=True)
     print(f"Loaded {len(sequences)} sequences for training.")
     return sequences
 
 
+# Stream token sequences for training, one piece at a time
+def iter_train_sequences(root=None):
+    return iter_sequences(root or split_root("train"), "Train folder", as_arrays=True)
+
+
+def _encode_corpus(sequences, min_length):
+    """
+    Concatenate every sequence longer than `min_length` into one array of
+    dense ids (0..len(vocab)-1).
+    Returns (vocab, ids, starts, lengths).
+    """
+    arrays = [np.asarray(seq) for seq in sequences if len(seq) > min_length]
+    if not arrays:
+        return [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    vocab, ids = np.unique(np.concatenate(arrays), return_inverse=True)
+    return vocab.tolist(), ids.astype(np.int64), starts, lengths
+
+
+def _count_windows(ids, starts, lengths, orders, base):
+    """
+    Yield (order, grams, counts) for every requested order in one sweep.
+    Packed window keys are extended one token at a time (key * base + next id),
+    so the keys of order k are built from those of order k - 1 instead of
+    rescanning the corpus. Windows crossing a sequence end are masked out.
+    """
+    remaining = np.repeat(starts + lengths, lengths) - np.arange(len(ids))
+
+    keys = ids.copy()
+    width = 1
+    for order in sorted(orders):
+        while width < order + 1:
+            shifted = np.zeros_like(ids)
+            shifted[:len(ids) - width] = ids[width:]
+            keys = keys * base + shifted
+            width += 1
+
+        grams, counts = np.unique(keys[remaining >= width], return_counts=True)
+        yield order, grams, counts
+
+
+def count_all_transitions(sequences, orders):
+    """
+    Count (state -> next token) transitions for several orders with NumPy.
+    Every window of order + 1 tokens is packed into one integer and reduced
+    with np.unique, so the cost is a sort instead of a Python loop per token.
+    Returns (vocab, {order: (state_keys, next_ids, counts)}), each sorted by
+    state then next id, where state_keys pack `order` ids of `vocab` in base
+    len(vocab).
+    """
+    orders = sorted(set(orders))
+    if not orders:
+        return [], {}
+    if orders[0] < 1:
+        raise ValueError("Orders must be >= 1")
+
+    vocab, ids, starts, lengths = _encode_corpus(sequences, orders[0])
+    base = max(len(vocab), 1)
+    if base ** (orders[-1] + 1) >= 2 ** 63:
+        raise ValueError(f"Vocabulary of {base} tokens is too large for order {orders[-1]}")
+
+    tables = {}
+    for order, grams, counts in _count_windows(ids, starts, lengths, orders, base):
+        tables[order] = (grams // base, grams % base, counts)
+    return vocab, tables
+
+
+def count_transitions(sequences, order):
+    """
+    Count transitions for a single order.
+    Returns (vocab, state_keys, next_ids, counts), see count_all_transitions.
+    """
+    vocab, tables = count_all_transitions(sequences, [order])
+    return (vocab, *tables[order])
+
+
+def count_tables(sequences, orders):
+    """Count transitions for several orders. Returns {order: CountTable}."""
+    vocab, tables = count_all_transitions(sequences, orders)
+    return {order: CountTable(order, vocab, *table) for order, table in tables.items()}
+
+
 def train_markov_chain(sequences, order=1):
     """
     Train a Markov model of arbitrary order.
     states are n-grams of length = order
     """
+    return train_markov_chains(sequences, orders=[order])[order]
+
+
+def train_markov_chains(sequences, orders=(1, 2, 3, 4)):
+    """
+    Train Markov models of several orders with a single pass over the corpus.
+    Returns {order: model}.
+    """
+    return {order: table.to_model() for order, table in count_tables(sequences, orders).items()}
 
-    transitions = defaultdict(lambda: defaultdict(int))
 
+def count_tables_streaming(sequences, orders, chunk_tokens=1_000_000):
+    """
+    Count transitions of a stream of sequences (e.g. iter_train_sequences()).
+    Sequences are counted in chunks of about `chunk_tokens` tokens as they
+    arrive and the partial tables are merged, so memory is bounded by one
+    chunk plus the count tables rather than by the whole split.
+    Returns {order: CountTable}.
+    """
+    orders = list(orders)
+    partial = {order: [] for order in orders}
+
+    def flush(chunk):
+        for order, table in count_tables(chunk, orders).items():
+            partial[order].append(table)
+            if len(partial[order]) >= 8:
+                partial[order] = [CountTable.merge_all(partial[order])]
+
+    chunk, size = [], 0
     for seq in sequences:
-        if len(seq) <= order:
-            continue  # skip short sequences
+        chunk.append(seq)
+        size += len(seq)
+        if size >= chunk_tokens:
+            flush(chunk)
+            chunk, size = [], 0
+    if chunk:
+        flush(chunk)
+
+    return {
+        order: CountTable.merge_all(tables) if tables else CountTable(order, [], [], [], [])
+        for order, tables in partial.items()
+    }
+
+
+def _split_shards(sequences, shards):
+    """Split sequences into `shards` groups with roughly the same number of tokens."""
+    groups = [[] for _ in range(shards)]
+    sizes = [0] * shards
+    for seq in sorted(sequences, key=len, reverse=True):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(seq)
+        sizes[smallest] += len(seq)
+    return [g for g in groups if g]
+
+
+def train_count_tables_parallel(sequences, orders=(1, 2, 3, 4), max_workers=6, shards=None):
+    """
+    Count transitions on shards of the corpus in a process pool and merge them.
+    Returns {order: CountTable}.
+    """
+    shards = shards or max_workers
+    orders = list(orders)
+    partial = {order: [] for order in orders}
 
-        # build state transitions
-        for i in range(len(seq) - order):
-            state = tuple(seq[i:i + order])
-            next_token = seq[i + order]
-            transitions[state][next_token] += 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(count_tables, shard, orders) for shard in _split_shards(sequences, shards)]
+        for f in as_completed(futures):
+            for order, table in f.result().items():
+                partial[order].append(table)
 
-    # convert counts to probabilities
-    model = {}
-    for state, next_counts in transitions.items():
-        total = sum(next_counts.values())
-        model[state] = {
-            token: count / total
-            for token, count in next_counts.items()
-        }
+    return {
+        order: CountTable.merge_all(tables) if tables else CountTable(order, [], [], [], [])
+        for order, tables in partial.items()
+    }
 
-    return model
 
+def train_markov_chains_parallel(sequences, orders=(1, 2, 3, 4), max_workers=6, shards=None):
+    """Parallel version of train_markov_chains (sharded counting, then merge and normalize)."""
+    tables = train_count_tables_parallel(sequences, orders, max_workers, shards)
+    return {order: table.to_model() for order, table in tables.items()}
 
-# Save model as JSON (convert tuple keys to strings)
+
+# Save model in the binary format (or as a JSON export when path ends in .json)
 def save_model(model, path):
     path = Path(path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-
-    # convert tuple keys into strings for JSON compatibility
-    json_ready = {",".join(state): probs for state, probs in model.items()}
 
-    with open(path, "w") as f:
-        json.dump(json_ready, f, indent=2)
+    if path.suffix == ".json":
+        export_json(model, path)
+    else:
+        save_binary_model(model, path)
 
     print(f"Saved model to {path}")
 
 
+# Fold new sequences into a saved model without retraining on the whole corpus
+def update_model(model_path, new_sequences):
+    """
+    Add the transitions of `new_sequences` to the model stored at `model_path`
+    (which must have been saved with its counts) and rewrite it.
+    Only the states that occur in the new data are renormalized.
+    Returns the updated CountTable.
+    """
+    table = CountTable.load(model_path)
+    new = count_tables(new_sequences, [table.order])[table.order]
+
+    updated = table.update(new)
+    updated.save_model(model_path)
+
+    print(f"Updated {model_path} with {new.total()} new transitions")
+
+    # The backoff table saved next to the models must match them again
+    if backoff_path(Path(model_path).parent).exists():
+        print(f"Rebuilt {save_backoff_model(Path(model_path).parent)}")
+    return updated
+
+
 # Main training pipeline
 if __name__ == "__main__":
     print("Loading training data...")
     sequences = load_train_sequences()
 
-    for order in [1, 2, 3, 4]:
-        print(f"\nTraining Markov model of order {order}")
-        model = train_markov_chain(sequences, order=order)
+    workers = max((os.cpu_count() or 2) - 1, 1)
+
+    print("\nTraining Markov models of orders 1-4")
+    tables = train_count_tables_parallel(sequences, orders=[1, 2, 3, 4], max_workers=workers)
+
+    # Counts are stored next to the probabilities so update_model can extend them
+    for order, table in tables.items():
+        output_path = f"models/markov_order{order}.bin"
+        table.save_model(output_path)
+        print(f"Saved model to {output_path}")
 
-        output_path = f"models/markov_order{order}.json"
-        save_model(model, output_path)
\ No newline at end of file
+    # One backoff table for all orders, memory-mapped by the generator
+    print(f"Saved backoff table to {save_backoff_model()}")
\ No newline at end of file
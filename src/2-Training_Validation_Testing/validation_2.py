@@ -1,42 +1,29 @@
-import json
 import math
+import sys
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+import model_io
+from sequence_loader import iter_sequences, load_sequences, split_root
 
-# Load validation sequences
-def load_validation_sequences(root="outputs/token_sequences/validation"):
-    root = Path(root)
-    sequences = []
-
-    if not root.exists():
-        raise FileNotFoundError(f"Validation folder not found: {root}")
-
-    for file in root.glob("*.json"):
-        try:
-            with open(file, "r") as f:
-                data = json.load(f)
-                tokens = data.get("tokens")
-                if tokens:
-                    sequences.append(tokens)
-        except Exception as e:
-            print(f"Error reading {file}: {e}")
 
+# Load validation sequences (consolidated corpus or JSON folder)
+def load_validation_sequences(root=None):
+    sequences = load_sequences(root or split_root("validation"), "Validation folder")
     print(f"Loaded {len(sequences)} validation sequences.")
     return sequences
 
 
-# Load trained Markov model
-def load_model(path):
-    with open(path, "r") as f:
-        raw_model = json.load(f)
-
-    model = {}
+# Stream validation sequences, one piece at a time
+def iter_validation_sequences(root=None):
+    return iter_sequences(root or split_root("validation"), "Validation folder")
 
-    for state_str, transitions in raw_model.items():
-        state_tuple = tuple(state_str.split(","))
-        model[state_tuple] = transitions
 
-    return model
+# Load trained Markov model (binary, or a legacy .json export).
+# Binary models are memory-mapped: all orders are scored in one pass, and
+# mapped models only bring in the pages the validation states touch.
+def load_model(path):
+    return model_io.load_model(path, mapped=True)
 
 
 # Compute log-likelihood of a sequence under a given model
@@ -70,29 +57,31 @@ def sequence_log_likelihood(sequence, model, order):
 
 # Evaluate all models and print results
 if __name__ == "__main__":
-    print("Loading validation data...")
-    sequences = load_validation_sequences()
-
-    print("\nEvaluating Markov models...\n")
+    print("Loading models...")
+    models = {}
 
     for order in [1, 2, 3, 4]:
-        model_path = Path(f"models/markov_order{order}.json")
+        model_path = model_io.model_path(order)
 
         if not model_path.exists():
             print(f"Model for order {order} not found: {model_path}")
             continue
 
-        print(f"Evaluating order {order} model...")
+        models[order] = load_model(model_path)
+
+    print("\nEvaluating Markov models on streamed validation data...\n")
 
-        model = load_model(model_path)
+    # One pass over the split scores every model, so each piece is read once
+    total_ll = {order: 0.0 for order in models}
+    count = 0
 
-        total_ll = 0.0
-        count = 0
+    for seq in iter_validation_sequences():
+        for order, model in models.items():
+            total_ll[order] += sequence_log_likelihood(seq, model, order)
+        count += 1
 
-        for seq in sequences:
-            ll = sequence_log_likelihood(seq, model, order)
-            total_ll += ll
-            count += 1
+    print(f"Evaluated {count} validation sequences.")
 
-        avg_ll = total_ll / max(1, count)
-        print(f"Order {order} average log-likelihood: {avg_ll:.2f}\n")
\ No newline at end of file
+    for order in models:
+        avg_ll = total_ll[order] / max(1, count)
+        print(f"Order {order} average log-likelihood: {avg_ll:.2f}\n")
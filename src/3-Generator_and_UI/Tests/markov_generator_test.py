@@ -1,10 +1,17 @@
 import unittest
-from markov_generator import transpose_note, transpose_sequence, validate_inputs, load_model, weighted_choice, generate_sequence, KEY_TO_SEMITONES, _MODEL_CACHE
+import tempfile
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from markov_generator import transpose_note, transpose_sequence, validate_inputs, load_model, weighted_choice, next_token, generate_sequence, generate_batch, make_rng, spawn_rngs, BackoffModel, load_backoff_model, KEY_TO_SEMITONES, _MODEL_CACHE, _BACKOFF_CACHE, _BACKOFF_TABLE
+from model_io import save_binary_model, MappedModel, ArrayModel
+from backoff_model import save_backoff_model
+from vocabulary import END, timed_note, rest
 
 class TestScript(unittest.TestCase):
     def setUp(self):
         # Common seed and configuration used in multiple tests
-        self.sample_seed = ["NOTE_60", "NOTE_61"]
+        self.sample_seed = [60, 61]
         self.sample_order = 2
         self.sample_measures = 1
         self.sample_key = "C"
@@ -23,6 +30,15 @@ class TestScript(unittest.TestCase):
         """transpose_note must correctly subtract semitones."""
         self.assertEqual(transpose_note("NOTE_60", -2), "NOTE_58")
 
+    def test_transpose_note_transposes_integer_ids(self):
+        """transpose_note must add semitones to pitch ids directly."""
+        self.assertEqual(transpose_note(60, 3), 63)
+        self.assertEqual(transpose_note(60, -2), 58)
+
+    def test_transpose_note_returns_end_id_unchanged(self):
+        """transpose_note must leave the END id unchanged."""
+        self.assertEqual(transpose_note(END, 5), END)
+
     # transpose_sequence
 
     def test_transpose_sequence_applies_transposition_to_all_notes(self):
@@ -31,6 +47,11 @@ class TestScript(unittest.TestCase):
         result = transpose_sequence(seq, 2)
         self.assertEqual(result, ["NOTE_62", "NOTE_64"])
 
+    def test_transpose_sequence_folds_out_of_range_pitches(self):
+        """transpose_sequence must keep pitches within 0-127 by octave folding."""
+        self.assertEqual(transpose_sequence([120, 127, END], 11), [119, 126, END])
+        self.assertEqual(transpose_sequence(["NOTE_2", "END"], -3), ["NOTE_11", "END"])
+
     # validate_inputs
 
     def test_validate_inputs_raises_for_invalid_order(self):
@@ -41,7 +62,7 @@ class TestScript(unittest.TestCase):
     def test_validate_inputs_raises_for_seed_length_mismatch(self):
         """validate_inputs must fail when seed length does not match order."""
         with self.assertRaises(ValueError):
-            validate_inputs(3, ["NOTE_60"], self.sample_measures, self.sample_key)
+            validate_inputs(3, [60], self.sample_measures, self.sample_key)
 
     def test_validate_inputs_raises_for_nonpositive_measures(self):
         """validate_inputs must fail when measures <= 0."""
@@ -83,6 +104,16 @@ class TestScript(unittest.TestCase):
         choice = weighted_choice(dist)
         self.assertIn(choice, dist.keys())
 
+    # next_token
+
+    def test_next_token_samples_dict_and_array_models(self):
+        """next_token must sample from dict and array models and return None for unseen states."""
+        model = {(60,): {62: 1.0}, (62,): {60: 0.0, 64: 1.0}}
+        for m in (model, ArrayModel.from_dict(model)):
+            self.assertEqual(next_token(m, (60,)), 62)
+            self.assertEqual(next_token(m, (62,)), 64)
+            self.assertIsNone(next_token(m, (61,)))
+
     # generate_sequence
 
     def test_generate_sequence_calls_validation_and_raises_on_invalid_input(self):
@@ -94,36 +125,207 @@ class TestScript(unittest.TestCase):
         """generate_sequence must stop immediately if seed state not in model."""
         _MODEL_CACHE.clear()
         _MODEL_CACHE[2] = {}  # empty model -> no state match
-        output = generate_sequence(2, ["NOTE_60", "NOTE_61"], 1, "C")
+        output = generate_sequence(2, [60, 61], 1, "C")
         # Only seed, because state not found in model
-        self.assertEqual(output, ["NOTE_60", "NOTE_61"])
+        self.assertEqual(output, [60, 61])
 
     def test_generate_sequence_stops_when_next_note_is_end(self):
-        """generate_sequence must stop when next note is 'END'."""
+        """generate_sequence must stop when next note is END."""
         _MODEL_CACHE.clear()
         _MODEL_CACHE[2] = {
-            ("NOTE_60", "NOTE_61"): {"END": 1}
+            (60, 61): {END: 1}
         }
-        output = generate_sequence(2, ["NOTE_60", "NOTE_61"], 2, "C")
+        output = generate_sequence(2, [60, 61], 2, "C")
         # Seed only, since END stops generation
-        self.assertEqual(output, ["NOTE_60", "NOTE_61"])
+        self.assertEqual(output, [60, 61])
 
     def test_generate_sequence_generates_notes_until_measure_limit(self):
         """generate_sequence must append valid notes until reaching note limit."""
         _MODEL_CACHE.clear()
         _MODEL_CACHE[1] = {
-            ("NOTE_60",): {"NOTE_61": 1},
-            ("NOTE_61",): {"NOTE_62": 1},
-            ("NOTE_62",): {"NOTE_63": 1},
-            ("NOTE_63",): {"END": 1},
+            (60,): {61: 1},
+            (61,): {62: 1},
+            (62,): {63: 1},
+            (63,): {END: 1},
         }
-        output = generate_sequence(1, ["NOTE_60"], 2, "C")  # 8 notes max
+        output = generate_sequence(1, [60], 2, "C")  # 8 notes max
         self.assertTrue(len(output) >= 1)
 
     def test_generate_sequence_transposes_seed_and_back(self):
         """generate_sequence must transpose seed to normalized key and back to original."""
         _MODEL_CACHE.clear()
-        _MODEL_CACHE[1] = {("NOTE_60",): {"END": 1}}
-        output = generate_sequence(1, ["NOTE_62"], 1, "D")  # D -> -2 semitones normalization
+        _MODEL_CACHE[1] = {(60,): {END: 1}}
+        output = generate_sequence(1, [62], 1, "D")  # D -> -2 semitones normalization
         # After normalization and reverse transposition, original seed should remain
-        self.assertEqual(output, ["NOTE_62"])
\ No newline at end of file
+        self.assertEqual(output, [62])
+
+    def test_generate_sequence_accepts_token_string_seed(self):
+        """generate_sequence must encode token string seeds and return token ids."""
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE[1] = {(60,): {62: 1}, (62,): {END: 1}}
+        output = generate_sequence(1, ["NOTE_60"], 1, "C")
+        self.assertEqual(output, [60, 62])
+
+    def test_generate_sequence_with_memory_mapped_model(self):
+        """generate_sequence must work on a memory-mapped binary model."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "markov_order1.bin"
+            save_binary_model({
+                (60,): {62: 1.0},
+                (62,): {60: 1.0},
+            }, path)
+            model = MappedModel(path)
+            _MODEL_CACHE.clear()
+            _MODEL_CACHE[1] = model
+            try:
+                output = generate_sequence(1, [60], 1, "C")
+            finally:
+                _MODEL_CACHE.clear()
+                model.close()
+        self.assertEqual(output, [60, 62, 60, 62])
+
+    def test_generate_sequence_counts_measures_by_duration(self):
+        """generate_sequence must fill measures by the durations of timed tokens."""
+        quarter, half, quarter_rest = timed_note(60, 1), timed_note(62, 2), rest(1)
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE[1] = {(quarter,): {half: 1}, (half,): {quarter_rest: 1}, (quarter_rest,): {quarter: 1}}
+        # plain pitch seed becomes a quarter note; 2 measures = 8 quarters
+        output = generate_sequence(1, [60], 2, "C")
+        self.assertEqual(output, [quarter, half, quarter_rest, quarter, half, quarter_rest])
+
+    def test_generate_sequence_transposes_timed_tokens(self):
+        """generate_sequence must transpose timed notes without changing their durations."""
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE[1] = {(timed_note(60, 1),): {timed_note(64, 0.5): 1}, (timed_note(64, 0.5),): {END: 1}}
+        output = generate_sequence(1, ["NOTE_62_1"], 1, "D")
+        self.assertEqual(output, [timed_note(62, 1), timed_note(66, 0.5)])
+
+    # generate_batch
+
+    def test_generate_batch_matches_scalar_generation(self):
+        """generate_batch must give the same sequences as generate_sequence for a deterministic model."""
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE[2] = {(60, 62): {64: 1}, (62, 64): {65: 1}, (64, 65): {60: 1}, (65, 60): {62: 1}}
+        batch = generate_batch(2, [62, 64], 2, "D", 3)
+        self.assertEqual(batch.shape, (3, 8))
+        for row in batch.tolist():
+            self.assertEqual(row, generate_sequence(2, [62, 64], 2, "D"))
+
+    def test_generate_batch_pads_finished_chains_with_end(self):
+        """generate_batch must pad chains that hit END or an unseen state."""
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE[1] = {(60,): {62: 1}, (62,): {64: 1}, (64,): {END: 1}}
+        batch = generate_batch(1, [[60], [64], [61]], 2, "C", 3)
+        self.assertEqual(batch.tolist(), [[60, 62, 64], [64, END, END], [61, END, END]])
+
+    def test_generate_batch_rejects_wrong_number_of_seeds(self):
+        """generate_batch must fail when the number of seeds is neither 1 nor n."""
+        with self.assertRaises(ValueError):
+            generate_batch(1, [[60], [62]], 1, "C", 3)
+
+    # random streams
+
+    def _random_model(self):
+        """Order-1 model where every state has several possible continuations."""
+        return {(p,): {q: 1.0 for q in range(60, 72)} for p in range(60, 72)}
+
+    def test_generate_sequence_is_reproducible_with_seed(self):
+        """generate_sequence must return the same sequence for the same rng seed."""
+        for model in (self._random_model(), ArrayModel.from_dict(self._random_model())):
+            _MODEL_CACHE.clear()
+            _MODEL_CACHE[1] = model
+            first = generate_sequence(1, [60], 8, "C", rng=7)
+            self.assertEqual(generate_sequence(1, [60], 8, "C", rng=7), first)
+            self.assertEqual(generate_sequence(1, [60], 8, "C", rng=make_rng(7)), first)
+            self.assertNotEqual(generate_sequence(1, [60], 8, "C", rng=8), first)
+
+    def test_spawned_streams_make_parallel_batches_deterministic(self):
+        """Batches generated in threads with spawned streams must not depend on scheduling."""
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE[1] = ArrayModel.from_dict(self._random_model())
+
+        def run():
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                batches = executor.map(lambda rng: generate_batch(1, [60], 4, "C", 50, rng=rng), spawn_rngs(42, 8))
+                return [b.tolist() for b in batches]
+
+        first = run()
+        self.assertEqual(run(), first)
+        self.assertNotEqual(first[0], first[1])
+
+    # backoff
+
+    def _backoff_models(self):
+        """Order-1 and order-2 models where (62, 64) leads to an unseen order-2 state."""
+        order1 = {(60,): {62: 1.0}, (62,): {64: 1.0}, (64,): {60: 0.5, END: 0.5}}
+        order2 = {(60, 62): {64: 1.0}, (62, 64): {65: 1.0}}
+        return order1, order2
+
+    def test_backoff_model_points_to_longest_known_suffix(self):
+        """Every transition must lead to the row of the longest known suffix of state + token."""
+        order1, order2 = self._backoff_models()
+        model = BackoffModel.from_models({1: order1, 2: order2})
+        row = model.start_row([60, 62])
+        token, row = model.sample(row, 0.5)
+        self.assertEqual(token, 64)
+        self.assertEqual(row, model.start_row([62, 64]))
+        token, row = model.sample(row, 0.5)
+        # (64, 65) and (65,) are unseen: back off to the note frequencies
+        self.assertEqual((token, row), (65, 0))
+        self.assertEqual(model.start_row([64, 65]), 0)
+
+    def test_backoff_model_requires_consecutive_orders(self):
+        """BackoffModel must reject a set of models with missing orders."""
+        order1, order2 = self._backoff_models()
+        with self.assertRaises(ValueError):
+            BackoffModel.from_models({2: order2})
+
+    def test_generate_sequence_with_backoff_fills_every_measure(self):
+        """generate_sequence(backoff=True) must not stop at unseen states or END."""
+        order1, order2 = self._backoff_models()
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE.update({1: order1, 2: order2})
+        self.assertEqual(len(generate_sequence(2, [60, 62], 4, "C")), 4)
+        for rng in range(5):
+            output = generate_sequence(2, [60, 62], 4, "C", rng=rng, backoff=True)
+            self.assertEqual(len(output), 16)
+            self.assertNotIn(END, output)
+
+    def test_generate_batch_with_backoff_fills_every_measure(self):
+        """generate_batch(backoff=True) must return full-length rows without padding."""
+        order1, order2 = self._backoff_models()
+        _MODEL_CACHE.clear()
+        _MODEL_CACHE.update({1: order1, 2: order2})
+        batch = generate_batch(2, [[60, 62], [70, 71]], 4, "C", 2, rng=0, backoff=True)
+        self.assertEqual(batch.shape, (2, 16))
+        self.assertNotIn(END, batch.tolist()[0] + batch.tolist()[1])
+
+    def test_load_backoff_model_maps_the_trained_table(self):
+        """load_backoff_model must map the saved table when it matches the models, else build one."""
+        order1, order2 = self._backoff_models()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            models_dir = Path(tmpdir) / "models"
+            save_binary_model(order1, models_dir / "markov_order1.bin")
+            save_binary_model(order2, models_dir / "markov_order2.bin")
+            save_backoff_model(models_dir)
+
+            cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                _MODEL_CACHE.clear()
+                _BACKOFF_CACHE.clear()
+                for order in (1, 2):
+                    model = load_backoff_model(order)
+                    self.assertEqual(model.order, order)
+                    self.assertFalse(model.next_rows.flags.owndata)  # a view on the mapped file
+
+                # a table built from other models is not used
+                _MODEL_CACHE[2] = {(60, 62): {65: 1.0}}
+                model = load_backoff_model(2)
+                self.assertTrue(model.next_rows.flags.owndata)
+                self.assertEqual(model.sample(model.start_row([60, 62]), 0.5)[0], 65)
+            finally:
+                os.chdir(cwd)
+                _MODEL_CACHE.clear()
+                _BACKOFF_CACHE.clear()
+                _BACKOFF_TABLE.clear()
@@ -0,0 +1,120 @@
+import unittest
+import tempfile
+import threading
+import time
+import os
+from pathlib import Path
+from model_registry import ModelRegistry
+from markov_generator import model_io
+
+
+class Testmodel_registry(unittest.TestCase):
+    """Unit tests for the model_registry module."""
+
+    def setUp(self):
+        """Create model files (their content is the 'model') and a counting loader."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        for order in range(1, 5):
+            (self.dir / f"m{order}").write_text(f"model {order}")
+        self.loads = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def registry(self, delay=0.0, **kwargs):
+        """Registry reading the text files of self.dir."""
+        def load(path):
+            self.loads.append(path.name)
+            time.sleep(delay)
+            return path.read_text()
+        return ModelRegistry(lambda order: self.dir / f"m{order}", load, **kwargs)
+
+    def test_concurrent_requests_share_one_load(self):
+        """Test that threads asking for the same model wait for a single load."""
+        registry = self.registry(delay=0.2)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get_model(1))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, ["model 1"] * 8)
+        self.assertEqual(self.loads, ["m1"])
+
+    def test_least_recently_used_models_are_evicted(self):
+        """Test that max_models keeps only the most recently used models."""
+        registry = self.registry(max_models=2)
+        registry.preload([1, 2])
+        registry.get_model(1)  # 2 is now the least recently used
+        registry.get_model(3)
+        self.assertEqual(sorted(registry), [1, 3])
+
+        registry.get_model(2)
+        self.assertEqual(self.loads, ["m1", "m2", "m3", "m2"])
+
+    def test_size_limit_evicts_models(self):
+        """Test that max_bytes bounds the total size of the model files held."""
+        registry = self.registry(max_bytes=len("model 1") * 2)
+        registry.preload([1, 2, 3])
+        self.assertEqual(sorted(registry), [2, 3])
+
+    def test_changed_file_is_reloaded(self):
+        """Test that a model is loaded again after its file changes on disk."""
+        registry = self.registry(reload_interval=0)
+        self.assertEqual(registry.get_model(1), "model 1")
+        self.assertEqual(registry.get_model(1), "model 1")
+
+        path = self.dir / "m1"
+        path.write_text("model 1, retrained")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        self.assertEqual(registry.get_model(1), "model 1, retrained")
+        self.assertEqual(self.loads, ["m1", "m1"])
+
+    def test_model_moving_to_another_file_is_reloaded(self):
+        """Test that a model is reloaded when its key resolves to a new file (e.g. .json -> .bin)."""
+        def path_for(order):
+            binary = self.dir / f"m{order}.bin"
+            return binary if binary.exists() else self.dir / f"m{order}"
+
+        registry = ModelRegistry(path_for, lambda path: path.read_text(), reload_interval=0)
+        self.assertEqual(registry.get_model(1), "model 1")
+
+        (self.dir / "m1.bin").write_text("model 1, binary")
+        self.assertEqual(registry.get_model(1), "model 1, binary")
+        self.assertEqual(len(registry), 1)
+
+    def test_missing_model_raises_and_is_not_cached(self):
+        """Test that a failed load raises FileNotFoundError and is retried later."""
+        registry = self.registry()
+        with self.assertRaises(FileNotFoundError):
+            registry.get_model(9)
+        self.assertNotIn(9, registry)
+
+        (self.dir / "m9").write_text("model 9")
+        self.assertEqual(registry.get_model(9), "model 9")
+
+    def test_assigned_models_are_pinned(self):
+        """Test that models assigned directly are neither evicted nor reloaded."""
+        registry = self.registry(max_models=1, reload_interval=0)
+        registry[1] = "pinned"
+        registry.preload([2, 3])
+        self.assertEqual(registry.get_model(1), "pinned")
+        self.assertEqual(sorted(registry), [1, 3])
+
+    def test_rewritten_file_keeps_mapped_model_valid(self):
+        """Test that rewriting a model file leaves models mapped from it readable, then reloads."""
+        path = self.dir / "m1.bin"
+        model_io.save_binary_model({(60,): {62: 1.0}}, path)
+        registry = ModelRegistry(lambda order: path, model_io.MappedModel, reload_interval=0)
+        old = registry.get_model(1)
+
+        model_io.save_binary_model({(60,): {64: 0.5, 65: 0.5}, (64,): {60: 1.0}}, path)
+        self.assertEqual(old[(60,)], {62: 1.0})
+
+        new = registry.get_model(1)
+        self.assertIsNot(new, old)
+        self.assertEqual(new[(60,)], {64: 0.5, 65: 0.5})
+        self.assertEqual(old[(60,)], {62: 1.0})
+        self.assertEqual([p.name for p in self.dir.iterdir() if p.suffix == ".tmp"], [])
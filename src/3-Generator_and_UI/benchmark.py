@@ -0,0 +1,77 @@
+import sys
+import time
+import random
+import itertools
+
+import markov_generator
+from markov_generator import generate_sequence, generate_batch, _MODEL_CACHE
+
+# Throughput of generate_batch versus calling generate_sequence n times, and
+# the cost of one sampling step (dict weighted_choice versus ArrayModel.sample).
+# Uses the trained model of the given order (models/markov_order<k>.bin);
+# with --synthetic a random model is generated instead.
+ORDER = 2
+MEASURES = 16
+KEY = "C"
+BATCH_SIZES = (10, 100, 1000, 10000)
+STEPS = 20000
+
+
+def synthetic_model(order, num_states=1000, branching=20, low=48, high=84):
+    """Random {state: {token: prob}} model over pitches low..high-1."""
+    rng = random.Random(0)
+    pitches = range(low, high)
+    num_states = min(num_states, len(pitches) ** order)
+    model = {}
+    while len(model) < num_states:
+        state = tuple(rng.choice(pitches) for _ in range(order))
+        weights = [rng.random() for _ in range(branching)]
+        total = sum(weights)
+        model[state] = {p: w / total for p, w in zip(rng.sample(pitches, branching), weights)}
+    # every state can continue, so chains run for the whole length
+    for state in list(model):
+        for p in model[state]:
+            model.setdefault(state[1:] + (p,), model[state])
+    return model
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def step_times(model, steps=STEPS):
+    """Microseconds per sampling step: weighted_choice on dict rows versus model.sample."""
+    rng = random.Random(0)
+    states = list(itertools.islice(iter(model), 1000))
+    rows = {state: dict(model[state]) for state in states}  # the dict model sampled before
+
+    dict_time, _ = timed(lambda: [markov_generator.weighted_choice(rows[states[i % len(states)]], rng)
+                                  for i in range(steps)])
+    array_time, _ = timed(lambda: [model.sample(states[i % len(states)], rng.random()) for i in range(steps)])
+    return dict_time / steps * 1e6, array_time / steps * 1e6
+
+
+def main():
+    if "--synthetic" in sys.argv:
+        _MODEL_CACHE[ORDER] = markov_generator.model_io.ArrayModel.from_dict(synthetic_model(ORDER))
+
+    model = markov_generator.load_model(ORDER)
+    seed = list(next(iter(model)))
+    print(f"Order {ORDER}, {len(model)} states, {MEASURES} measures per sequence")
+    print(f"{'n':>7} {'scalar (seq/s)':>16} {'batch (seq/s)':>16} {'speed-up':>9}")
+
+    for n in BATCH_SIZES:
+        scalar_time, _ = timed(lambda: [generate_sequence(ORDER, seed, MEASURES, KEY) for _ in range(n)])
+        batch_time, batch = timed(generate_batch, ORDER, seed, MEASURES, KEY, n)
+        print(f"{n:>7} {n / scalar_time:>16.0f} {n / batch_time:>16.0f} {scalar_time / batch_time:>8.1f}x"
+              f"   ({batch.shape[1]} tokens)")
+
+    dict_step, array_step = step_times(model)
+    print(f"\nOne sampling step: weighted_choice on a dict row {dict_step:.2f} us, "
+          f"ArrayModel.sample {array_step:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
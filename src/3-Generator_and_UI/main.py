@@ -1,5 +1,15 @@
+import threading
 import tkinter as tk
 from ui import MarkovUI
+from markov_generator import preload_models
+
+
+def preload():
+    """Load the models and backoff tables in the background so the first generation does not wait."""
+    try:
+        preload_models()
+    except FileNotFoundError as e:
+        print(f"[INFO] {e}")
 
 
 def main():
@@ -11,6 +21,8 @@ def main():
     except:
         root.attributes("-zoomed", True)    # Linux
 
+    threading.Thread(target=preload, daemon=True).start()
+
     app = MarkovUI(root)
     app.pack(fill="both", expand=True)
 
@@ -1,9 +1,20 @@
-import json
+import bisect
+import itertools
 import random
+import sys
+import threading
 from pathlib import Path
 
-# GLOBAL CACHE (models are loaded only once)
-_MODEL_CACHE = {}
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+import model_io
+import vocabulary
+from backoff_model import BackoffModel, map_backoff_model
+from model_registry import ModelRegistry
+
+# At most this many models stay loaded (orders 1-4 plus room for reloads)
+MAX_MODELS = 8
 
 # Semitone offsets to transpose any key to C major / A minor
 KEY_TO_SEMITONES = {
@@ -21,21 +32,28 @@ KEY_TO_SEMITONES = {
     "B": -11, "G#m": -11,
 }
 
-def transpose_note(note_str, semitones):
+def transpose_note(note, semitones):
     """
-    Transpose note like NOTE_60 -> NOTE_63 (+3 semitones)
-    Handles only NOTE_<pitch> format.
+    Transpose a token id like 60 -> 63 (+3 semitones).
+    Timed notes keep their duration; rests and END are returned unchanged; token strings like
+    NOTE_60 are still accepted and returned as strings. Pitches leaving 0-127
+    are folded back by octaves.
     """
-    if note_str == "END":
-        return "END"
+    if isinstance(note, str):
+        return vocabulary.decode(transpose_note(vocabulary.encode(note), semitones))
 
-    prefix, pitch_str = note_str.split("_")
-    pitch = int(pitch_str)
-    transposed = pitch + semitones
-    return f"{prefix}_{transposed}"
+    return vocabulary.transpose(note, semitones)
 
 def transpose_sequence(seq, semitones):
-    return [transpose_note(n, semitones) for n in seq]
+    """
+    Transpose a whole sequence with one NumPy operation (see transpose_note).
+    Token ids come back as a list of ints; string tokens are only parsed and
+    formatted when the input contains strings.
+    """
+    if any(isinstance(n, str) for n in seq):
+        return vocabulary.decode_sequence(transpose_sequence(vocabulary.encode_sequence(seq), semitones))
+
+    return vocabulary.transpose_ids(seq, semitones).tolist()
 
 
 # VALIDATION
@@ -54,78 +72,191 @@ def validate_inputs(order, seed, measures, key):
 
 
 # MODEL LOADING
+def _read_model(path):
+    """
+    Binary models are memory-mapped, so the cache only keeps a read-only view;
+    legacy JSON models are converted to the same array form for sampling.
+    """
+    model = model_io.load_model(path, mapped=True)
+    if isinstance(model, dict):
+        model = model_io.ArrayModel.from_dict(model)
+    return model
+
+
+# GLOBAL CACHE (thread-safe, bounded, reloads models whose file changed)
+_MODEL_CACHE = ModelRegistry(model_io.model_path, _read_model, max_models=MAX_MODELS)
+_BACKOFF_TABLE = ModelRegistry(lambda _: model_io.backoff_path(), map_backoff_model, max_models=1)
+_BACKOFF_CACHE = {}
+_BACKOFF_LOCK = threading.Lock()
+
+
 def load_model(order):
     """
-    Loads the Markov model from cache. If not present, loads from file.
+    Loads the Markov model from cache. If not present (or its file changed),
+    loads it from file; concurrent callers share a single load.
+    """
+    return _MODEL_CACHE.get_model(order)
+
+
+def preload_models(orders=(1, 2, 3, 4), backoff=True):
     """
-    global _MODEL_CACHE
+    Load the models of the given orders now, e.g. when the app starts
+    (with backoff=True also the backoff tables the UI generates with).
+    """
+    _MODEL_CACHE.preload(orders)
+    if backoff:
+        for order in orders:
+            load_backoff_model(order)
 
-    if order in _MODEL_CACHE:
-        return _MODEL_CACHE[order]
 
-    path = Path(f"models/markov_order{order}.json")
+def uses_timed_tokens(model):
+    """True if the model was trained on timed tokens (notes with durations, rests)."""
+    vocab = getattr(model, "vocab", None)
+    if vocab is None:
+        vocab = next(iter(model), ())
+    return any(isinstance(t, int) and vocabulary.is_timed(t) for t in vocab)
 
-    if not path.exists():
-        raise FileNotFoundError(f"Model not found: {path}")
 
-    raw_model = json.load(open(path, "r"))
+def seed_tokens(seed, timed):
+    """Seed token ids; plain pitches become quarter notes for timed models."""
+    seed = vocabulary.encode_sequence(seed)
+    if not timed:
+        return seed
+    return [vocabulary.timed_note(t, 1) if vocabulary.is_pitch(t) else t for t in seed]
 
-    model = {}
-    for key, transitions in raw_model.items():
-        state = tuple(key.split(","))
-        model[state] = transitions
 
-    _MODEL_CACHE[order] = model
-    return model
+# BACKOFF MODEL
+def _trained_backoff(models):
+    """The mapped backoff table saved at training time, if it was built from these models."""
+    try:
+        table = _BACKOFF_TABLE.get_model("backoff")
+    except (OSError, ValueError):
+        return None
+    if not table.built_from(models):
+        return None
+    return table.for_order(len(models))
+
+
+def load_backoff_model(order):
+    """
+    BackoffModel over the models of orders 1..order, cached like load_model
+    and rebuilt when one of those models was replaced. The table saved at
+    training time is memory-mapped when it matches the loaded models;
+    otherwise one is built in memory.
+    """
+    models = [load_model(k) for k in range(1, order + 1)]
+    with _BACKOFF_LOCK:
+        cached = _BACKOFF_CACHE.get(order)
+        if cached is None or any(a is not b for a, b in zip(cached[0], models)):
+            arrays = [m if isinstance(m, model_io.ArrayModel) else model_io.ArrayModel.from_dict(m) for m in models]
+            model = _trained_backoff(arrays) or BackoffModel.from_models(dict(enumerate(arrays, start=1)))
+            cached = (models, model)
+            _BACKOFF_CACHE[order] = cached
+    return cached[1]
+
+
+# RANDOM STREAMS
+def make_rng(rng=None):
+    """
+    NumPy Generator for one generation request.
+    rng: None (fresh OS entropy), an int seed, a SeedSequence or a Generator
+    (used as is). Every request owns its generator, so concurrent requests
+    never share RNG state and need no locking.
+    """
+    return np.random.default_rng(rng)
+
+
+def spawn_rngs(rng, count):
+    """`count` independent generators derived from rng (see make_rng), e.g. one per worker."""
+    return make_rng(rng).spawn(count)
 
 
 # WEIGHTED SAMPLING
-def weighted_choice(distribution: dict):
+def weighted_choice(distribution: dict, rng=None):
     notes = list(distribution.keys())
     weights = list(distribution.values())
-    return random.choices(notes, weights)[0]
+    if rng is None:
+        return random.choices(notes, weights)[0]
+
+    cumulative = list(itertools.accumulate(weights))
+    index = bisect.bisect_right(cumulative, rng.random() * cumulative[-1])
+    return notes[min(index, len(notes) - 1)]
+
+
+def next_token(model, state, rng=None):
+    """
+    Sample the token following `state`, or None if the state is unseen.
+    Array models sample from their precomputed cumulative probabilities;
+    plain dict models fall back to weighted_choice.
+    rng: Generator of the request (None: the global `random` module).
+    """
+    if isinstance(model, model_io.ArrayModel):
+        return model.sample(state, random.random() if rng is None else rng.random())
+
+    if state not in model:
+        return None
+    return weighted_choice(model[state], rng)
 
 
 # SEQUENCE GENERATION
-def generate_sequence(order, seed, measures, key):
+def generate_sequence(order, seed, measures, key, rng=None, backoff=False):
     """
     order: 1-4
-    seed: list of initial notes ["NOTE_60", ...]
-    measures: duration (1 measure = 4 notes)
+    seed: list of initial notes as token ids / MIDI pitches [60, ...]
+          (token strings like "NOTE_60" are also accepted)
+    measures: duration (1 measure = 4 quarter notes; plain pitch tokens count
+              as one quarter, timed tokens by their duration)
     key: original key ("C", "F#", "Bm", etc)
+    rng: random stream of this request (see make_rng); the same int seed
+         always gives the same sequence
+    backoff: on an unseen state, continue from the longest known suffix
+             (orders below `order`) instead of stopping, and never stop at
+             END, so every measure is filled (see BackoffModel)
 
-    RETURNS: list of notes in the requested key
+    RETURNS: list of token ids in the requested key
     """
 
     # Validation
     validate_inputs(order, seed, measures, key)
 
-    # Convert measures to number of notes
-    total_notes = measures * 4
+    # Convert measures to quarter notes
+    total_beats = measures * 4
 
     # Load model
-    model = load_model(order)
+    model = load_backoff_model(order) if backoff else load_model(order)
+    rng = make_rng(rng)
 
     # Transpose input seed to C / Am normalization
     semitones = KEY_TO_SEMITONES[key]  # usually negative (to normalize)
-    seed_transposed = transpose_sequence(seed, semitones)
+    seed_transposed = transpose_sequence(seed_tokens(seed, uses_timed_tokens(model)), semitones)
 
     # Initial state
     state = tuple(seed_transposed)
     result = list(state)
+    beats = sum(vocabulary.duration_of(t) for t in result)
 
-    # Gneration loop
-    while len(result) < total_notes:
+    # Backoff: the model hands over the next context with every token,
+    # and fills the whole length (the loop below then has nothing left to do)
+    if backoff:
+        row = model.start_row(state)
+        while beats < total_beats:
+            next_note, row = model.sample(row, rng.random())
+            result.append(next_note)
+            beats += vocabulary.duration_of(next_note)
 
-        if state not in model:
-            break  # unseen state
+    # Generation loop
+    while beats < total_beats:
 
-        next_note = weighted_choice(model[state])
+        next_note = next_token(model, state, rng)
 
-        if next_note == "END":
+        if next_note is None:
+            break  # unseen state
+
+        if next_note == vocabulary.END:
             break
 
         result.append(next_note)
+        beats += vocabulary.duration_of(next_note)
 
         # sliding window
         state = tuple(result[-order:])
@@ -134,3 +265,112 @@ def generate_sequence(order, seed, measures, key):
     result_untransposed = transpose_sequence(result, -semitones)
 
     return result_untransposed
+
+
+# BATCH GENERATION
+def _batch_seeds(seeds, n):
+    """One seed per chain: a single seed is shared, a list of seeds is used as is."""
+    if len(seeds) and isinstance(seeds[0], (list, tuple, np.ndarray)):
+        seeds = [list(seed) for seed in seeds]
+        if len(seeds) != n:
+            raise ValueError(f"Expected 1 or {n} seeds, got {len(seeds)}")
+        return seeds
+    return [list(seeds)] * n
+
+
+def generate_batch(order, seeds, measures, key, n, rng=None, backoff=False):
+    """
+    Generate n sequences at once: all chains advance in lockstep, each step
+    being a few NumPy operations over integer states instead of n Python
+    sampling calls.
+    seeds: one seed (shared by every chain) or a list of n seeds
+    Other arguments as in generate_sequence; batches run in parallel threads
+    stay deterministic when each gets its own stream from spawn_rngs.
+
+    RETURNS: (n, length) array of token ids in the requested key. Chains that
+    stop early (END or an unseen state; with timed tokens also chains whose
+    notes were longer) are padded with vocabulary.END.
+    """
+    if n <= 0:
+        raise ValueError("n must be > 0")
+    seeds = _batch_seeds(seeds, n)
+    for seed in seeds:
+        validate_inputs(order, seed, measures, key)
+
+    total_beats = measures * 4
+
+    model = load_backoff_model(order) if backoff else load_model(order)
+    rng = make_rng(rng)
+    if not isinstance(model, (model_io.ArrayModel, BackoffModel)):
+        model = model_io.ArrayModel.from_dict(model)
+
+    # Seeds as token ids in C / Am, and as vocabulary indices of the model
+    semitones = KEY_TO_SEMITONES[key]
+    timed = uses_timed_tokens(model)
+    seed_ids = np.array([seed_tokens(seed, timed) for seed in seeds], dtype=np.int64)
+    seed_ids = vocabulary.transpose_ids(seed_ids, semitones).reshape(n, order)
+    if backoff:
+        result = _backoff_batch(model, seed_ids, total_beats, rng)
+        return vocabulary.transpose_ids(result, -semitones).astype(vocabulary.TOKEN_DTYPE)
+
+    window = model.token_ids(seed_ids.ravel().tolist()).reshape(n, order)
+
+    # Token id and duration of every vocabulary index
+    vocab_tokens = np.array(vocabulary.encode_sequence(model.vocab), dtype=np.int64)
+    durations = np.array([vocabulary.duration_of(t) for t in vocab_tokens.tolist()])
+
+    columns = list(seed_ids.T)
+    beats = np.array([[vocabulary.duration_of(t) for t in row] for row in seed_ids.tolist()]).sum(axis=1)
+    active = beats < total_beats
+
+    while active.any():
+        chains = np.flatnonzero(active)
+        rows = model.find_rows(window[chains])
+        chains, rows = chains[rows >= 0], rows[rows >= 0]
+        if len(chains) == 0:
+            break  # every remaining state is unseen
+
+        next_ids = model.sample_rows(rows, rng.random(len(chains)))
+        tokens = vocab_tokens[next_ids]
+        going = tokens != vocabulary.END
+        chains, next_ids, tokens = chains[going], next_ids[going], tokens[going]
+        if len(chains) == 0:
+            break
+
+        column = np.full(n, vocabulary.END, dtype=np.int64)
+        column[chains] = tokens
+        columns.append(column)
+
+        # slide the windows of the chains that moved; the others are done
+        window[chains, :-1] = window[chains, 1:]
+        window[chains, -1] = next_ids
+        beats[chains] += durations[next_ids]
+        active[:] = False
+        active[chains] = beats[chains] < total_beats
+
+    result = np.column_stack(columns)
+
+    # Transpose back to the original key
+    return vocabulary.transpose_ids(result, -semitones).astype(vocabulary.TOKEN_DTYPE)
+
+
+def _backoff_batch(model, seed_ids, total_beats, rng):
+    """generate_batch loop for a BackoffModel: no chain stops before total_beats."""
+    durations = np.array([vocabulary.duration_of(t) for t in range(vocabulary.VOCAB_SIZE)])
+    rows = model.start_rows(seed_ids)
+    beats = durations[seed_ids].sum(axis=1)
+    columns = list(seed_ids.T)
+    active = beats < total_beats
+
+    while active.any():
+        chains = np.flatnonzero(active)
+        tokens, rows[chains] = model.sample_rows(rows[chains], rng.random(len(chains)))
+
+        column = np.full(len(seed_ids), vocabulary.END, dtype=np.int64)
+        column[chains] = tokens
+        columns.append(column)
+
+        beats[chains] += durations[tokens]
+        active[chains] = beats[chains] < total_beats
+
+    return np.column_stack(columns)
@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+
+
+class _Entry:
+    __slots__ = ("model", "path", "stamp", "size", "checked")
+
+    def __init__(self, model, path=None, stamp=None, size=0):
+        self.model = model
+        self.path = path      # None: pinned model, never reloaded or evicted
+        self.stamp = stamp    # (mtime_ns, size, inode) of the file when it was loaded
+        self.size = size
+        self.checked = time.monotonic()
+
+
+def _file_stamp(path):
+    # model files are replaced by renaming a new file over them, which always
+    # changes the inode even when mtime and size happen to match
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class ModelRegistry(MutableMapping):
+    """
+    Thread-safe cache of loaded models, keyed by order.
+
+    - single-flight: threads asking for a model that is being loaded wait for
+      that load instead of starting their own
+    - bounded: least recently used models are dropped beyond `max_models`
+      entries or `max_bytes` of model files
+    - hot reload: a model whose file changed on disk (checked at most every
+      `reload_interval` seconds) is loaded again on its next use
+
+    path_for(key) gives the file of a model and load(path) reads it. The
+    registry is also a mapping of the models currently held; assigning
+    registry[key] = model pins a model that has no file.
+    """
+
+    def __init__(self, path_for, load, max_models=None, max_bytes=None, reload_interval=1.0):
+        self._path_for = path_for
+        self._load = load
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loading = {}  # key -> Future of the load in progress
+
+    def get_model(self, key):
+        """The model for `key`, loading (or reloading) it if needed."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_stale(key, entry):
+                self._entries.move_to_end(key)
+                return entry.model
+
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            path = self._path_for(key)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Model not found: {path}")
+            stamp = _file_stamp(path)
+            model = self._load(path)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._entries[key] = _Entry(model, path, stamp, stamp[1])
+            self._entries.move_to_end(key)
+            self._evict()
+            del self._loading[key]
+        future.set_result(model)
+        return model
+
+    def preload(self, keys):
+        """Load the given models now (e.g. at startup) instead of on first use."""
+        for key in keys:
+            self.get_model(key)
+
+    def _is_stale(self, key, entry):
+        """
+        True if the entry's file changed since it was loaded, or the key now
+        resolves to another file, e.g. a .bin written next to a legacy .json
+        (called with the lock held).
+        """
+        if entry.path is None:
+            return False
+        now = time.monotonic()
+        if now - entry.checked < self.reload_interval:
+            return False
+        entry.checked = now
+        try:
+            if Path(self._path_for(key)) != Path(entry.path):
+                return True
+            return _file_stamp(entry.path) != entry.stamp
+        except OSError:
+            return False  # file removed or being replaced: keep the loaded model
+
+    def _evict(self):
+        """Drop least recently used file-backed models beyond the limits (lock held)."""
+        def over():
+            loaded = [e for e in self._entries.values() if e.path is not None]
+            return ((self.max_models is not None and len(loaded) > self.max_models)
+                    or (self.max_bytes is not None and len(loaded) > 1
+                        and sum(e.size for e in loaded) > self.max_bytes))
+
+        while over():
+            # the newest entry is never evicted, so a single large model still loads
+            key = next(k for k, e in self._entries.items() if e.path is not None)
+            del self._entries[key]
+
+    # Mapping interface: the models currently held
+    def __getitem__(self, key):
+        with self._lock:
+            return self._entries[key].model
+
+    def __setitem__(self, key, model):
+        with self._lock:
+            self._entries[key] = _Entry(model)
+            self._entries.move_to_end(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._entries[key]
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -1,7 +1,26 @@
+import sys
+import threading
+from functools import lru_cache
+from pathlib import Path
+
 import numpy as np
 import sounddevice as sd
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / "0-Common"))
+import vocabulary
+
 SR = 44100
+# Length of a quarter note (a plain pitch token) in seconds
+SECONDS_PER_QUARTER = 0.55
+# Sine tables kept in memory (float32, one per pitch and sample rate),
+# each covering the first SINE_TABLE_SECONDS of a note
+SINE_CACHE_SIZE = 128
+SINE_TABLE_SECONDS = SECONDS_PER_QUARTER
+AMPLITUDE = 0.25
+ATTACK_SECONDS = 0.02
+RELEASE_SECONDS = 0.04
+# Frames rendered per OutputStream callback (~23 ms at 44.1 kHz)
+BLOCK_SIZE = 1024
 
 
 def midi_to_freq(midi):
@@ -9,31 +28,221 @@ def midi_to_freq(midi):
     return 440.0 * (2 ** ((midi - 69) / 12.0))
 
 
-def _synthesize_note(freq, duration=0.55, sr=SR):
+def _synthesize_note(freq, duration=SECONDS_PER_QUARTER, sr=SR):
     """Generate a single synthesized note with a simple ADSR envelope."""
-    t = np.linspace(0, duration, int(sr * duration), False)
+    return _render_note(freq, int(sr * duration), sr)
+
+
+def _render_note(freq, num_samples, sr):
+    """_synthesize_note for an exact number of samples."""
+    t = np.arange(num_samples) / sr
 
     env = np.ones_like(t)
-    attack = int(0.02 * sr)
-    release = int(0.04 * sr)
+    attack = int(ATTACK_SECONDS * sr)
+    release = int(RELEASE_SECONDS * sr)
 
     if len(t) > attack + release:
         env[:attack] = np.linspace(0, 1, attack)
         env[-release:] = np.linspace(1, 0, release)
 
-    wave = 0.25 * np.sin(2 * np.pi * freq * t) * env
+    wave = AMPLITUDE * np.sin(2 * np.pi * freq * t) * env
     return wave
 
 
-def play_midi_sequence(midi_list, sr=SR):
-    """Play a list of MIDI notes sequentially."""
+@lru_cache(maxsize=SINE_CACHE_SIZE)
+def _sine_table(pitch, sr):
+    """
+    Envelope-free sine of a pitch from phase 0, float32, SINE_TABLE_SECONDS
+    long whatever the notes played, so the cache holds at most
+    SINE_CACHE_SIZE * SINE_TABLE_SECONDS * sr * 4 bytes (12 MB at 44.1 kHz).
+    """
+    t = np.arange(int(sr * SINE_TABLE_SECONDS)) / sr
+    table = np.sin(2 * np.pi * midi_to_freq(pitch) * t).astype(np.float32)
+    table.flags.writeable = False
+    return table
+
+
+def _sine(out, pitch, start, sr):
+    """Write sine samples start .. start + len(out) of a pitch into `out`."""
+    table = _sine_table(pitch, sr)
+    cut = min(max(len(table) - start, 0), len(out))
+    out[:cut] = table[start:start + cut]
+    if cut < len(out):
+        # past the table (notes longer than a quarter): computed directly
+        t = np.arange(start + cut, start + len(out)) / sr
+        out[cut:] = np.sin(2 * np.pi * midi_to_freq(pitch) * t)
+
+
+def render_note(out, pitch, num_samples, start=0, sr=SR):
+    """
+    Write samples start .. start + len(out) of a note into `out`: the cached
+    sine of its pitch, with the attack/release envelope of _render_note
+    applied here, so the cache does not depend on note lengths.
+    """
+    stop = start + len(out)
+    _sine(out, pitch, start, sr)
+    out *= AMPLITUDE
+
+    attack = int(ATTACK_SECONDS * sr)
+    release = int(RELEASE_SECONDS * sr)
+    if num_samples <= attack + release:
+        return out
+
+    if start < attack:
+        k = np.arange(start, min(stop, attack))
+        out[:len(k)] *= k / (attack - 1)
+    release_start = num_samples - release
+    if stop > release_start:
+        k = np.arange(max(start, release_start), stop) - release_start
+        out[len(out) - len(k):] *= 1 - k / (release - 1)
+    return out
+
+
+def note_waveform(pitch, num_samples, sr=SR):
+    """Waveform of a whole note (a new array; see render_note)."""
+    return render_note(np.empty(num_samples), pitch, num_samples, 0, sr)
+
+
+def note_events(tokens, sr=SR, seconds_per_quarter=SECONDS_PER_QUARTER):
+    """
+    (pitch, number of samples) of every sounding token, pitch None for rests;
+    END and other tokens without duration are skipped.
+    """
+    events = []
+    for token in tokens:
+        pitch = vocabulary.pitch_of(token)
+        if pitch is None and not vocabulary.is_rest(token):
+            continue
+        events.append((pitch, int(sr * vocabulary.duration_of(token) * seconds_per_quarter)))
+    return events
+
+
+def synthesize_tokens(tokens, sr=SR, seconds_per_quarter=SECONDS_PER_QUARTER):
+    """
+    Audio for a token sequence: notes last their duration (a quarter for plain
+    pitches), rests are silence and END is skipped. The output buffer is
+    allocated once and each note is rendered into place from the sine cache.
+    """
+    events = note_events(tokens, sr, seconds_per_quarter)
+    audio = np.zeros(sum(n for _, n in events))
+
+    position = 0
+    for pitch, num_samples in events:
+        if pitch is not None:
+            render_note(audio[position:position + num_samples], pitch, num_samples, 0, sr)
+        position += num_samples
+    return audio
+
+
+class StreamingPlayer:
+    """
+    Plays a token sequence through a sounddevice.OutputStream. The callback
+    renders each block just in time from the note events, so playback starts
+    at once and memory does not grow with the length of the piece.
+    pause(), resume() and stop() may be called from any thread (e.g. the UI).
+    """
+
+    def __init__(self, tokens, sr=SR, seconds_per_quarter=SECONDS_PER_QUARTER, blocksize=BLOCK_SIZE):
+        self.sr = sr
+        self.blocksize = blocksize
+        self._events = note_events(tokens, sr, seconds_per_quarter)
+        self._index = 0    # current event
+        self._offset = 0   # samples of the current event already played
+        self._paused = False
+        self._stream = None
+        self.finished = threading.Event()
+
+    def render(self, out):
+        """
+        Fill `out` (1-D, written in place) with the next samples; returns how
+        many came from the piece (fewer than len(out) once it is over).
+        """
+        frames = len(out)
+        written = 0
+        while written < frames and self._index < len(self._events):
+            pitch, num_samples = self._events[self._index]
+            take = min(num_samples - self._offset, frames - written)
+            if pitch is None:
+                out[written:written + take] = 0
+            else:
+                render_note(out[written:written + take], pitch, num_samples, self._offset, self.sr)
+            written += take
+            self._offset += take
+            if self._offset == num_samples:
+                self._index += 1
+                self._offset = 0
+        out[written:] = 0
+        return written
+
+    def _callback(self, outdata, frames, time, status):
+        if self._paused:
+            outdata.fill(0)
+            return
+        if self.render(outdata[:, 0]) < frames:
+            raise sd.CallbackStop  # the stream drains the last block, then finishes
+
+    def start(self):
+        """Start playing (returns immediately)."""
+        if not self._events:
+            self.finished.set()
+            return self
+        self._stream = sd.OutputStream(
+            samplerate=self.sr,
+            channels=1,
+            blocksize=self.blocksize,
+            callback=self._callback,
+            finished_callback=self.finished.set,
+        )
+        self._stream.start()
+        return self
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def stop(self):
+        """Stop playing and release the audio device."""
+        if self._stream is not None:
+            self._stream.abort()
+            self._stream.close()
+            self._stream = None
+        self.finished.set()
+
+    def wait(self, timeout=None):
+        """Block until the piece has been played (or stop() was called)."""
+        finished = self.finished.wait(timeout)
+        if finished and self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        return finished
+
+
+def play_tokens(tokens, sr=SR):
+    """Start streaming a token sequence; returns the StreamingPlayer controlling it."""
+    return StreamingPlayer(tokens, sr).start()
+
+
+def play_midi_sequence(midi_list, sr=SR, streaming=True):
+    """
+    Play a list of MIDI notes (or token ids with durations and rests) sequentially.
+    streaming=False synthesizes the whole piece first and plays it with sd.play.
+    """
     if not midi_list:
         print("[AUDIO] No MIDI notes to play.")
         return
 
+    if streaming:
+        play_tokens(midi_list, sr).wait()
+        return
+
     # Synthesize all notes
-    parts = [_synthesize_note(midi_to_freq(m)) for m in midi_list]
-    audio = np.concatenate(parts)
+    audio = synthesize_tokens(midi_list, sr)
 
     # Play the audio
     sd.play(audio, sr)
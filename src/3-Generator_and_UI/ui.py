@@ -1,10 +1,14 @@
 import tkinter as tk
 from tkinter import ttk
 from markov_generator import generate_sequence
-from playback import play_midi_sequence
-import threading
+import vocabulary
+from playback import play_tokens
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageTk
 
+# How often (ms) the Tk thread checks for a finished generation
+GENERATION_POLL_MS = 50
+
 # Existing NumberSelector
 class NumberSelector(tk.Frame):
     """
@@ -491,12 +495,12 @@ class StaffCanvas(tk.Canvas):
     # Data interface for MarkovUI
     # -----------------------------
     def get_seed_notes(self):
-        """Return list of NOTE_midi strings for occupied slots that are user-added (is_generated False),
-        in left->right order (slot order)."""
+        """Return list of MIDI pitches (token ids) for occupied slots that are user-added
+        (is_generated False), in left->right order (slot order)."""
         res = []
         for slot in self.slots:
             if slot["occupied"] and not slot.get("is_generated", False):
-                res.append(f"NOTE_{slot['midi']}")
+                res.append(slot["midi"])
         return res
 
     def clear_generated_notes(self):
@@ -520,7 +524,7 @@ class StaffCanvas(tk.Canvas):
 
     def draw_generated_notes(self, notes_list):
         """
-        notes_list: list of strings like "NOTE_60","NOTE_67"...
+        notes_list: list of token ids like 60, 67...
         Place them into the first empty slots in order L->R and mark them is_generated=True.
         """
         # find all free slots
@@ -535,8 +539,7 @@ class StaffCanvas(tk.Canvas):
         generated_notes = notes_list[:max_new_notes]
 
         # place generated notes in free slots
-        for note_str, slot_index in zip(generated_notes, free_slots):
-            midi = int(note_str.split("_")[1])
+        for midi, slot_index in zip(generated_notes, free_slots):
             slot = self.slots[slot_index]
             slot["occupied"] = True
             slot["midi"] = midi
@@ -551,7 +554,7 @@ class StaffCanvas(tk.Canvas):
     # utility: fill canvas from a given list (clear then place seed as user notes)
     def load_seed_notes_into_slots(self, seed_notes):
         """
-        seed_notes: list of "NOTE_60" etc; clears current slots and fills left->right
+        seed_notes: list of token ids (60 etc); clears current slots and fills left->right
         as user notes.
         """
         # clear all
@@ -560,7 +563,7 @@ class StaffCanvas(tk.Canvas):
         for i, n in enumerate(seed_notes):
             if i >= len(free):
                 break
-            midi = int(n.split("_", 1)[1])
+            midi = n
             idx = free[i]
             self.slots[idx]["occupied"] = True
             self.slots[idx]["midi"] = midi
@@ -588,6 +591,14 @@ class MarkovUI(tk.Frame):
         super().__init__(parent)
         self.configure(padx=30, pady=10)
 
+        # Generation runs on a worker thread; results come back through after()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._generation_id = 0  # bumped for every request, so stale results are dropped
+        self._pending = None
+
+        # Streaming playback of the last sequence (see playback.StreamingPlayer)
+        self.player = None
+
         # TOP ROW: order and measures
         top_frame = tk.Frame(self)
         top_frame.pack(fill="x", pady=(10, 6))
@@ -602,6 +613,7 @@ class MarkovUI(tk.Frame):
         # Bind a single handler to update both chain order and sync seed notes
         self.order_selector.bind("<<ValueChanged>>", 
             lambda e: (
+                self.cancel_generation(),
                 self.staff.clear_generated_notes(),
                 self.staff.set_chain_order(self.order_selector.get_value()),
                 self.sync_seed_notes(),
@@ -615,6 +627,7 @@ class MarkovUI(tk.Frame):
         # Bind a single handler to update staff measures
         self.measures_selector.bind("<<ValueChanged>>", 
             lambda e: (
+                self.cancel_generation(),
                 self.staff.clear_generated_notes(), 
                 self.staff.set_measures(self.measures_selector.get_value())
                 ))
@@ -730,6 +743,25 @@ class MarkovUI(tk.Frame):
         )
         play_button.pack(side="left", padx=6)
 
+        # --- Pause / Stop Buttons ---
+        self.pause_button = tk.Button(
+            button_frame,
+            text="Pause",
+            command=self.toggle_pause,
+            height=2,
+            font=("Arial", 14)
+        )
+        self.pause_button.pack(side="left", padx=6)
+
+        stop_button = tk.Button(
+            button_frame,
+            text="Stop",
+            command=self.stop_playback,
+            height=2,
+            font=("Arial", 14)
+        )
+        stop_button.pack(side="left", padx=6)
+
         help_label = tk.Label(
             self,
             text="Double click: add note\nClick: modify accidental\nRight click: delete note",
@@ -742,11 +774,14 @@ class MarkovUI(tk.Frame):
     def seq_to_abc(self, seq):
         abc = []
 
-        for note in seq:
-            if not note.startswith("NOTE_"):
+        for token in seq:
+            if vocabulary.is_rest(token):
+                abc.append("z")
+                continue
+
+            midi = vocabulary.pitch_of(token)
+            if midi is None:
                 continue
-            
-            midi = int(note.split("_")[1])
 
             # Convert MIDI to ABC pitch name
             names = ["C", "^C", "D", "^D", "E", "F", "^F", "G", "^G", "A", "^A", "B"]
@@ -770,13 +805,16 @@ class MarkovUI(tk.Frame):
         required = self.order_selector.get_value()
         user_notes = len(self.staff.get_seed_notes())
 
-        if user_notes >= required:
+        if self._pending is not None:
+            self.generate_button.config(state="disabled")
+        elif user_notes >= required:
             self.generate_button.config(state="normal")
         else:
             self.generate_button.config(state="disabled")
 
     def reset_staff(self):
         """Remove all notes from the staff (user and generated)."""
+        self.cancel_generation()
         for idx, slot in enumerate(self.staff.slots):
             self.staff._delete_note_in_slot(idx)
         self.staff.redraw()
@@ -790,16 +828,15 @@ class MarkovUI(tk.Frame):
             return
 
         seq = self.last_generated_seq
-        print("[AUDIO] Playing:", seq)
-
-        # Convert NOTE_XX → MIDI integer
-        midi_list = [int(n.split("_")[1]) for n in seq]
-
-        threading.Thread(
-            target=play_midi_sequence,
-            args=(midi_list,),
-            daemon=True
-        ).start()
+        print("[AUDIO] Playing:", vocabulary.decode_sequence(seq))
+
+        # Notes play for their duration, rests are silent, END is skipped.
+        # The stream renders audio in its own callback, so this returns at once.
+        self.stop_playback()
+        try:
+            self.player = play_tokens(seq)
+        except Exception as e:  # no audio device, PortAudio errors...
+            print(f"[AUDIO] Playback failed: {e}")
  
     
     def sync_seed_notes(self):
@@ -833,28 +870,64 @@ class MarkovUI(tk.Frame):
         print(f"Chain Order: {order}")
         print(f"Measures: {measures}")
         print(f"Tonality: {tonality}")
-        print(f"Seed notes (left->right): {seed}")
+        print(f"Seed notes (left->right): {vocabulary.decode_sequence(seed)}")
         print("========================")
 
-        # -------------------------
-        # Placeholder generation behavior:
-        # You said: "at generation time write in staff (in reverse) so that if output is NOTE_60, NOTE_67
-        # they get drawn left->right as C, then G" — for demo we'll take the seed, reverse it as the generated
-        # output, and draw it into empty slots.
-        # Replace this block with a call to your markov_generator(seed, order, measures, tonality)
-        # which should return a list like ["NOTE_60","NOTE_67", ...]
-        # -------------------------
-        
-        if seed:
-            seq = generate_sequence(
-                order=order,
-                seed=seed,
-                measures=measures,
-                key=tonality
-            )
-        else:
-            seq = []
+        # Generate on the worker thread: the window stays responsive while
+        # a model loads; show_generated() runs on the Tk thread afterwards
+        self.start_generation(order, list(seed), measures, tonality)
+
+    def start_generation(self, order, seed, measures, tonality):
+        """Dispatch generate_sequence to the worker and poll for its result."""
+        self.cancel_generation()
+        self._generation_id += 1
+        self._pending = self._executor.submit(
+            generate_sequence,
+            order=order,
+            seed=seed,
+            measures=measures,
+            key=tonality,
+            backoff=True
+        )
+        self._set_busy(True)
+        self.after(GENERATION_POLL_MS, self._poll_generation, self._generation_id, self._pending, order)
 
+    def _poll_generation(self, generation_id, future, order):
+        """Runs on the Tk thread: wait for the request, ignoring cancelled ones."""
+        if generation_id != self._generation_id:
+            return  # stale: order/measures changed or a newer request started
+
+        if not future.done():
+            self.after(GENERATION_POLL_MS, self._poll_generation, generation_id, future, order)
+            return
+
+        self._pending = None
+        self._set_busy(False)
+        try:
+            seq = future.result()
+        except Exception as e:
+            print(f"[ERROR] Generation failed: {e}")
+            self.staff._flash_message(f"Generation failed: {e}")
+            return
+
+        self.show_generated(seq, order)
+
+    def cancel_generation(self):
+        """Drop the pending request (a running generation finishes but is ignored)."""
+        if self._pending is None:
+            return
+        self._pending.cancel()
+        self._pending = None
+        self._generation_id += 1
+        self._set_busy(False)
+
+    def _set_busy(self, busy):
+        """Busy indicator on the Generate button."""
+        self.generate_button.config(text="Generating..." if busy else "Generate with Markov")
+        self.update_generate_button()
+
+    def show_generated(self, seq, order):
+        """Write a generated sequence into the staff and the ABC box."""
         # clear previously generated notes (if any)
         self.staff.clear_generated_notes()
 
@@ -868,12 +941,11 @@ class MarkovUI(tk.Frame):
         self.abc_box.delete("1.0", tk.END)
         self.abc_box.insert(tk.END, abc_str)
 
-        print(f"[DEBUG] Demo generated notes: {seq}")
-
-        order = self.order_selector.get_value()
+        print(f"[DEBUG] Demo generated notes: {vocabulary.decode_sequence(seq)}")
 
-        # Remove only the seed notes (first 'order' notes)
-        generated_only = seq[order:]
+        # Remove only the seed notes (first 'order' notes); the staff has one
+        # slot per note, so only the pitches of the generated tokens are drawn
+        generated_only = [vocabulary.pitch_of(t) for t in seq[order:] if vocabulary.pitch_of(t) is not None]
 
         # Limit to available slots
         generated_only = generated_only[:free_slots]
@@ -881,6 +953,29 @@ class MarkovUI(tk.Frame):
         # Draw
         self.staff.draw_generated_notes(generated_only)
 
+    def toggle_pause(self):
+        """Pause or resume the sequence being played."""
+        if self.player is None or self.player.finished.is_set():
+            return
+        if self.player.paused:
+            self.player.resume()
+            self.pause_button.config(text="Pause")
+        else:
+            self.player.pause()
+            self.pause_button.config(text="Resume")
+
+    def stop_playback(self):
+        """Stop the sequence being played, if any."""
+        if self.player is not None:
+            self.player.stop()
+            self.player = None
+        self.pause_button.config(text="Pause")
+
+    def destroy(self):
+        self.stop_playback()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().destroy()
+
 
     def update_accidentals(self, event=None):
         """Disable '#' when the selected note is B or E."""